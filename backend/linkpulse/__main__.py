@@ -4,9 +4,13 @@ command-line interface (CLI) commands to serve the application, run migrations,
 or start a REPL (Read-Eval-Print Loop) session.
 
 Commands:
-- serve: Starts the application server using Uvicorn.
-- migrate: Runs database migrations.
+- serve: Starts the application server (Hypercorn or Uvicorn, with any number of workers), see `linkpulse.server`.
+- migrate: Runs database migrations; `--apply-all` applies pending ones without prompts, `--lint` checks them for
+  blocking locks on large tables, see `linkpulse.migrate`.
 - repl: Starts an interactive Python shell with pre-imported objects and models.
+- bench: Benchmarks the API's hot paths against the database, see `linkpulse.benchmarks.api`.
+- startup-profile: Reports per-module import time & time to first request, see `linkpulse.benchmarks.startup`.
+- users: Imports or exports users in bulk through `COPY`, see `linkpulse.users`.
 """
 
 from linkpulse.logging import setup_logging
@@ -14,7 +18,6 @@ from linkpulse.logging import setup_logging
 # We want to setup logging as early as possible.
 setup_logging()
 
-import os
 import sys
 
 import structlog
@@ -29,25 +32,9 @@ def main(*args: str) -> None:
     :type args: str"""
 
     if args[0] == "serve":
-        from linkpulse.utilities import is_development
-        from uvicorn import run
-
-        logger.debug("Invoking uvicorn.run")
-
-        run(
-            "linkpulse.app:app",
-            reload=is_development,
-            host="0.0.0.0" if is_development else "::",
-            port=int(os.getenv("PORT", "8000")),
-            log_config={
-                "version": 1,
-                "disable_existing_loggers": False,
-                "loggers": {
-                    "uvicorn": {"propagate": True},
-                    "uvicorn.access": {"propagate": True},
-                },
-            },
-        )
+        from linkpulse.server import ServeOptions, serve
+
+        serve(ServeOptions.parse(args[1:]))
 
     elif args[0] == "migrate":
         from linkpulse.migrate import main
@@ -68,6 +55,18 @@ def main(*args: str) -> None:
         from bpython import embed  # type: ignore
 
         embed(locals())
+    elif args[0] == "bench":
+        from linkpulse.benchmarks.api import main
+
+        sys.exit(main(*args[1:]))
+    elif args[0] == "startup-profile":
+        from linkpulse.benchmarks.startup import main
+
+        main(*args[1:])
+    elif args[0] == "users":
+        from linkpulse.users import main
+
+        main(*args[1:])
     else:
         raise ValueError("Unexpected command: {}".format(" ".join(args)))
 
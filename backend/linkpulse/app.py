@@ -1,54 +1,202 @@
+import os
 from contextlib import asynccontextmanager
-from typing import AsyncIterator
+from datetime import datetime
+from typing import TYPE_CHECKING, AsyncIterator, Optional
 
 import structlog
-from apscheduler.schedulers.background import BackgroundScheduler  # type: ignore
-from apscheduler.triggers.interval import IntervalTrigger  # type: ignore
 from asgi_correlation_id import CorrelationIdMiddleware
 from dotenv import load_dotenv
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, status
 from fastapi.responses import ORJSONResponse
 from fastapi_cache import FastAPICache
-from fastapi_cache.backends.inmemory import InMemoryBackend
-from linkpulse.logging import setup_logging
-from linkpulse.middleware import LoggingMiddleware
+from linkpulse.buffer import last_used_buffer
+from linkpulse.cache import session_cache
+from linkpulse.database import db_executor, run_db
+from linkpulse.hashing import HashingPoolSaturated, hashing_pool
+from linkpulse.health import readiness
+from linkpulse.logging import flush_logs, setup_logging
+from linkpulse.metrics import Snapshot, gauges, registry
+from linkpulse.middleware import LoggingMiddleware, MetricsMiddleware
+from linkpulse.ratelimit import rate_limit_storage
+from linkpulse.reaper import session_reaper
+from linkpulse.response_cache import response_cache
 from linkpulse.utilities import get_db, is_development
+from peewee import InterfaceError, OperationalError
+from playhouse.pool import MaxConnectionsExceeded
 
 load_dotenv(dotenv_path=".env")
 
 from linkpulse import models  # type: ignore
 
+if TYPE_CHECKING:
+    from apscheduler.schedulers.background import BackgroundScheduler  # type: ignore
+
 db = get_db()
 
 
-scheduler = BackgroundScheduler()
+# Created by the lifespan, so apscheduler is only imported once the app starts
+scheduler: Optional["BackgroundScheduler"] = None
+
+
+def _reset_scheduler() -> None:
+    # A scheduler started in the parent has no threads in a forked child; each worker starts its own in the lifespan
+    global scheduler
+    scheduler = None
+
+
+os.register_at_fork(after_in_child=_reset_scheduler)
+
+
+def start_scheduler() -> "BackgroundScheduler":
+    """
+    Create & start the scheduler running the application's periodic jobs.
+    """
+    from apscheduler.schedulers.background import BackgroundScheduler  # type: ignore
+    from apscheduler.triggers.interval import IntervalTrigger  # type: ignore
+
+    scheduler = BackgroundScheduler()
+    scheduler.add_job(
+        last_used_buffer.flush,
+        IntervalTrigger(seconds=last_used_buffer.flush_interval),
+        id="flush_last_used",
+        replace_existing=True,
+    )
+    # Also run immediately, opening the pool's minimum connections in the background rather than delaying startup
+    scheduler.add_job(
+        db.maintain,
+        IntervalTrigger(seconds=float(os.getenv("DB_POOL_MAINTENANCE_INTERVAL", "30"))),
+        id="maintain_db_pool",
+        replace_existing=True,
+        next_run_time=datetime.now(),
+    )
+    scheduler.add_job(
+        session_reaper.run,
+        IntervalTrigger(seconds=session_reaper.interval),
+        id="reap_expired_sessions",
+        replace_existing=True,
+    )
+    scheduler.add_job(
+        rate_limit_storage.evict,
+        IntervalTrigger(seconds=float(os.getenv("RATE_LIMIT_EVICT_INTERVAL", "60"))),
+        id="evict_rate_limits",
+        replace_existing=True,
+    )
+    if registry.directory is not None:
+        scheduler.add_job(
+            registry.write_snapshot,
+            IntervalTrigger(seconds=float(os.getenv("METRICS_WRITE_INTERVAL", "15"))),
+            id="write_metrics",
+            replace_existing=True,
+        )
+    scheduler.start()
+    return scheduler
+
+
+async def check_scheduler() -> Optional[str]:
+    if scheduler is None or not scheduler.running:
+        return "not running"
+    return None
+
+
+readiness.register("scheduler", check_scheduler)
+
+
+def collect_stats() -> Snapshot:
+    """
+    Expose the statistics of the caches, database & hashing pools and readiness probe as metrics.
+    """
+    pool = db.stats()
+    # Averages & maximums can't be summed across workers
+    pool = {key: value for key, value in pool.items() if not key.startswith("checkout_time")}
+    return {
+        **gauges("linkpulse_session_cache", "Session cache statistics", session_cache.stats()),
+        **gauges("linkpulse_response_cache", "API response cache statistics", response_cache.stats()),
+        **gauges("linkpulse_db_pool", "Database connection pool statistics", pool),
+        **gauges(
+            "linkpulse_hashing_pool",
+            "Password hashing pool statistics",
+            {"in_flight": hashing_pool.in_flight, "rejected": hashing_pool.rejected},
+        ),
+        **gauges(
+            "linkpulse_readiness",
+            "Readiness check statistics",
+            {"runs": readiness.runs, "failures": readiness.failures},
+        ),
+    }
+
+
+registry.register_collector(collect_stats)
 
 
 @asynccontextmanager
 async def lifespan(_: FastAPI) -> AsyncIterator[None]:
-    # Connect to database, ensure specific tables exist
-    db.connect()
-    db.create_tables([models.User, models.Session])
+    global scheduler
 
-    FastAPICache.init(backend=InMemoryBackend(), prefix="fastapi-cache", cache_status_header="X-Cache")
+    if os.getenv("MIGRATE_ON_STARTUP", "false").lower() == "true":
+        from linkpulse.migrate import apply_all
 
-    scheduler.start()
+        # Every worker & replica waits here until one of them has migrated; a failed migration aborts startup
+        await run_db(apply_all)
+
+    # Ensure specific tables exist
+    with db.connection_context():
+        db.create_tables([models.User, models.Session])
+
+    FastAPICache.init(backend=response_cache, prefix="fastapi-cache", cache_status_header="X-Cache")
+
+    scheduler = start_scheduler()
 
     yield
 
     scheduler.shutdown()
+    scheduler = None
+    response_cache.close()
+    readiness.close()
+    # Anything buffered since the last scheduled flush would otherwise be lost
+    last_used_buffer.flush()
+    db_executor.shutdown()
+    hashing_pool.shutdown()
+    logger.info("Session cache stats", **session_cache.stats())
 
     if not db.is_closed():
         db.close()
+    logger.info("Database pool stats", **db.stats())
+    db.close_idle()
+
+    registry.write_snapshot(final=True)
+    flush_logs()
 
 
 from linkpulse.routers import auth, misc
 
-# TODO: Apply migrations on startup in production environments
 app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 app.include_router(auth.router)
 app.include_router(misc.router)
 
+
+@app.exception_handler(HashingPoolSaturated)
+async def hashing_pool_saturated_handler(_: Request, exc: HashingPoolSaturated) -> ORJSONResponse:
+    return ORJSONResponse(
+        {"detail": "Service Unavailable"},
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+@app.exception_handler(OperationalError)
+@app.exception_handler(InterfaceError)
+@app.exception_handler(MaxConnectionsExceeded)
+async def database_unavailable_handler(_: Request, exc: Exception) -> ORJSONResponse:
+    # The next readiness probe re-checks the database, rather than reporting a cached success
+    readiness.invalidate()
+    logger.error("Database unavailable", error=f"{type(exc).__name__}: {exc}")
+    return ORJSONResponse(
+        {"detail": "Service Unavailable"},
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={"Retry-After": "1"},
+    )
+
+
 setup_logging()
 
 logger = structlog.get_logger()
@@ -70,5 +218,6 @@ if is_development:
     )
     logger.info("CORS Enabled", origins=origins)
 
+app.add_middleware(MetricsMiddleware)
 app.add_middleware(LoggingMiddleware)
 app.add_middleware(CorrelationIdMiddleware)
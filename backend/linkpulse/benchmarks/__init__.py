@@ -0,0 +1 @@
+"""Benchmarks for the LinkPulse backend. Each module is runnable via `python -m linkpulse.benchmarks.<name>`."""
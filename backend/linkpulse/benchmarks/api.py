@@ -0,0 +1,285 @@
+"""Load test of the API's hot paths, against the real application & database.
+
+Requests are sent through the ASGI interface by concurrent clients (no sockets), with the app's lifespan running, so the
+session cache, hashing pool, database pool & scheduler all behave as they do when served. For each scenario this
+reports requests/second, latency percentiles and database queries per request (including deferred writes, such as the
+`last_used` buffer, which is flushed before counting stops).
+
+`DATABASE_URL` must point at a local, disposable Postgres: benchmark users & sessions are created, then deleted.
+
+Results can be saved as JSON, and compared against a previous run's results; regressions beyond the threshold are
+logged, and make the command exit with a non-zero status.
+
+Usage:
+    python -m linkpulse bench [--concurrency N] [--requests N] [--scenarios login,session,...]
+                              [--output PATH] [--baseline PATH] [--threshold FRACTION]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import secrets
+import statistics
+import sys
+import time
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+import structlog
+from linkpulse.app import app
+from linkpulse.buffer import last_used_buffer
+from linkpulse.database import QueryCounter
+from linkpulse.hashing import hasher
+from linkpulse.models import Session, User
+from linkpulse.utilities import get_db, utc_now
+
+logger = structlog.get_logger()
+
+db = get_db()
+
+PASSWORD = "benchmark-password"
+
+
+@dataclass
+class Fixture:
+    """The users & sessions requests are made with. Each concurrent client has its own user & session."""
+
+    users: List[User] = field(default_factory=list)
+    sessions: List[str] = field(default_factory=list)
+    # Sessions consumed one per request, by logout
+    disposable: List[str] = field(default_factory=list)
+
+    def create(self, concurrency: int, disposable: int) -> None:
+        password_hash = hasher.hash(PASSWORD)
+        suffix = secrets.token_hex(4)
+        expiry = utc_now() + timedelta(hours=1)
+
+        with db.connection_context(), db.atomic():
+            self.users = [
+                User.create(email=f"bench-{i}-{suffix}@example.com", password_hash=password_hash)
+                for i in range(concurrency)
+            ]
+            self.sessions = [Session.generate_token() for _ in range(concurrency)]
+            self.disposable = [Session.generate_token() for _ in range(disposable)]
+
+            rows = [
+                {"token": token, "user": self.users[i % concurrency], "expiry": expiry}
+                for i, token in enumerate(self.sessions + self.disposable)
+            ]
+            for start in range(0, len(rows), 1000):
+                Session.insert_many(rows[start : start + 1000]).execute()
+
+    def delete(self) -> None:
+        with db.connection_context():
+            Session.delete().where(Session.user.in_(self.users)).execute()
+            User.delete().where(User.id.in_([user.id for user in self.users])).execute()
+
+
+# A request made by client `client_index`, as the `n`th request of the scenario
+Request = Callable[[httpx.AsyncClient, Fixture, int, int], Awaitable[httpx.Response]]
+
+
+def _cookie(token: str) -> Dict[str, str]:
+    # An explicit header takes precedence over the client's cookie jar, which collects login cookies
+    return {"Cookie": f"session={token}"}
+
+
+async def _login(client: httpx.AsyncClient, fixture: Fixture, index: int, n: int) -> httpx.Response:
+    # The rate limiter still runs, but with a distinct key per request it never rejects one
+    return await client.post(
+        "/api/login",
+        json={"email": fixture.users[index].email, "password": PASSWORD},
+        headers={"X-Real-IP": f"benchmark-{n}"},
+    )
+
+
+async def _session(client: httpx.AsyncClient, fixture: Fixture, index: int, _: int) -> httpx.Response:
+    return await client.get("/api/session", headers=_cookie(fixture.sessions[index]))
+
+
+async def _logout(client: httpx.AsyncClient, fixture: Fixture, _: int, n: int) -> httpx.Response:
+    return await client.post("/api/logout", headers=_cookie(fixture.disposable[n]))
+
+
+async def _health(client: httpx.AsyncClient, *_: Any) -> httpx.Response:
+    return await client.get("/health")
+
+
+async def _version(client: httpx.AsyncClient, *_: Any) -> httpx.Response:
+    return await client.get("/api/version")
+
+
+SCENARIOS: Dict[str, Request] = {
+    "login": _login,
+    "session": _session,
+    "logout": _logout,
+    "health": _health,
+    "version": _version,
+}
+
+
+async def run_scenario(
+    client: httpx.AsyncClient,
+    request: Request,
+    fixture: Fixture,
+    concurrency: int,
+    requests: int,
+    offset: int = 0,
+) -> Dict[str, Any]:
+    """
+    Send `requests` requests from `concurrency` concurrent clients, returning throughput, latency & query statistics.
+
+    :param offset: Added to each request's number, so consumed fixtures (e.g. logout's sessions) aren't reused.
+    """
+    numbers = iter(range(offset, offset + requests))
+    durations: List[float] = []
+    statuses: Dict[str, int] = {}
+
+    async def worker(index: int) -> None:
+        # Every worker pulls from the same iterator, until all requests have been sent
+        for n in numbers:
+            start = time.perf_counter()
+            response = await request(client, fixture, index, n)
+            durations.append((time.perf_counter() - start) * 1000)
+            statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+
+    with QueryCounter(db) as counter:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(index) for index in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        await asyncio.to_thread(last_used_buffer.flush)
+
+    percentiles = (
+        statistics.quantiles(durations, n=100, method="inclusive") if len(durations) > 1 else durations * 99
+    )
+    return {
+        "requests": requests,
+        "errors": sum(count for status, count in statuses.items() if int(status) >= 400),
+        "statuses": statuses,
+        "rps": round(requests / elapsed, 2),
+        "p50_ms": round(percentiles[49], 3),
+        "p95_ms": round(percentiles[94], 3),
+        "p99_ms": round(percentiles[98], 3),
+        "queries_per_request": round(counter.count / requests, 3),
+    }
+
+
+async def run(scenarios: List[str], concurrency: int, requests: int, warmup: int) -> Dict[str, Any]:
+    fixture = Fixture()
+    await asyncio.to_thread(fixture.create, concurrency, (warmup + requests) if "logout" in scenarios else 0)
+
+    results = {}
+    try:
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)  # type: ignore
+            async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+                for name in scenarios:
+                    request = SCENARIOS[name]
+                    if warmup > 0:
+                        await run_scenario(client, request, fixture, concurrency, warmup)
+                    results[name] = await run_scenario(
+                        client, request, fixture, concurrency, requests, warmup
+                    )
+                    logger.info(
+                        "Benchmark scenario complete", scenario=name, concurrency=concurrency, **results[name]
+                    )
+    finally:
+        await asyncio.to_thread(fixture.delete)
+
+    return {
+        "meta": {
+            "timestamp": utc_now().isoformat(),
+            "concurrency": concurrency,
+            "requests": requests,
+            "warmup": warmup,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+        },
+        "results": results,
+    }
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[Dict[str, Any]]:
+    """
+    Compare results against a baseline, returning every metric that regressed by more than `threshold` (a fraction).
+    Any increase in queries per request is a regression, regardless of the threshold.
+    """
+    regressions = []
+    for name, current in results["results"].items():
+        previous = baseline["results"].get(name)
+        if previous is None:
+            continue
+
+        checks = [
+            ("rps", current["rps"] < previous["rps"] * (1 - threshold)),
+            ("p95_ms", current["p95_ms"] > previous["p95_ms"] * (1 + threshold)),
+            ("p99_ms", current["p99_ms"] > previous["p99_ms"] * (1 + threshold)),
+            ("queries_per_request", current["queries_per_request"] > previous["queries_per_request"] + 0.01),
+        ]
+        for metric, regressed in checks:
+            if regressed:
+                regressions.append(
+                    {
+                        "scenario": name,
+                        "metric": metric,
+                        "baseline": previous[metric],
+                        "current": current[metric],
+                    }
+                )
+    return regressions
+
+
+def main(*args: str) -> int:
+    parser = argparse.ArgumentParser(prog="linkpulse bench", description="Benchmark the API's hot paths.")
+    parser.add_argument("--concurrency", type=int, default=10, help="Concurrent clients (default: 10)")
+    parser.add_argument("--requests", type=int, default=1000, help="Requests per scenario (default: 1000)")
+    parser.add_argument(
+        "--warmup", type=int, default=50, help="Unmeasured requests per scenario (default: 50)"
+    )
+    parser.add_argument(
+        "--scenarios",
+        default=",".join(SCENARIOS),
+        help="Comma-separated scenarios to run (default: {})".format(",".join(SCENARIOS)),
+    )
+    parser.add_argument("--output", help="Write results to this JSON file")
+    parser.add_argument("--baseline", help="Compare against results previously written with --output")
+    parser.add_argument(
+        "--threshold", type=float, default=0.1, help="Allowed regression, as a fraction (default: 0.1)"
+    )
+    options = parser.parse_args(args)
+
+    scenarios = [name.strip() for name in options.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error("Unknown scenarios: {}".format(", ".join(sorted(unknown))))
+
+    # httpx logs every request at INFO
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    results = asyncio.run(run(scenarios, options.concurrency, options.requests, options.warmup))
+
+    if options.output:
+        with open(options.output, "w") as file:
+            json.dump(results, file, indent=2)
+        logger.info("Benchmark results written", path=options.output)
+
+    if options.baseline:
+        with open(options.baseline) as file:
+            baseline = json.load(file)
+
+        regressions = compare(results, baseline, options.threshold)
+        for regression in regressions:
+            logger.warning("Benchmark regression", threshold=options.threshold, **regression)
+        if regressions:
+            return 1
+        logger.info("No regressions against baseline", baseline=options.baseline)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(*sys.argv[1:]))
@@ -0,0 +1,154 @@
+"""Measures the per-request overhead of `LoggingMiddleware`.
+
+Requests are driven directly through the ASGI interface (no sockets, no database) against a trivial endpoint, with
+no middleware, the previous `BaseHTTPMiddleware`-based implementation, and the current pure ASGI implementation.
+
+Usage:
+    python -m linkpulse.benchmarks.middleware [requests]
+"""
+
+from linkpulse.logging import setup_logging
+
+setup_logging()
+
+import asyncio
+import statistics
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+import structlog
+from asgi_correlation_id import correlation_id
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import PlainTextResponse
+from linkpulse.middleware import LoggingMiddleware
+from linkpulse.utilities import is_development
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.types import ASGIApp, Message
+
+logger = structlog.get_logger()
+
+
+class LegacyLoggingMiddleware(BaseHTTPMiddleware):
+    """The `BaseHTTPMiddleware` implementation `LoggingMiddleware` replaced, kept for comparison."""
+
+    def __init__(self, app: FastAPI):
+        super().__init__(app)
+        self.access_logger = structlog.get_logger("api.access")
+
+    async def dispatch(self, request: Request, call_next) -> Response:
+        structlog.contextvars.clear_contextvars()
+        request_id = correlation_id.get()
+        structlog.contextvars.bind_contextvars(request_id=request_id)
+
+        start_time = time.perf_counter_ns()
+        response = Response(status_code=500)
+        try:
+            response = await call_next(request)
+        finally:
+            process_time_ms = "{:.2f}".format((time.perf_counter_ns() - start_time) / 10**6)
+            self.access_logger.debug(
+                "Request",
+                http={
+                    "url": str(request.url),
+                    "query": dict(request.query_params),
+                    "status_code": response.status_code,
+                    "method": request.method,
+                    "request_id": request_id,
+                    "version": request.scope["http_version"],
+                },
+                client=({"ip": request.client.host, "port": request.client.port} if request.client else None),
+                duration_ms=process_time_ms,
+            )
+            if is_development:
+                response.headers["X-Process-Time"] = process_time_ms
+            return response
+
+
+def build_app(middleware: Optional[Callable[[ASGIApp], ASGIApp]] = None) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/", response_class=PlainTextResponse)
+    async def index():
+        return "OK"
+
+    if middleware is not None:
+        app.add_middleware(middleware)  # type: ignore
+    return app
+
+
+async def measure(app: ASGIApp, requests: int) -> List[float]:
+    """
+    Send `requests` GET requests through the app, returning each request's duration in microseconds.
+    """
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/",
+        "raw_path": b"/",
+        "root_path": "",
+        "query_string": b"a=1",
+        "headers": [(b"host", b"localhost")],
+        "client": ("127.0.0.1", 50000),
+        "server": ("127.0.0.1", 8000),
+    }
+
+    async def request() -> None:
+        received = False
+        response_complete = asyncio.Event()
+
+        async def receive() -> Message:
+            nonlocal received
+            if not received:
+                received = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+            # Like uvicorn, report a disconnect once the response has been sent
+            await response_complete.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message: Message) -> None:
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                response_complete.set()
+
+        await app(dict(scope), receive, send)
+
+    # Warm up, also triggers the app's middleware stack being built
+    for _ in range(min(requests // 10, 1000)):
+        await request()
+
+    durations = []
+    for _ in range(requests):
+        start = time.perf_counter_ns()
+        await request()
+        durations.append((time.perf_counter_ns() - start) / 1000)
+    return durations
+
+
+def main(requests: int = 20000) -> Dict[str, float]:
+    variants = {
+        "none": build_app(),
+        "legacy": build_app(LegacyLoggingMiddleware),
+        "asgi": build_app(LoggingMiddleware),
+    }
+
+    medians = {}
+    for name, app in variants.items():
+        durations = asyncio.run(measure(app, requests))
+        medians[name] = statistics.median(durations)
+
+    for name in ("legacy", "asgi"):
+        logger.info(
+            "Middleware overhead",
+            middleware=name,
+            requests=requests,
+            median_us=round(medians[name], 2),
+            overhead_us=round(medians[name] - medians["none"], 2),
+        )
+    return medians
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:2]))
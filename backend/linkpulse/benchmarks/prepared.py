@@ -0,0 +1,97 @@
+"""Measures the latency prepared statements save on the hot-path queries.
+
+Each query runs on a single pooled connection three ways: built & run by peewee as before, as its registered SQL run
+unprepared (`DB_PREPARED_STATEMENTS=false`), and through its prepared statement (see `linkpulse.prepared`). All three
+read the same row; the first difference is peewee's query building, the second the server's parsing & planning.
+
+Usage:
+    python -m linkpulse.benchmarks.prepared [iterations]
+"""
+
+from linkpulse.logging import setup_logging
+
+setup_logging()
+
+import secrets
+import statistics
+import sys
+import time
+from datetime import timedelta
+from typing import Callable, Dict, List
+
+import structlog
+from linkpulse.models import Session, User
+from linkpulse.prepared import prepared_statements
+from linkpulse.utilities import get_db, utc_now
+
+logger = structlog.get_logger()
+
+
+def measure(call: Callable[[], object], iterations: int) -> List[float]:
+    """
+    Call `call` `iterations` times, returning each call's duration in microseconds.
+    """
+    # Warm up, also prepares the statements on this connection
+    for _ in range(min(iterations // 10, 100)):
+        call()
+
+    durations = []
+    for _ in range(iterations):
+        start = time.perf_counter_ns()
+        call()
+        durations.append((time.perf_counter_ns() - start) / 1000)
+    return durations
+
+
+def main(iterations: int = 2000) -> Dict[str, Dict[str, float]]:
+    db = get_db()
+    enabled = prepared_statements.enabled
+    medians: Dict[str, Dict[str, float]] = {}
+
+    with db.connection_context():
+        user = User.create(email=f"bench-{secrets.token_hex(4)}@example.com", password_hash="-")
+        expiry = utc_now() + timedelta(hours=1)
+        session = Session.create(token=Session.generate_token(), user=user, expiry=expiry)
+        try:
+            variants: Dict[str, Dict[str, Callable[[], object]]] = {
+                "session_by_token": {
+                    "peewee": lambda: Session.select(Session, User.id, User.email)
+                    .join(User)
+                    .where(Session.token == session.token)
+                    .get_or_none(),
+                    "unprepared": lambda: Session.resolve(session.token),
+                    "prepared": lambda: Session.resolve(session.token),
+                },
+                "user_by_email": {
+                    "peewee": lambda: User.get_or_none(User.email == user.email),
+                    "unprepared": lambda: User.by_email(user.email),
+                    "prepared": lambda: User.by_email(user.email),
+                },
+            }
+
+            for query, calls in variants.items():
+                medians[query] = {}
+                for name, call in calls.items():
+                    prepared_statements.enabled = name == "prepared"
+                    medians[query][name] = statistics.median(measure(call, iterations))
+
+                result = medians[query]
+                logger.info(
+                    "Prepared statement latency",
+                    query=query,
+                    iterations=iterations,
+                    **{f"{name}_us": round(median, 2) for name, median in result.items()},
+                    saved_us=round(result["peewee"] - result["prepared"], 2),
+                    saved_by_prepare_us=round(result["unprepared"] - result["prepared"], 2),
+                )
+        finally:
+            prepared_statements.enabled = enabled
+            Session.delete().where(Session.user == user).execute()
+            user.delete_instance()
+
+    logger.info("Prepared statements", **prepared_statements.stats())
+    return medians
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:2]))
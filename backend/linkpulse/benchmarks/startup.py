@@ -0,0 +1,193 @@
+"""Profiles application startup: per-module import time, and time to the first served request.
+
+Each measurement runs in a fresh interpreter, so nothing is already imported or cached:
+    - Imports are measured with `python -X importtime -c "import linkpulse.app"`, reported per `linkpulse` module and
+      per third-party package (summing the self time of its modules).
+    - Time to first request is measured in a child process that imports the app, runs its lifespan startup & serves
+      one `GET /health` over ASGI, broken down into those phases; the total includes interpreter startup.
+
+The database in `DATABASE_URL` must be reachable, as the lifespan connects to it.
+
+Usage:
+    python -m linkpulse startup-profile [--top N] [--output PATH]
+"""
+
+# Only the standard library is imported here, as the child process measures its own imports
+import argparse
+import json
+import re
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Tuple
+
+IMPORT_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$")
+
+
+def parse_importtime(output: str) -> List[Tuple[str, int, int, int]]:
+    """
+    Parse `-X importtime` output into (module, self µs, cumulative µs, depth) tuples, in import order.
+    """
+    modules = []
+    for line in output.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match is not None:
+            own, cumulative, indent, module = match.groups()
+            modules.append((module, int(own), int(cumulative), len(indent) // 2))
+    return modules
+
+
+def profile_imports(top: int) -> Dict[str, Any]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import linkpulse.app"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    modules = parse_importtime(result.stderr)
+
+    total = sum(own for _, own, _, _ in modules)
+    linkpulse = sorted(
+        (
+            (module, own, cumulative)
+            for module, own, cumulative, _ in modules
+            if module.split(".")[0] == "linkpulse"
+        ),
+        key=lambda item: item[2],
+        reverse=True,
+    )
+    packages: Dict[str, int] = {}
+    for module, own, _, _ in modules:
+        package = module.split(".")[0]
+        if package != "linkpulse":
+            packages[package] = packages.get(package, 0) + own
+
+    return {
+        "total_ms": round(total / 1000, 2),
+        "modules": len(modules),
+        "linkpulse": [
+            {"module": module, "self_ms": round(own / 1000, 2), "cumulative_ms": round(cumulative / 1000, 2)}
+            for module, own, cumulative in linkpulse[:top]
+        ],
+        "packages": [
+            {"package": package, "self_ms": round(own / 1000, 2)}
+            for package, own in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+        ],
+    }
+
+
+def _child() -> None:
+    """
+    Import the app, run its startup & serve one request, printing each phase's duration as JSON.
+    """
+    start = time.perf_counter()
+
+    import asyncio
+
+    from linkpulse.app import app
+
+    imported = time.perf_counter()
+
+    async def first_request() -> Dict[str, float]:
+        done = asyncio.Event()
+        status = 0
+
+        async def receive() -> Dict[str, Any]:
+            if not done.is_set():
+                return {"type": "http.request", "body": b"", "more_body": False}
+            return {"type": "http.disconnect"}
+
+        async def send(message: Dict[str, Any]) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                done.set()
+
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "GET",
+            "scheme": "http",
+            "path": "/health",
+            "raw_path": b"/health",
+            "root_path": "",
+            "query_string": b"",
+            "headers": [(b"host", b"localhost")],
+            "client": ("127.0.0.1", 50000),
+            "server": ("127.0.0.1", 8000),
+        }
+
+        async with app.router.lifespan_context(app):
+            started = time.perf_counter()
+            await app(scope, receive, send)
+            served = time.perf_counter()
+            # Reported before shutdown, so the parent can time the first response
+            print(json.dumps({"status": status}), flush=True)
+
+        return {
+            "import_ms": round((imported - start) * 1000, 2),
+            "startup_ms": round((started - imported) * 1000, 2),
+            "first_request_ms": round((served - started) * 1000, 2),
+        }
+
+    print(json.dumps(asyncio.run(first_request())), flush=True)
+
+
+def profile_first_request() -> Dict[str, Any]:
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "linkpulse.benchmarks.startup", "--child"],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    assert process.stdout is not None
+
+    first = json.loads(process.stdout.readline())
+    elapsed = time.perf_counter() - start
+    phases = json.loads(process.stdout.readline())
+    if process.wait() != 0:
+        raise RuntimeError(f"Startup profile failed with exit code {process.returncode}")
+
+    return {**phases, "status": first["status"], "time_to_first_request_ms": round(elapsed * 1000, 2)}
+
+
+def main(*args: str) -> Dict[str, Any]:
+    parser = argparse.ArgumentParser(
+        prog="linkpulse startup-profile", description="Profile application startup."
+    )
+    parser.add_argument("--top", type=int, default=15, help="Modules & packages to list (default: 15)")
+    parser.add_argument("--output", help="Write the profile to this JSON file")
+    options = parser.parse_args(args)
+
+    import structlog
+
+    logger = structlog.get_logger()
+
+    imports = profile_imports(options.top)
+    for entry in imports["linkpulse"]:
+        logger.info("Module import time", **entry)
+    for entry in imports["packages"]:
+        logger.info("Package import time", **entry)
+    logger.info("Total import time", total_ms=imports["total_ms"], modules=imports["modules"])
+
+    first_request = profile_first_request()
+    logger.info("Time to first request", **first_request)
+
+    profile = {"imports": imports, "first_request": first_request}
+    if options.output:
+        with open(options.output, "w") as file:
+            json.dump(profile, file, indent=2)
+        logger.info("Startup profile written", path=options.output)
+    return profile
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["--child"]:
+        _child()
+    else:
+        from linkpulse.logging import setup_logging
+
+        setup_logging()
+        main(*sys.argv[1:])
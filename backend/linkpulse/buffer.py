@@ -0,0 +1,125 @@
+"""buffer.py
+This module provides a write-behind buffer for high-frequency, low-value writes.
+
+`Session.use()` is called on nearly every authenticated request, so instead of issuing an UPDATE per request,
+the newest `last_used` timestamp per session token is kept in memory and flushed periodically in bulk.
+"""
+
+import os
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import structlog
+from linkpulse.prepared import prepared_statements
+
+logger = structlog.get_logger()
+
+# The tokens & timestamps are passed as two arrays, so batches of any size share a single prepared statement.
+# The last_used comparison guards against an older buffered value overwriting a newer one (e.g. written by another worker)
+prepared_statements.register(
+    "session_last_used",
+    'UPDATE "session" SET "last_used" = v.last_used '
+    "FROM unnest($1::varchar[], $2::timestamp[]) AS v(token, last_used) "
+    'WHERE "session"."token" = v.token '
+    'AND ("session"."last_used" IS NULL OR "session"."last_used" < v.last_used)',
+)
+
+
+class LastUsedBuffer:
+    """
+    Collects `last_used` timestamps for sessions, keeping only the newest value per token.
+
+    The buffer is flushed with a single `UPDATE ... FROM unnest(...)` statement per batch, either by the scheduler
+    (see the lifespan in `app.py`) or manually via `flush()`. It is thread-safe, as flushes happen on scheduler threads.
+    """
+
+    def __init__(self, flush_interval: Optional[float] = None, batch_size: Optional[int] = None):
+        """
+        :param flush_interval: Seconds between scheduled flushes. Defaults to `SESSION_FLUSH_INTERVAL` or 10.
+        :param batch_size: Maximum rows per UPDATE statement. Defaults to `SESSION_FLUSH_BATCH_SIZE` or 500.
+        """
+        if flush_interval is None:
+            flush_interval = float(os.getenv("SESSION_FLUSH_INTERVAL", "10"))
+        if batch_size is None:
+            batch_size = int(os.getenv("SESSION_FLUSH_BATCH_SIZE", "500"))
+
+        if flush_interval <= 0:
+            raise ValueError("flush_interval must be positive")
+        if batch_size <= 0:
+            raise ValueError("batch_size must be positive")
+
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+
+        self._pending: Dict[str, datetime] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def record(self, token: str, timestamp: datetime) -> None:
+        """
+        Record a use of the session. Older timestamps never overwrite newer ones.
+        """
+        with self._lock:
+            current = self._pending.get(token)
+            if current is None or current < timestamp:
+                self._pending[token] = timestamp
+
+    def discard(self, token: str) -> None:
+        """
+        Drop any pending update for the token, e.g. when the session is deleted.
+        """
+        with self._lock:
+            self._pending.pop(token, None)
+
+    def after_fork(self) -> None:
+        """
+        Drop pending updates in a forked child; the parent still holds (and will flush) them.
+        """
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def flush(self) -> int:
+        """
+        Write all pending timestamps to the database in batches of `batch_size`.
+
+        If a batch fails, it (and every batch after it) is merged back into the buffer to be retried on the next flush.
+
+        :return: The number of rows updated.
+        :rtype: int
+        """
+        with self._lock:
+            if len(self._pending) == 0:
+                return 0
+            pending, self._pending = self._pending, {}
+
+        items = list(pending.items())
+        updated = 0
+        for start in range(0, len(items), self.batch_size):
+            batch = items[start : start + self.batch_size]
+            try:
+                updated += self._write(batch)
+            except Exception:
+                logger.exception("Failed to flush last_used buffer", remaining=len(items) - start)
+                for token, timestamp in items[start:]:
+                    self.record(token, timestamp)
+                break
+
+        logger.debug("Flushed last_used buffer", pending=len(items), updated=updated)
+        return updated
+
+    @staticmethod
+    def _write(batch: List[Tuple[str, datetime]]) -> int:
+        # Avoid a circular import; models.py depends on this module.
+        from linkpulse.utilities import get_db
+
+        db = get_db()
+        tokens, timestamps = zip(*batch)
+        with db.connection_context():
+            return prepared_statements.execute("session_last_used", list(tokens), list(timestamps)).rowcount
+
+
+last_used_buffer = LastUsedBuffer()
+os.register_at_fork(after_in_child=last_used_buffer.after_fork)
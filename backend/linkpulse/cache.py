@@ -0,0 +1,161 @@
+"""cache.py
+This module provides small in-process caches used to avoid database round trips on hot paths.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Dict, Generic, Hashable, Optional, Tuple, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class TTLCache(Generic[K, V]):
+    """
+    A bounded, thread-safe LRU cache where every entry also has a time-to-live.
+
+    Entries are evicted in least-recently-used order once `maxsize` is reached, and are dropped lazily once expired.
+    A `maxsize` of 0 disables the cache entirely (every lookup is a miss).
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        """
+        :param maxsize: The maximum number of entries held at once.
+        :param ttl: The default number of seconds an entry is valid for.
+        """
+        if maxsize < 0:
+            raise ValueError("maxsize must not be negative")
+        if ttl <= 0:
+            raise ValueError("ttl must be positive")
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        # key -> (value, monotonic deadline)
+        self._entries: OrderedDict[K, Tuple[V, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: K) -> Optional[V]:
+        """
+        Retrieve a value, refreshing its LRU position. Returns None if missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, deadline = entry
+            if deadline <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: K, value: V, ttl: Optional[float] = None) -> None:
+        """
+        Store a value, evicting the least recently used entries if the cache is full.
+
+        :param ttl: Overrides the default TTL for this entry; it is capped at the default TTL.
+        """
+        if self.maxsize == 0:
+            return
+
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: K) -> bool:
+        """
+        Remove a single entry. Returns True if it was present.
+        """
+        with self._lock:
+            if self._entries.pop(key, None) is None:
+                return False
+            self.invalidations += 1
+            return True
+
+    def invalidate_where(self, predicate: Callable[[V], bool]) -> int:
+        """
+        Remove every entry whose value matches the predicate. This is O(n), so it's reserved for rare operations.
+
+        :return: The number of entries removed.
+        """
+        with self._lock:
+            keys = [key for key, (value, _) in self._entries.items() if predicate(value)]
+            for key in keys:
+                del self._entries[key]
+            self.invalidations += len(keys)
+            return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def after_fork(self) -> None:
+        """
+        Empty the cache in a forked child, which must not serve (or keep invalidating) the parent's entries.
+        """
+        # The lock may have been held by another thread at the time of the fork
+        self._lock = threading.Lock()
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Counters for sizing the cache. These are cumulative for the lifetime of the process.
+        """
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+
+@dataclass(frozen=True, slots=True)
+class CachedSession:
+    """
+    The subset of a validated session (and its user) needed to serve a request without a database lookup.
+    """
+
+    token: str
+    user_id: int
+    email: str
+    expiry: datetime
+
+
+# NOTE: This cache is per-process. Invalidation only reaches the process handling the logout, so other workers may
+# accept a revoked session for up to SESSION_CACHE_TTL seconds. Keep the TTL short.
+session_cache: TTLCache[str, CachedSession] = TTLCache(
+    maxsize=int(os.getenv("SESSION_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("SESSION_CACHE_TTL", "30")),
+)
+os.register_at_fork(after_in_child=session_cache.after_fork)
@@ -0,0 +1,351 @@
+"""database.py
+This module provides the database connection pool, and the execution layer for running blocking peewee queries from
+async code.
+
+peewee & psycopg2 are synchronous, so calling them directly inside an `async def` route stalls the event loop
+(and every other in-flight request) for the duration of the round trip. Instead, queries are handed off to a bounded
+thread pool and awaited. Each call checks a connection out of the pool and returns it afterwards.
+"""
+
+import asyncio
+import functools
+import heapq
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, ParamSpec, TypeVar
+from urllib.parse import urlparse
+
+import structlog
+from peewee import _ConnectionLocal
+from playhouse.db_url import parseresult_to_dict
+from playhouse.pool import MaxConnectionsExceeded, PooledDatabase, PooledPostgresqlDatabase, _sentinel
+
+logger = structlog.get_logger()
+
+P = ParamSpec("P")
+T = TypeVar("T")
+
+
+class PostgresPool(PooledPostgresqlDatabase):
+    """
+    A connection pool with health checks & recycling, on top of peewee's `PooledPostgresqlDatabase`.
+
+    Added
+        - min_connections: Idle connections opened ahead of time by `maintain()`
+        - max_idle: Connections idle longer than this are closed rather than reused
+        - ping_interval: Connections idle longer than this are pinged before reuse, so connections to a failed-over
+          primary are discarded instead of erroring on the next query
+        - Checkout statistics, see `stats()`
+
+    `max_connections`, `timeout` (checkout wait) and `stale_timeout` (maximum connection age) are peewee's own.
+    """
+
+    def __init__(
+        self,
+        database: str,
+        min_connections: int = 0,
+        max_idle: Optional[float] = None,
+        ping_interval: Optional[float] = None,
+        **kwargs: Any,
+    ):
+        self._min_connections = min_connections
+        self._max_idle = max_idle
+        self._ping_interval = ping_interval
+
+        # connection key -> time it was returned to the pool
+        self._returned_at: Dict[int, float] = {}
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.checkout_time = 0.0
+        self.checkout_time_max = 0.0
+        self.timeouts = 0
+        self.created = 0
+        self.recycled = 0
+        self.failed_pings = 0
+        # Connections inherited over fork, see `after_fork`
+        self._inherited: List[Any] = []
+
+        super().__init__(database, **kwargs)
+
+    def connect(self, reuse_if_open: bool = False) -> bool:
+        start = time.perf_counter()
+        try:
+            return super().connect(reuse_if_open)
+        except MaxConnectionsExceeded:
+            with self._stats_lock:
+                self.timeouts += 1
+            logger.warning("Timed out waiting for a database connection", **self.stats())
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._stats_lock:
+                self.checkouts += 1
+                self.checkout_time += elapsed
+                self.checkout_time_max = max(self.checkout_time_max, elapsed)
+
+    def _connect(self):
+        conn = super()._connect()
+        key = self.conn_key(conn)
+        if key not in self._returned_at:
+            self.created += 1
+        self._returned_at.pop(key, None)
+        return conn
+
+    def _raw_close(self, conn) -> None:
+        # Close the underlying connection, bypassing the pool
+        try:
+            super(PooledDatabase, self)._close(conn)
+        except Exception:
+            pass
+
+    def _is_closed(self, conn) -> bool:
+        # Called on checkout of an idle connection; returning True discards it.
+        if super()._is_closed(conn):
+            return True
+
+        idle = time.time() - self._returned_at.get(self.conn_key(conn), time.time())
+
+        if self._max_idle is not None and idle > self._max_idle:
+            self._discard(conn)
+            self.recycled += 1
+            return True
+
+        if self._ping_interval is not None and idle > self._ping_interval:
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+            except Exception:
+                logger.warning("Discarding dead database connection", idle=round(idle, 2))
+                self._discard(conn)
+                self.failed_pings += 1
+                return True
+
+        return False
+
+    def _discard(self, conn) -> None:
+        self._returned_at.pop(self.conn_key(conn), None)
+        self._raw_close(conn)
+
+    def _close(self, conn, close_conn: bool = False) -> None:
+        with self._pool_lock:
+            super()._close(conn, close_conn)
+            key = self.conn_key(conn)
+            if close_conn or not any(c is conn for _, _, c in self._connections):
+                self._returned_at.pop(key, None)
+            else:
+                self._returned_at[key] = time.time()
+
+    def maintain(self) -> None:
+        """
+        Close idle connections past `max_idle` or `stale_timeout`, then open connections up to `min_connections`.
+        Intended to be run periodically by the scheduler.
+        """
+        now = time.time()
+        with self._pool_lock:
+            keep = []
+            for ts, sentinel, conn in self._connections:
+                idle = now - self._returned_at.get(self.conn_key(conn), now)
+                expired = self._stale_timeout and self._is_stale(ts)
+                if expired or (self._max_idle is not None and idle > self._max_idle):
+                    self._discard(conn)
+                    self.recycled += 1
+                else:
+                    keep.append((ts, sentinel, conn))
+            heapq.heapify(keep)
+            self._connections = keep
+
+            missing = self._min_connections - len(self._connections) - len(self._in_use)
+            for _ in range(max(missing, 0)):
+                try:
+                    conn = super(PooledDatabase, self)._connect()
+                except Exception:
+                    logger.exception("Failed to open database connection")
+                    break
+                self.created += 1
+                self._returned_at[self.conn_key(conn)] = now
+                heapq.heappush(self._connections, (now, _sentinel(), conn))
+
+        logger.debug("Database pool stats", **self.stats())
+
+    def after_fork(self) -> None:
+        """
+        Forget the connections inherited from the parent process, so the child opens its own.
+
+        The inherited connections are deliberately not closed: they share sockets with the parent, and closing them
+        would end the parent's sessions. References are kept so they're never closed by garbage collection either.
+        """
+        self._inherited.extend(conn for _, _, conn in self._connections)
+        self._inherited.extend(pool_conn.connection for pool_conn in self._in_use.values())
+        if self._state.conn is not None:
+            self._inherited.append(self._state.conn)
+
+        # Locks may have been held by other threads at the time of the fork
+        self._pool_lock = threading.RLock()
+        self._stats_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._state = _ConnectionLocal()
+        self._connections = []
+        self._in_use = {}
+        self._returned_at = {}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            average = self.checkout_time / self.checkouts if self.checkouts else 0.0
+            return {
+                "in_use": len(self._in_use),
+                "idle": len(self._connections),
+                "max_connections": self._max_connections,
+                "checkouts": self.checkouts,
+                "checkout_time_avg_ms": round(average * 1000, 3),
+                "checkout_time_max_ms": round(self.checkout_time_max * 1000, 3),
+                "timeouts": self.timeouts,
+                "created": self.created,
+                "recycled": self.recycled,
+                "failed_pings": self.failed_pings,
+            }
+
+
+# Pool options, configurable via DATABASE_URL query parameters (e.g. `?max_connections=20`) or environment variables
+_pool_options = {
+    "min_connections": ("DB_POOL_MIN_SIZE", int, "2"),
+    "max_connections": ("DB_POOL_MAX_SIZE", int, "20"),
+    "timeout": ("DB_POOL_TIMEOUT", float, "10"),
+    "stale_timeout": ("DB_POOL_MAX_AGE", float, "3600"),
+    "max_idle": ("DB_POOL_MAX_IDLE", float, "300"),
+    "ping_interval": ("DB_POOL_PING_INTERVAL", float, "30"),
+}
+
+
+class QueryCounter:
+    """
+    Counts the queries executed against a database (from any thread) while active.
+
+    Example:
+        >>> with QueryCounter(get_db()) as counter:
+        ...     client.get("/api/session")
+        >>> counter.count
+        1
+    """
+
+    def __init__(self, database: PooledPostgresqlDatabase):
+        self.database = database
+        self.count = 0
+        self.queries: List[str] = []
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> "QueryCounter":
+        execute_sql = self.database.execute_sql
+
+        def counted(sql, params=None, *args, **kwargs):
+            with self._lock:
+                self.count += 1
+                self.queries.append(sql)
+            return execute_sql(sql, params, *args, **kwargs)
+
+        # Shadow the bound method on this instance only; peewee routes every query through execute_sql
+        self.database.execute_sql = counted  # type: ignore
+        return self
+
+    def __exit__(self, *_) -> None:
+        del self.database.execute_sql
+
+
+def create_database(url: str) -> PostgresPool:
+    """
+    Create the pooled database from a `postgres://` or `postgresql://` URL.
+    Query parameters take precedence over environment variables, which take precedence over the defaults.
+    """
+    parsed = urlparse(url)
+    if parsed.scheme.removesuffix("+pool") not in ("postgres", "postgresql"):
+        raise ValueError(f"Unsupported database scheme: {parsed.scheme}")
+
+    params = parseresult_to_dict(parsed)
+    for name, (env, cast, default) in _pool_options.items():
+        if name not in params:
+            params[name] = cast(os.getenv(env, default))
+
+    database = params.pop("database")
+    return PostgresPool(database, **params)
+
+
+class QueryExecutor:
+    """
+    A lazily-started, bounded thread pool dedicated to database work.
+
+    peewee keeps one connection per thread, so `max_workers` also bounds the number of connections this pool opens.
+    """
+
+    def __init__(self, name: str, max_workers: int):
+        """
+        :param name: Used as the thread name prefix, for debugging.
+        :param max_workers: The maximum number of threads (and therefore concurrent queries).
+        """
+        if max_workers <= 0:
+            raise ValueError("max_workers must be positive")
+
+        self.name = name
+        self.max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers, thread_name_prefix=self.name
+                    )
+                    logger.debug("Query executor started", name=self.name, max_workers=self.max_workers)
+        return self._executor
+
+    async def run(self, func: Callable[P, T], *args: P.args, **kwargs: P.kwargs) -> T:
+        """
+        Run a blocking function on the pool and await its result.
+        A database connection is checked out for the duration of the call.
+        """
+        loop = asyncio.get_running_loop()
+        call = functools.partial(_with_connection, func, *args, **kwargs)
+        return await loop.run_in_executor(self._get_executor(), call)
+
+    def after_fork(self) -> None:
+        """
+        Drop the executor inherited from the parent process; its threads don't exist in the child.
+        """
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def shutdown(self) -> None:
+        """
+        Wait for queued work to finish and stop the pool. It will be restarted on the next `run()`.
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+
+        if executor is not None:
+            executor.shutdown(wait=True)
+            logger.debug("Query executor stopped", name=self.name)
+
+
+def _with_connection(func: Callable[P, T], *args: P.args, **kwargs: P.kwargs) -> T:
+    from linkpulse.utilities import get_db
+
+    with get_db().connection_context():
+        return func(*args, **kwargs)
+
+
+db_executor = QueryExecutor("db", max_workers=int(os.getenv("DB_THREADS", "8")))
+os.register_at_fork(after_in_child=db_executor.after_fork)
+
+
+async def run_db(func: Callable[P, T], *args: P.args, **kwargs: P.kwargs) -> T:
+    """
+    Run a blocking database call on the default query executor.
+
+    Group related queries into a single function where possible, as each call is a separate thread hop.
+
+    Example:
+        >>> user = await run_db(User.get_or_none, User.email == email)
+    """
+    return await db_executor.run(func, *args, **kwargs)
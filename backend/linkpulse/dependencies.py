@@ -1,24 +1,51 @@
+import asyncio
+import functools
+import math
 import os
-from dataclasses import dataclass
+import time
+from typing import TYPE_CHECKING, Optional
 
 import structlog
 from fastapi import HTTPException, Request, Response, status
-from limits import parse
-from limits.aio.storage import MemoryStorage
-from limits.aio.strategies import MovingWindowRateLimiter
+from linkpulse.cache import session_cache
+from linkpulse.database import run_db
 from linkpulse.models import Session
+from linkpulse.ratelimit import RateLimitStorage, rate_limit_storage
+from linkpulse.tokens import SignedSession, is_signed, session_signer
+from linkpulse.utilities import utc_now
 
-storage = MemoryStorage()
-strategy = MovingWindowRateLimiter(storage)
+if TYPE_CHECKING:
+    from limits import RateLimitItem
 
 logger = structlog.get_logger()
 is_pytest = os.environ.get("PYTEST_VERSION") is not None
 
 
 class RateLimiter:
-    def __init__(self, limit: str):
-        self.limit = parse(limit)
-        self.retry_after = str(self.limit.get_expiry())
+    """
+    Limits requests per client IP, using GCRA (see `linkpulse.ratelimit`).
+
+    Limits use the `limits` syntax, e.g. "6/minute": a burst of 6 requests is allowed, then one every 10 seconds.
+    """
+
+    def __init__(self, limit: str, storage: Optional[RateLimitStorage] = None):
+        # Parsed on first use, as importing `limits` is slow
+        self._limit = limit
+        self.storage = storage if storage is not None else rate_limit_storage
+
+    @functools.cached_property
+    def limit(self) -> "RateLimitItem":
+        from limits import parse
+
+        return parse(self._limit)
+
+    @functools.cached_property
+    def period(self) -> float:
+        return float(self.limit.get_expiry())
+
+    @functools.cached_property
+    def interval(self) -> float:
+        return self.period / self.limit.amount
 
     async def __call__(self, request: Request, response: Response):
         key = request.headers.get("X-Real-IP")
@@ -34,20 +61,47 @@ class RateLimiter:
             # The reason for this is so tests don't compete with each other for rate limiting
             key += "." + os.environ["PYTEST_CURRENT_TEST"]
 
-        if not await strategy.hit(self.limit, key):
-            logger.warning("Rate limit exceeded", key=key)
+        hit = functools.partial(
+            self.storage.hit, self.limit.key_for(key), self.interval, self.period, time.time()
+        )
+        # Shared storage can wait on other workers' locks, which would stall every request on the event loop
+        retry_after = await asyncio.to_thread(hit) if self.storage.blocking else hit()
+        if retry_after > 0:
+            logger.warning("Rate limit exceeded", key=key, retry_after=retry_after)
             raise HTTPException(
                 status_code=status.HTTP_429_TOO_MANY_REQUESTS,
                 detail="Too Many Requests",
-                headers={"Retry-After": self.retry_after},
+                headers={"Retry-After": str(math.ceil(retry_after))},
             )
         return True
 
 
+def _resolve_session(token: str) -> Optional[Session]:
+    """
+    Fetch a session & its user, revoking it if expired. Blocking; run via `run_db`.
+    """
+    session = Session.resolve(token)
+
+    # This doesn't differentiate between expired or completely invalid sessions
+    if session is None or session.is_expired(revoke=True):
+        return None
+    return session
+
+
 class SessionDependency:
     def __init__(self, required: bool = False):
         self.required = required
 
+    def _reject(self, response: Response, session_token: str) -> None:
+        if self.required:
+            logger.debug("Session Cookie Revoked", token=session_token)
+            response.delete_cookie("session")
+            headers = {"set-cookie": response.headers["set-cookie"]}
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized", headers=headers
+            )
+        return None
+
     async def __call__(self, request: Request, response: Response):
         session_token = request.cookies.get("session")
 
@@ -58,18 +112,36 @@ class SessionDependency:
                 raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
             return None
 
+        claims = None
+        if is_signed(session_token):
+            # Forged, expired & unverifiable cookies are rejected without touching the cache or database
+            claims = session_signer.verify(session_token) if session_signer is not None else None
+            if claims is None:
+                return self._reject(response, session_token)
+            session_token = claims.token
+
+        # Serve recently validated sessions from the cache; expired entries fall through so they get revoked below
+        cached = session_cache.get(session_token)
+        if cached is not None:
+            session = Session.from_cache(cached)
+            if not session.is_expired(revoke=False):
+                return self._check_claims(response, session, claims)
+
         # Get session from database
-        session = Session.get_or_none(Session.token == session_token)
+        session = await run_db(_resolve_session, session_token)
 
-        # This doesn't differentiate between expired or completely invalid sessions
-        if session is None or session.is_expired(revoke=True):
-            if self.required:
-                logger.debug("Session Cookie Revoked", token=session_token)
-                response.delete_cookie("session")
-                headers = {"set-cookie": response.headers["set-cookie"]}
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized", headers=headers
-                )
-            return None
+        if session is None:
+            return self._reject(response, session_token)
+
+        # Never cache a session past its expiry
+        remaining = (session.expiry_utc - utc_now()).total_seconds()
+        session_cache.set(session_token, session.to_cache(), ttl=remaining)
+
+        return self._check_claims(response, session, claims)
 
+    def _check_claims(self, response: Response, session: Session, claims: Optional[SignedSession]):
+        # Only a leaked signing key could produce a valid signature over another user's token
+        if claims is not None and session.user_id != claims.user_id:  # type: ignore
+            logger.warning("Signed session user mismatch", token=claims.token, user_id=claims.user_id)
+            return self._reject(response, claims.token)
         return session
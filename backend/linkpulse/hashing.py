@@ -0,0 +1,143 @@
+"""hashing.py
+This module provides password hashing & verification, offloaded from the event loop to a bounded worker pool.
+
+Argon2 (m=65536, t=3, p=4) costs tens of milliseconds of CPU per call. argon2-cffi releases the GIL while hashing,
+so a thread pool sized to the available cores runs hashes in parallel without the pickling & fork concerns of a
+process pool. Admission is bounded: once every worker is busy and the queue is full, callers are rejected immediately
+with `HashingPoolSaturated` (served as a 503 with `Retry-After`) instead of piling up behind a login burst.
+"""
+
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Callable, Optional, Tuple, TypeVar
+
+import structlog
+
+if TYPE_CHECKING:
+    from pwdlib import PasswordHash
+
+logger = structlog.get_logger()
+
+T = TypeVar("T")
+
+
+@functools.cache
+def get_hasher() -> "PasswordHash":
+    from pwdlib import PasswordHash
+    from pwdlib.hashers.argon2 import Argon2Hasher
+
+    return PasswordHash([Argon2Hasher()])
+
+
+def __getattr__(name: str) -> Any:
+    # `hasher` is created on first use, as importing pwdlib & argon2 is slow
+    if name == "hasher":
+        return get_hasher()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# A valid hash of an unknown password, verified against when a user doesn't exist to prevent timing attacks.
+# cspell: disable
+dummy_hash = (
+    "$argon2id$v=19$m=65536,t=3,p=4$Ii3hm5/NqcJddQDFK24Wtw$I99xV/qkaLROo0VZcvaZrYMAD9RTcWzxY5/RbMoRLQ4"
+)
+
+
+class HashingPoolSaturated(Exception):
+    """
+    Raised when the hashing pool cannot accept more work.
+    """
+
+    def __init__(self, retry_after: int):
+        super().__init__("Hashing pool is saturated")
+        self.retry_after = retry_after
+
+
+class HashingPool:
+    """
+    A bounded worker pool for password hashing.
+
+    At most `max_workers + max_queue` calls may be in flight (running or waiting) at once.
+    All calls must be made from the event loop thread, as the in-flight counter is not locked.
+    """
+
+    def __init__(self, max_workers: int, max_queue: int, retry_after: int = 1):
+        """
+        :param max_workers: The number of hashing threads, ideally the number of available cores.
+        :param max_queue: The number of calls allowed to wait for a free worker before rejecting new ones.
+        :param retry_after: Seconds suggested to rejected clients via `Retry-After`.
+        """
+        if max_workers <= 0:
+            raise ValueError("max_workers must be positive")
+        if max_queue < 0:
+            raise ValueError("max_queue must not be negative")
+
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+
+        self.in_flight = 0
+        self.rejected = 0
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    async def _run(self, func: Callable[..., T], *args) -> T:
+        if self.in_flight >= self.max_workers + self.max_queue:
+            self.rejected += 1
+            logger.warning("Hashing pool saturated", in_flight=self.in_flight, rejected=self.rejected)
+            raise HashingPoolSaturated(self.retry_after)
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="hash")
+
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(func, *args))
+        finally:
+            self.in_flight -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(get_hasher().hash, password)
+
+    async def verify(self, password: str, hash: str) -> bool:
+        return await self._run(get_hasher().verify, password, hash)
+
+    async def verify_and_update(self, password: str, hash: str) -> Tuple[bool, Optional[str]]:
+        return await self._run(get_hasher().verify_and_update, password, hash)
+
+    async def verify_dummy(self, password: str) -> None:
+        """
+        Spend the same time as a real verification, for when the user doesn't exist.
+
+        This goes through the same admission check & queue as `verify_and_update`, so neither the timing nor a 503 reveals
+        whether the account exists.
+        """
+        await self._run(get_hasher().verify_and_update, password, dummy_hash)
+
+    def after_fork(self) -> None:
+        # The parent's threads (and the calls they were running) don't exist in the child
+        self._executor = None
+        self.in_flight = 0
+
+    def shutdown(self) -> None:
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+def _available_cores() -> int:
+    # Respects CPU affinity (e.g. container limits via cpusets) where supported
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+_workers = int(os.getenv("HASH_WORKERS", "0")) or _available_cores()
+hashing_pool = HashingPool(
+    max_workers=_workers,
+    max_queue=int(os.getenv("HASH_QUEUE_SIZE", str(_workers * 4))),
+    retry_after=int(os.getenv("HASH_RETRY_AFTER", "1")),
+)
+os.register_at_fork(after_in_child=hashing_pool.after_fork)
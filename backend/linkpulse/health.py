@@ -0,0 +1,153 @@
+"""health.py
+This module provides the readiness probe behind `/health/ready`.
+
+Liveness (`/health`, `/health/live`) only shows the process is serving requests; readiness also checks its
+dependencies: database connectivity, pending migrations and the scheduler. A failing readiness check answers `503`,
+so load balancers take the instance out of rotation.
+
+Probes arrive often and from several load balancers at once, so the result is cached for `READINESS_CACHE_TTL`
+seconds and concurrent probes share a single check. Database errors seen while serving requests invalidate the
+cached result, so the next probe re-checks immediately instead of reporting a stale success.
+"""
+
+import asyncio
+import os
+import re
+import time
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import structlog
+from linkpulse.database import run_db
+from linkpulse.utilities import get_db
+
+logger = structlog.get_logger()
+
+MIGRATIONS_DIR = Path(__file__).parent / "migrations"
+
+# A check returns None when healthy, otherwise the reason it isn't; exceptions count as failures
+Check = Callable[[], Awaitable[Optional[str]]]
+
+
+class ReadinessProbe:
+    """
+    Runs the registered checks concurrently, caching & coalescing the combined result.
+    """
+
+    def __init__(self, ttl: float, timeout: float):
+        """
+        :param ttl: Seconds a result is reused for.
+        :param timeout: Seconds each check may take before it counts as failed.
+        """
+        if ttl < 0:
+            raise ValueError("ttl must not be negative")
+        if timeout <= 0:
+            raise ValueError("timeout must be positive")
+
+        self.ttl = ttl
+        self.timeout = timeout
+        self.checks: Dict[str, Check] = {}
+
+        self._result: Optional[Tuple[bool, Dict[str, str]]] = None
+        self._checked_at = 0.0
+        self._task: Optional[asyncio.Task[Tuple[bool, Dict[str, str]]]] = None
+
+        self.runs = 0
+        self.failures = 0
+
+    def register(self, name: str, check: Check) -> None:
+        self.checks[name] = check
+
+    async def _run_check(self, check: Check) -> Optional[str]:
+        try:
+            return await asyncio.wait_for(check(), self.timeout)
+        except asyncio.TimeoutError:
+            return f"timed out after {self.timeout}s"
+        except Exception as exc:
+            return f"{type(exc).__name__}: {exc}"
+
+    async def _run(self) -> Tuple[bool, Dict[str, str]]:
+        try:
+            names = list(self.checks)
+            reasons = await asyncio.gather(*(self._run_check(self.checks[name]) for name in names))
+            results = {name: reason or "ok" for name, reason in zip(names, reasons)}
+            ready = not any(reasons)
+
+            self.runs += 1
+            if not ready:
+                self.failures += 1
+                logger.warning("Readiness check failed", **results)
+
+            self._result, self._checked_at = (ready, results), time.monotonic()
+            return ready, results
+        finally:
+            self._task = None
+
+    async def check(self) -> Tuple[bool, Dict[str, str]]:
+        """
+        :return: Whether every check passed, and each check's result (`ok` or the reason it failed).
+        """
+        if self._result is not None and time.monotonic() - self._checked_at < self.ttl:
+            return self._result
+
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="readiness-check")
+        # Shielded, so a probe disconnecting doesn't cancel the check the others are waiting on
+        return await asyncio.shield(self._task)
+
+    def invalidate(self) -> None:
+        """
+        Discard the cached result, so the next probe checks again.
+        """
+        self._result = None
+
+    def close(self) -> None:
+        """
+        Cancel a check in progress, which belongs to the event loop that is shutting down.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._result = None
+
+    def after_fork(self) -> None:
+        # A check in progress belongs to the parent's event loop, and its result describes the parent
+        self._task = None
+        self._result = None
+
+
+def migration_names() -> List[str]:
+    """
+    The migrations shipped with the application, in the order `peewee_migrate` applies them.
+    """
+    return sorted(path.stem for path in MIGRATIONS_DIR.glob("*.py") if re.match(r"^\d{3}_", path.stem))
+
+
+# Migration files can't change while the process runs
+MIGRATIONS = migration_names()
+
+
+def _pending_migrations() -> List[str]:
+    applied = {name for (name,) in get_db().execute_sql("SELECT name FROM migratehistory").fetchall()}
+    return [name for name in MIGRATIONS if name not in applied]
+
+
+async def check_database() -> Optional[str]:
+    await run_db(get_db().execute_sql, "SELECT 1")
+    return None
+
+
+async def check_migrations() -> Optional[str]:
+    pending = await run_db(_pending_migrations)
+    if pending:
+        return f"{len(pending)} pending: {', '.join(pending)}"
+    return None
+
+
+readiness = ReadinessProbe(
+    ttl=float(os.getenv("READINESS_CACHE_TTL", "1")),
+    timeout=float(os.getenv("READINESS_TIMEOUT", "2")),
+)
+readiness.register("database", check_database)
+readiness.register("migrations", check_migrations)
+os.register_at_fork(after_in_child=readiness.after_fork)
@@ -1,7 +1,9 @@
 import logging
 import os
 import sys
-from typing import Any, List, Optional
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, TextIO
 
 import structlog
 from structlog.types import EventDict, Processor
@@ -31,12 +33,160 @@ def drop_color_message_key(_: Any, __: Any, event_dict: EventDict) -> EventDict:
     return event_dict
 
 
-def setup_logging(json_logs: Optional[bool] = None, log_level: Optional[str] = None) -> None:
+class QueueLogHandler(logging.Handler):
+    """
+    A handler that formats & writes records on a background thread, so logging never blocks on a slow stream.
+
+    Records are held in a bounded in-memory queue and written in batches. When the queue is full, `policy` decides:
+        - "block": wait for the writer to catch up (no records are lost)
+        - "drop-oldest": discard the oldest queued record
+        - "drop-debug": discard the incoming record if it is DEBUG or lower, otherwise block
+    Dropped records are counted in `dropped`.
+
+    Note that formatting happens on the writer thread, so foreign (non-structlog) records are rendered without the
+    context variables of the thread that emitted them.
+    """
+
+    policies = ("block", "drop-oldest", "drop-debug")
+
+    def __init__(
+        self,
+        stream: Optional[TextIO] = None,
+        max_size: int = 10000,
+        policy: str = "block",
+        batch_size: int = 256,
+    ):
+        if policy not in self.policies:
+            raise ValueError(f"Unknown queue policy: {policy}")
+        if max_size <= 0 or batch_size <= 0:
+            raise ValueError("max_size and batch_size must be positive")
+
+        super().__init__()
+        self.stream = stream if stream is not None else sys.stderr
+        self.max_size = max_size
+        self.policy = policy
+        self.batch_size = batch_size
+        self.dropped = 0
+
+        self._queue: Deque[logging.LogRecord] = deque()
+        self._condition = threading.Condition()
+        self._writing = False
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+        os.register_at_fork(after_in_child=self.after_fork)
+
+    def after_fork(self) -> None:
+        """
+        Restart the writer in a forked child, where the parent's thread doesn't exist.
+        Queued records are dropped, as the parent writes them.
+        """
+        if self._closed:
+            return
+
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._writing = False
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        # Records emitted by the writer itself (or after closing) can't wait on the queue
+        if self._closed or threading.current_thread() is self._thread:
+            self._write([record])
+            return
+
+        with self._condition:
+            while len(self._queue) >= self.max_size:
+                if self.policy == "drop-oldest":
+                    self._queue.popleft()
+                    self.dropped += 1
+                    break
+                if self.policy == "drop-debug" and record.levelno <= logging.DEBUG:
+                    self.dropped += 1
+                    return
+                self._condition.wait()
+
+            self._queue.append(record)
+            self._condition.notify_all()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._queue or self._closed)
+                if not self._queue:
+                    return
+
+                batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+                self._writing = True
+                # Wake any emitters blocked on a full queue
+                self._condition.notify_all()
+
+            try:
+                self._write(batch)
+            finally:
+                with self._condition:
+                    self._writing = False
+                    self._condition.notify_all()
+
+    def _write(self, batch: List[logging.LogRecord]) -> None:
+        lines = []
+        for record in batch:
+            try:
+                lines.append(self.format(record))
+            except Exception:
+                self.handleError(record)
+
+        if len(lines) > 0:
+            try:
+                self.stream.write("\n".join(lines) + "\n")
+                self.stream.flush()
+            except Exception:
+                self.handleError(batch[-1])
+
+    def flush(self, timeout: Optional[float] = 5.0) -> None:
+        """
+        Wait until every queued record has been written, or until `timeout` seconds have passed.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: not self._queue and not self._writing, timeout)
+
+    def close(self) -> None:
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        # The writer drains the queue before exiting
+        self._thread.join(timeout=5.0)
+        super().close()
+
+    def stats(self) -> Dict[str, int]:
+        return {"queued": len(self._queue), "max_size": self.max_size, "dropped": self.dropped}
+
+
+# The handler installed on the root logger by `setup_logging`, replaced if it's called again
+_handler: Optional[logging.Handler] = None
+
+
+def flush_logs() -> None:
+    """
+    Flush the root logger's handlers, writing any queued records.
+    """
+    for handler in logging.getLogger().handlers:
+        handler.flush()
+
+
+def setup_logging(
+    json_logs: Optional[bool] = None, log_level: Optional[str] = None, queue: Optional[bool] = None
+) -> None:
+    global _handler
+
     # Pull from environment variables, apply defaults if not set
     if json_logs is None:
         json_logs = os.getenv("LOG_JSON_FORMAT", "true").lower() == "true"
     if log_level is None:
         log_level = os.getenv("LOG_LEVEL", "INFO")
+    if queue is None:
+        queue = os.getenv("LOG_QUEUE", "false").lower() == "true"
 
     def flatten(n):
         """
@@ -82,6 +232,8 @@ def setup_logging(json_logs: Optional[bool] = None, log_level: Optional[str] = N
             structlog.stdlib.ProcessorFormatter.wrap_for_formatter,
         ],
         logger_factory=structlog.stdlib.LoggerFactory(),
+        # Calls below the configured level return immediately, before any processor runs
+        wrapper_class=structlog.make_filtering_bound_logger(logging.getLevelName(log_level.upper())),
         cache_logger_on_first_use=True,
     )
 
@@ -106,12 +258,25 @@ def setup_logging(json_logs: Optional[bool] = None, log_level: Optional[str] = N
         ],
     )
 
-    handler = logging.StreamHandler()
+    handler: logging.Handler
+    if queue:
+        # Format & write on a background thread, so a back-pressured stdout doesn't stall the event loop
+        handler = QueueLogHandler(
+            max_size=int(os.getenv("LOG_QUEUE_SIZE", "10000")),
+            policy=os.getenv("LOG_QUEUE_POLICY", "block"),
+            batch_size=int(os.getenv("LOG_QUEUE_BATCH_SIZE", "256")),
+        )
+    else:
+        handler = logging.StreamHandler()
     # Use OUR `ProcessorFormatter` to format all `logging` entries.
     handler.setFormatter(formatter)
     root_logger = logging.getLogger()
+    if _handler is not None:
+        root_logger.removeHandler(_handler)
+        _handler.close()
     root_logger.addHandler(handler)
     root_logger.setLevel(log_level.upper())
+    _handler = handler
 
     def configure_logger(
         name: str,
@@ -159,5 +324,7 @@ def setup_logging(json_logs: Optional[bool] = None, log_level: Optional[str] = N
             return
 
         root_logger.error("Uncaught exception", exc_info=(exc_type, exc_value, exc_traceback))
+        # The process is likely about to exit; don't lose queued records (including this one)
+        flush_logs()
 
     sys.excepthook = handle_exception
@@ -0,0 +1,269 @@
+"""metrics.py
+This module provides a small in-process metrics registry, rendered in the Prometheus text format by `/metrics`.
+
+Updates are plain dictionary & list operations with no locking; they're expected to happen on the event loop thread
+(see `MetricsMiddleware`), so they never contend. Collectors are read at render time for values owned elsewhere
+(e.g. cache & pool statistics).
+
+With multiple worker processes, set `METRICS_DIR` to a directory shared by the workers on a host. Each process writes a
+snapshot of its metrics there (periodically, on shutdown, and when serving `/metrics`), and `/metrics` merges all the
+snapshots, so any worker can answer for all of them. Snapshots from past processes are kept, as counters are cumulative;
+clear the directory when the whole server (re)starts. Their gauges aren't: a process's final snapshot leaves them out,
+and they're skipped for snapshots whose process no longer exists (e.g. a worker that crashed).
+"""
+
+import bisect
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import structlog
+
+logger = structlog.get_logger()
+
+Labels = Tuple[str, ...]
+# A JSON-serializable snapshot of a registry: metric name -> {"type", "help", "labels", "buckets"?, "values"}
+Snapshot = Dict[str, Dict[str, Any]]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, labels: Labels = (), amount: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "type": self.type,
+            "help": self.help,
+            "labels": self.labels,
+            "values": [[list(labels), value] for labels, value in self.values.items()],
+        }
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(
+        self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (non-cumulative, +Inf last)..., sum]
+        self.values: Dict[Labels, List[float]] = {}
+
+    def observe(self, value: float, labels: Labels = ()) -> None:
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = [0] * (len(self.buckets) + 2)
+        entry[bisect.bisect_left(self.buckets, value)] += 1
+        entry[-1] += value
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "type": self.type,
+            "help": self.help,
+            "labels": self.labels,
+            "buckets": self.buckets,
+            "values": [[list(labels), list(entry)] for labels, entry in self.values.items()],
+        }
+
+
+class Registry:
+    def __init__(self, directory: Optional[str] = None):
+        """
+        :param directory: Where per-process snapshots are shared between workers. None for a single process.
+        """
+        self.directory = Path(directory) if directory else None
+        self.metrics: Dict[str, Any] = {}
+        self.collectors: List[Callable[[], Snapshot]] = []
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        metric = self.metrics[name] = Counter(name, help, labels)
+        return metric
+
+    def histogram(
+        self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        metric = self.metrics[name] = Histogram(name, help, labels, buckets)
+        return metric
+
+    def after_fork(self) -> None:
+        """
+        Reset every metric in a forked child, so the parent's counts aren't reported twice.
+        """
+        for metric in self.metrics.values():
+            metric.values.clear()
+
+    def register_collector(self, collector: Callable[[], Snapshot]) -> None:
+        """
+        Register a function returning metrics (in snapshot form) that are owned elsewhere, read on every snapshot.
+        """
+        self.collectors.append(collector)
+
+    def snapshot(self) -> Snapshot:
+        snapshot = {name: metric.snapshot() for name, metric in self.metrics.items()}
+        for collector in self.collectors:
+            try:
+                snapshot.update(collector())
+            except Exception:
+                logger.exception("Metrics collector failed", collector=collector.__qualname__)
+        return snapshot
+
+    def write_snapshot(self, final: bool = False) -> None:
+        """
+        Write this process's snapshot to the shared directory, atomically replacing the previous one.
+
+        :param final: The process is exiting; only its counters & histograms are kept, as its gauges stop being true.
+        """
+        if self.directory is None:
+            return
+
+        snapshot = self.snapshot()
+        if final:
+            snapshot = _without_gauges(snapshot)
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fd, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as file:
+            json.dump(snapshot, file)
+        os.replace(temporary, self.directory / f"{os.getpid()}.json")
+
+    def collect(self) -> Snapshot:
+        """
+        The metrics of every worker process sharing the directory, or only this process if there is none.
+        """
+        if self.directory is None:
+            return self.snapshot()
+
+        self.write_snapshot()
+        snapshots = []
+        for path in self.directory.glob("*.json"):
+            try:
+                snapshot = json.loads(path.read_text())
+            except (OSError, ValueError):
+                # Being replaced, or removed, as we read it
+                continue
+            # A process that exited without writing a final snapshot
+            if path.stem.isdigit() and not _is_running(int(path.stem)):
+                snapshot = _without_gauges(snapshot)
+            snapshots.append(snapshot)
+        return merge(snapshots)
+
+    def render(self) -> str:
+        return render(self.collect())
+
+
+def _is_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Exists, but belongs to another user
+        return True
+    return True
+
+
+def _without_gauges(snapshot: Snapshot) -> Snapshot:
+    return {name: metric for name, metric in snapshot.items() if metric["type"] != "gauge"}
+
+
+def merge(snapshots: Iterable[Snapshot]) -> Snapshot:
+    """
+    Sum several snapshots into one. Counters, gauges & histogram buckets are added per label set.
+    """
+    merged: Snapshot = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            target = merged.setdefault(name, {**metric, "values": {}})
+            for labels, value in metric["values"]:
+                key = tuple(labels)
+                if metric["type"] == "histogram":
+                    current = target["values"].get(key)
+                    target["values"][key] = (
+                        value if current is None else [a + b for a, b in zip(current, value)]
+                    )
+                else:
+                    target["values"][key] = target["values"].get(key, 0) + value
+
+    for metric in merged.values():
+        metric["values"] = [[list(labels), value] for labels, value in metric["values"].items()]
+    return merged
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render(snapshot: Snapshot) -> str:
+    """
+    Render a snapshot in the Prometheus text exposition format (version 0.0.4).
+    """
+    lines = []
+    for name, metric in sorted(snapshot.items()):
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        names = metric["labels"]
+
+        for labels, value in sorted(metric["values"]):
+            if metric["type"] != "histogram":
+                lines.append(f"{name}{_format_labels(names, labels)} {_format_value(value)}")
+                continue
+
+            *counts, total = value
+            cumulative = 0
+            for bound, count in zip([*metric["buckets"], "+Inf"], counts):
+                cumulative += count
+                le = bound if bound == "+Inf" else _format_value(bound)
+                lines.append(f"{name}_bucket{_format_labels(names, labels, f'le=\"{le}\"')} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(names, labels)} {_format_value(total)}")
+            lines.append(f"{name}_count{_format_labels(names, labels)} {cumulative}")
+
+    return "\n".join(lines) + "\n"
+
+
+registry = Registry(os.getenv("METRICS_DIR"))
+os.register_at_fork(after_in_child=registry.after_fork)
+
+http_requests = registry.counter(
+    "http_requests_total",
+    "Total HTTP requests, by route template, method & status",
+    ("route", "method", "status"),
+)
+http_request_duration = registry.histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency in seconds, by route template, method & status",
+    ("route", "method", "status"),
+)
+
+
+def gauges(name: str, help: str, stats: Dict[str, Any], label: str = "stat") -> Snapshot:
+    """
+    Convert a flat dictionary of numeric statistics (e.g. `session_cache.stats()`) into a labelled gauge.
+    """
+    values = [[[key], value] for key, value in stats.items() if isinstance(value, (int, float))]
+    return {name: {"type": "gauge", "help": help, "labels": (label,), "values": values}}
@@ -1,18 +1,74 @@
+import logging
+import os
+import random
 import time
-from asgi_correlation_id import correlation_id
-import structlog
+from dataclasses import dataclass
+from typing import Optional
 
+import structlog
+from asgi_correlation_id import correlation_id
+from linkpulse.metrics import http_request_duration, http_requests
 from linkpulse.utilities import is_development
-from fastapi import FastAPI, Request, Response
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.datastructures import URL, MutableHeaders, QueryParams
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+@dataclass(frozen=True)
+class AccessLogSampler:
+    """
+    Decides which requests get an access log entry, so access logs can stay enabled at production volume.
+
+    Server errors (5xx) and slow requests are always logged; other requests are logged with the given probability.
+    """
+
+    # Probability of logging a successful (1xx-3xx) request
+    rate: float = 1.0
+    # Probability of logging a client error (4xx)
+    client_error_rate: float = 1.0
+    # Requests at least this slow are always logged; None disables the threshold
+    slow_ms: Optional[float] = None
 
+    @classmethod
+    def from_env(cls) -> "AccessLogSampler":
+        slow_ms = os.getenv("ACCESS_LOG_SLOW_MS")
+        return cls(
+            rate=float(os.getenv("ACCESS_LOG_SAMPLE_RATE", "1")),
+            client_error_rate=float(os.getenv("ACCESS_LOG_CLIENT_ERROR_SAMPLE_RATE", "1")),
+            slow_ms=float(slow_ms) if slow_ms else None,
+        )
 
-class LoggingMiddleware(BaseHTTPMiddleware):
-    def __init__(self, app: FastAPI):
-        super().__init__(app)
+    def should_log(self, status_code: int, duration_ms: float) -> bool:
+        if status_code >= 500:
+            return True
+        if self.slow_ms is not None and duration_ms >= self.slow_ms:
+            return True
+
+        rate = self.client_error_rate if status_code >= 400 else self.rate
+        return rate >= 1 or random.random() < rate
+
+
+class LoggingMiddleware:
+    """
+    Emits a structured access log entry for every HTTP request, and adds `X-Process-Time` in development.
+
+    This is a pure ASGI middleware: the response is passed through untouched (including streaming bodies), with the
+    status code captured from `http.response.start` as it goes by.
+
+    Access logs are emitted at `ACCESS_LOG_LEVEL` (default DEBUG). If that level is disabled for the `api.access`
+    logger, or the request isn't sampled, the log entry is never built.
+    """
+
+    def __init__(self, app: ASGIApp, sampler: Optional[AccessLogSampler] = None):
+        self.app = app
         self.access_logger = structlog.get_logger("api.access")
+        self.level: int = logging.getLevelName(os.getenv("ACCESS_LOG_LEVEL", "DEBUG").upper())
+        self.sampler = sampler if sampler is not None else AccessLogSampler.from_env()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
 
-    async def dispatch(self, request: Request, call_next) -> Response:
         structlog.contextvars.clear_contextvars()
 
         # These context vars will be added to all log entries emitted during the request
@@ -20,39 +76,79 @@ class LoggingMiddleware(BaseHTTPMiddleware):
         structlog.contextvars.bind_contextvars(request_id=request_id)
 
         start_time = time.perf_counter_ns()
-        # If the call_next raises an error, we still want to return our own 500 response,
-        # so we can add headers to it (process time, request ID...)
-        response = Response(status_code=500)
+        # If the app raises before starting a response, the server will respond with a 500
+        status_code = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if is_development:
+                    elapsed_ms = (time.perf_counter_ns() - start_time) / 10**6
+                    MutableHeaders(scope=message).append("X-Process-Time", "{:.2f}".format(elapsed_ms))
+            await send(message)
+
         try:
-            response = await call_next(request)
+            await self.app(scope, receive, send_wrapper)
         except Exception:
-            # TODO: Validate that we don't swallow exceptions (unit test?)
             structlog.stdlib.get_logger("api.error").exception("Uncaught exception")
             raise
         finally:
-            process_time_ms = "{:.2f}".format(
-                (time.perf_counter_ns() - start_time) / 10**6
-            )
-
-            self.access_logger.debug(
-                "Request",
-                http={
-                    "url": str(request.url),
-                    "query": dict(request.query_params),
-                    "status_code": response.status_code,
-                    "method": request.method,
-                    "request_id": request_id,
-                    "version": request.scope["http_version"],
-                },
-                client=(
-                    {"ip": request.client.host, "port": request.client.port}
-                    if request.client
-                    else None
-                ),
-                duration_ms=process_time_ms,
-            )
-
-            if is_development:
-                response.headers["X-Process-Time"] = process_time_ms
-
-            return response
+            # Checked per request, as levels may be reconfigured at runtime; this is a cached lookup in `logging`
+            if logging.getLogger("api.access").isEnabledFor(self.level):
+                self._log(scope, request_id, status_code, (time.perf_counter_ns() - start_time) / 10**6)
+
+    def _log(self, scope: Scope, request_id: Optional[str], status_code: int, duration_ms: float) -> None:
+        if not self.sampler.should_log(status_code, duration_ms):
+            return
+
+        client = scope.get("client")
+        self.access_logger.log(
+            self.level,
+            "Request",
+            http={
+                "url": str(URL(scope=scope)),
+                "query": dict(QueryParams(scope["query_string"])),
+                "status_code": status_code,
+                "method": scope["method"],
+                "request_id": request_id,
+                "version": scope["http_version"],
+            },
+            client=({"ip": client[0], "port": client[1]} if client else None),
+            duration_ms="{:.2f}".format(duration_ms),
+        )
+
+
+class MetricsMiddleware:
+    """
+    Records a request count & latency observation for every HTTP request, labelled by route template, method & status.
+
+    The route template (e.g. `/api/user/{id}`) is read from the matched route once the app has handled the request, so
+    label cardinality stays bounded; requests matching no route are labelled `<unmatched>`.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # The router adds the matched route to the (shared) scope
+            route = scope.get("route")
+            labels = (getattr(route, "path", "<unmatched>"), scope["method"], str(status_code))
+            http_requests.inc(labels)
+            http_request_duration.observe(time.perf_counter() - start_time, labels)
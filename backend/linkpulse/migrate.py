@@ -1,16 +1,248 @@
+import hashlib
+import os
 import pkgutil
 import re
 import sys
-from typing import List, Optional, Tuple
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from functools import cached_property
+from importlib.metadata import version
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, Optional, Tuple
+from unittest import mock
 
-import questionary
 import structlog
 from dotenv import load_dotenv
-from peewee_migrate import Router, router
+from peewee import DatabaseError, InterfaceError, Node
+from peewee_migrate import Migrator, Router, router
+from peewee_migrate.template import TEMPLATE
+from playhouse.migrate import Operation, make_index_name
+
+if TYPE_CHECKING:
+    from peewee import Database, Model
 
 logger = structlog.get_logger()
 load_dotenv(dotenv_path=".env")
 
+MIGRATIONS_DIR = Path(__file__).parent / "migrations"
+
+# Any fixed key works, as long as every process migrating this database contends on the same one
+MIGRATION_LOCK_KEY = 0x6C696E6B70756C73  # "linkpuls" in ASCII, fitting a signed 64-bit key
+
+# The model state after the applied migrations, as a migration creating every model; not a migration itself
+SNAPSHOT_NAME = ".snapshot.py"
+# Part of the snapshot's key, so changes to its format (or peewee_migrate's) replace existing snapshots
+SNAPSHOT_VERSION = f"1:{version('peewee-migrate')}"
+
+ACCESS_EXCLUSIVE = "ACCESS EXCLUSIVE"
+
+# Table locks taken by `playhouse.migrate` operations that block queries: ACCESS EXCLUSIVE blocks reads & writes, the
+# others block writes. Either is held until the migration commits, including any scan, rewrite or index build.
+LOCKS = {
+    "add_column": ACCESS_EXCLUSIVE,
+    "drop_column": ACCESS_EXCLUSIVE,
+    "rename_column": ACCESS_EXCLUSIVE,
+    "change_column": ACCESS_EXCLUSIVE,
+    "alter_column_type": ACCESS_EXCLUSIVE,
+    "add_not_null": ACCESS_EXCLUSIVE,
+    "drop_not_null": ACCESS_EXCLUSIVE,
+    "add_default": ACCESS_EXCLUSIVE,
+    "add_column_default": ACCESS_EXCLUSIVE,
+    "drop_column_default": ACCESS_EXCLUSIVE,
+    "add_constraint": ACCESS_EXCLUSIVE,
+    "drop_constraint": ACCESS_EXCLUSIVE,
+    "drop_foreign_key_constraint": ACCESS_EXCLUSIVE,
+    "add_foreign_key_constraint": "SHARE ROW EXCLUSIVE",
+    "drop_index": ACCESS_EXCLUSIVE,
+    "rename_table": ACCESS_EXCLUSIVE,
+    "add_index": "SHARE",
+    "add_unique": "SHARE",
+}
+
+# The same, for statements run through `migrator.sql`
+SQL_LOCKS = [
+    (
+        re.compile(
+            r"^\s*CREATE\s+(?:UNIQUE\s+)?INDEX\s+(?!CONCURRENTLY\b).*?\bON\s+(?:ONLY\s+)?\"?(\w+)",
+            re.I | re.S,
+        ),
+        "SHARE",
+    ),
+    (
+        re.compile(
+            r"^\s*ALTER\s+TABLE\s+(?:IF\s+EXISTS\s+)?(?:ONLY\s+)?\"?(\w+)\"?(?!.*\bVALIDATE\s+CONSTRAINT\b)",
+            re.I | re.S,
+        ),
+        ACCESS_EXCLUSIVE,
+    ),
+]
+
+ONLINE_ALTERNATIVES = {
+    "add_index": "add_index_concurrently",
+    "add_unique": "add_index_concurrently",
+    "drop_index": "drop_index_concurrently",
+    "add_constraint": "add_constraint_not_valid",
+}
+
+
+def _quote(name: str) -> str:
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+class OnlineOperation:
+    """
+    A schema change that runs outside a transaction, once the rest of its migration has committed.
+    """
+
+    def __init__(self, method: str, table: str, func: Callable[[], None]):
+        self.method = method
+        self.table = table
+        self.func = func
+        # Logged by `Migrator.__call__`
+        self.__name__ = f"{method} {table}"
+
+    def __call__(self) -> None:
+        self.func()
+
+
+class OnlineMigrator(Migrator):
+    """
+    A Migrator with variants of index & constraint operations that don't block queries on large tables.
+
+    Added
+        - add_index_concurrently, drop_index_concurrently: `CREATE/DROP INDEX CONCURRENTLY`, which don't block reads or
+          writes while the index is built (or dropped)
+        - add_constraint_not_valid: `ADD CONSTRAINT ... NOT VALID`, which locks the table only briefly, followed by
+          `VALIDATE CONSTRAINT`, which checks the existing rows without blocking reads or writes
+        - validate_constraint: Validate a constraint added as `NOT VALID` by an earlier migration
+
+    Postgres can't build an index concurrently inside a transaction, and validating a constraint in the transaction
+    that added it holds its ACCESS EXCLUSIVE lock throughout. So `ExtendedRouter.run_one` runs these operations after
+    the migration's other operations have committed, each on its own. They're idempotent, so a migration interrupted
+    part-way can be re-run; keep them in migrations of their own, so nothing else runs twice.
+    """
+
+    def take_online(self) -> List[OnlineOperation]:
+        """
+        Remove & return the queued online operations, leaving the others to run in a transaction.
+        """
+        online = [op for op in self.__ops__ if isinstance(op, OnlineOperation)]
+        self.__ops__ = [op for op in self.__ops__ if not isinstance(op, OnlineOperation)]
+        return online
+
+    def _execute(self, sql: str, *params: Any) -> Any:
+        return self.__database__.execute_sql(sql, params)
+
+    def add_index_concurrently(
+        self, model: "str | type[Model]", *columns: str, unique: bool = False
+    ) -> "type[Model]":
+        """
+        Create an index without blocking writes, see `add_index`.
+        """
+        model = self.add_index(model, *columns, unique=unique)
+        # `add_index` updated the model's state; only its operation is replaced
+        table, column_names = self.__ops__.pop().args
+        index = make_index_name(table, column_names)
+        sql = "CREATE {}INDEX CONCURRENTLY IF NOT EXISTS {} ON {} ({})".format(
+            "UNIQUE " if unique else "", _quote(index), _quote(table), ", ".join(map(_quote, column_names))
+        )
+
+        def run() -> None:
+            # A failed concurrent build leaves an invalid index behind, which `IF NOT EXISTS` would keep
+            invalid = self._execute(
+                "SELECT 1 FROM pg_index WHERE indexrelid = to_regclass(%s) AND NOT indisvalid", _quote(index)
+            ).fetchone()
+            if invalid:
+                self._execute(f"DROP INDEX CONCURRENTLY {_quote(index)}")
+            self._execute(sql)
+
+        self.__ops__.append(OnlineOperation("add_index_concurrently", table, run))
+        return model
+
+    def drop_index_concurrently(self, model: "str | type[Model]", *columns: str) -> "type[Model]":
+        """
+        Drop an index without blocking reads or writes, see `drop_index`.
+        """
+        model = self.drop_index(model, *columns)
+        table, index = self.__ops__.pop().args
+        sql = f"DROP INDEX CONCURRENTLY IF EXISTS {_quote(index)}"
+        self.__ops__.append(OnlineOperation("drop_index_concurrently", table, lambda: self._execute(sql)))
+        return model
+
+    def add_constraint_not_valid(
+        self, model: "str | type[Model]", name: str, constraint: Node, validate: bool = True
+    ) -> "type[Model]":
+        """
+        Add a constraint without checking existing rows under an ACCESS EXCLUSIVE lock, see `add_constraint`.
+
+        :param validate: Check the existing rows afterwards; otherwise only new & updated rows are checked until
+            `validate_constraint` is called (e.g. by a later migration, once invalid rows are fixed).
+        """
+        model = self.__get_model__(model)
+        table = model._meta.table_name  # type: ignore
+        definition, params = self.__migrator__.make_context().sql(constraint).query()
+        sql = f"ALTER TABLE {_quote(table)} ADD CONSTRAINT {_quote(name)} {definition} NOT VALID"
+
+        def run() -> None:
+            exists = self._execute(
+                "SELECT 1 FROM pg_constraint WHERE conrelid = to_regclass(%s) AND conname = %s",
+                _quote(table),
+                name,
+            ).fetchone()
+            if not exists:
+                self._execute(sql, *params)
+
+        self.__ops__.append(OnlineOperation("add_constraint_not_valid", table, run))
+        if validate:
+            self.validate_constraint(model, name)
+        return model
+
+    def validate_constraint(self, model: "str | type[Model]", name: str) -> "type[Model]":
+        """
+        Check the existing rows against a `NOT VALID` constraint, without blocking reads or writes.
+        """
+        model = self.__get_model__(model)
+        table = model._meta.table_name  # type: ignore
+        sql = f"ALTER TABLE {_quote(table)} VALIDATE CONSTRAINT {_quote(name)}"
+        self.__ops__.append(OnlineOperation("validate_constraint", table, lambda: self._execute(sql)))
+        return model
+
+
+@dataclass(frozen=True)
+class LockWarning:
+    """
+    An operation in a pending migration that locks a large table against queries until it commits.
+    """
+
+    migration: str
+    operation: str
+    table: str
+    lock: str
+    # Estimated, from the planner's statistics
+    rows: int
+    alternative: Optional[str] = None
+
+
+def _locked_table(operation: Any) -> Optional[Tuple[str, str]]:
+    """
+    :return: The table an operation locks against queries, and the lock mode; None if it doesn't, or isn't known to.
+    """
+    if not isinstance(operation, Operation):
+        return None
+
+    if operation.method == "sql":
+        for pattern, lock in SQL_LOCKS:
+            match = pattern.match(str(operation.args[0]))
+            if match is not None:
+                return match[1], lock
+        return None
+
+    lock = LOCKS.get(operation.method)
+    if lock is None or not operation.args or not isinstance(operation.args[0], str):
+        return None
+    return operation.args[0], lock
+
 
 class ExtendedRouter(Router):
     """
@@ -19,8 +251,20 @@ class ExtendedRouter(Router):
     Added
         - show: Show the suggested migration that will be created, without actually creating it
         - all_migrations: Get all migrations that have been applied
+        - run_one: Times each applied migration (see `durations`), and runs online operations outside its transaction
+        - lint: Warn about pending migrations that lock large tables against queries
+        - migrator: Loads the applied migrations' model state from a snapshot instead of replaying them, see `snapshot`
+
+    Migrations get an `OnlineMigrator`, for online index & constraint operations.
     """
 
+    def __init__(self, *args: Any, **kwargs: Any):
+        kwargs.setdefault("migrator_class", OnlineMigrator)
+        super().__init__(*args, **kwargs)
+        # Seconds taken by each migration applied (or rolled back) by this router
+        self.durations: Dict[str, float] = {}
+        self.slow_threshold = float(os.getenv("MIGRATE_SLOW_SECONDS", "5"))
+
     def show(self, module: str) -> Optional[Tuple[str, str]]:
         """
         Show the suggested migration that will be created, without actually creating it
@@ -64,12 +308,280 @@ class ExtendedRouter(Router):
         """
         return [mm.name for mm in self.model.select().order_by(self.model.id)]
 
+    @property
+    def snapshot_path(self) -> Path:
+        return Path(self.migrate_dir) / SNAPSHOT_NAME
+
+    def snapshot_key(self, names: List[str]) -> str:
+        """
+        Hash the names & contents of migrations, so a snapshot of their state no longer matches once any file changes.
+        """
+        digest = hashlib.sha256(SNAPSHOT_VERSION.encode())
+        for name in names:
+            digest.update(b"\0" + name.encode() + b"\0")
+            digest.update((Path(self.migrate_dir) / f"{name}.py").read_bytes())
+        return digest.hexdigest()
+
+    def _from_snapshot(self, content: str) -> Migrator:
+        migrator = self.migrator_class(self.database)
+        scope: Dict[str, Any] = {}
+        exec(compile(content, str(self.snapshot_path), "exec", dont_inherit=True), scope)
+        scope["migrate"](migrator, self.database, fake=True)
+        # Only the model state is wanted, not the operations creating the tables
+        migrator.__ops__ = []
+        return migrator
+
+    def _load_snapshot(self, key: str) -> Optional[Migrator]:
+        try:
+            with self.snapshot_path.open() as file:
+                if file.readline().strip() != f"# key: {key}":
+                    return None
+                content = file.read()
+        except FileNotFoundError:
+            return None
+
+        try:
+            return self._from_snapshot(content)
+        except Exception:
+            logger.warning(
+                "Ignoring unreadable migration snapshot", path=str(self.snapshot_path), exc_info=True
+            )
+            return None
+
+    def _save_snapshot(self, key: str, migrator: Migrator) -> None:
+        models = list(migrator.orm)
+        code = router.compile_migrations(self.migrator_class(self.database), models)
+
+        # Generated fields lose the index flags `add_index` sets on primary keys, so they're restored explicitly
+        loaded = self._from_snapshot(TEMPLATE.format(migrate=code, rollback="", name=SNAPSHOT_NAME))
+        for model in models:
+            table = model._meta.table_name  # type: ignore
+            for name, field in model._meta.fields.items():  # type: ignore
+                generated = loaded.orm[table]._meta.fields[name]
+                for flag in ("unique", "index"):
+                    value = getattr(field, flag)
+                    if value != getattr(generated, flag):
+                        code += f"\n    migrator.orm[{table!r}]._meta.fields[{name!r}].{flag} = {value!r}"
+
+        content = TEMPLATE.format(migrate=code, rollback="", name=SNAPSHOT_NAME)
+        loaded = self._from_snapshot(content)
+        # Only an exact copy is saved: differences would show up as changes in every migration created from it
+        if router.compile_migrations(loaded, models) or router.compile_migrations(migrator, list(loaded.orm)):
+            logger.warning("Migration state can't be snapshotted exactly, it will be replayed each time")
+            return
+
+        partial = self.snapshot_path.with_name(f"{SNAPSHOT_NAME}.{os.getpid()}.tmp")
+        try:
+            partial.write_text(f"# key: {key}\n{content}")
+            # Atomic, so concurrent runs never read a partial snapshot
+            os.replace(partial, self.snapshot_path)
+        except OSError:
+            # e.g. a read-only deployment; the state is replayed each time instead
+            logger.warning("Can't save migration snapshot", path=str(self.snapshot_path), exc_info=True)
+
+    def snapshot(self) -> Migrator:
+        """
+        Build a migrator holding the model state after the applied migrations.
+
+        peewee_migrate rebuilds the state by replaying every applied migration, which gets slower as they accumulate.
+        Instead, the state is saved as a migration creating every model, keyed by the applied migrations' names &
+        contents, and loaded while the key still matches. Otherwise, the state is replayed & saved again.
+        """
+        done = self.done
+        key = self.snapshot_key(done)
+        migrator = self._load_snapshot(key)
+        if migrator is not None:
+            return migrator
+
+        migrator = self.migrator_class(self.database)
+        for name in done:
+            self.run_one(name, migrator)
+        self._save_snapshot(key, migrator)
+        return migrator
+
+    @cached_property
+    def migrator(self) -> Migrator:
+        return self.snapshot()
+
+    def run_one(
+        self,
+        name: str,
+        migrator: Migrator,
+        *,
+        fake: bool = True,
+        downgrade: bool = False,
+        force: bool = False,
+    ) -> str:
+        if fake:
+            return super().run_one(name, migrator, fake=fake, downgrade=downgrade, force=force)
+
+        start = time.perf_counter()
+        migrate, rollback = self.read(name)
+        try:
+            # As in peewee_migrate, except that online operations run once the transaction has committed
+            with self.database.transaction():
+                self.logger.info('Rolling back "%s"' if downgrade else 'Migrate "%s"', name)
+                (rollback if downgrade else migrate)(migrator, self.database, fake=False)
+                online = migrator.take_online() if isinstance(migrator, OnlineMigrator) else []
+                migrator()
+                if not online:
+                    self._record(name, downgrade)
+
+            if online:
+                for operation in online:
+                    logger.info("Running online operation", migration=name, operation=operation.__name__)
+                    operation()
+                self._record(name, downgrade)
+        except Exception:
+            self.database.rollback()
+            self.logger.exception("%s failed: %s", "Rollback" if downgrade else "Migration", name)
+            raise
+
+        elapsed = time.perf_counter() - start
+        self.durations[name] = elapsed
+        # Slow migrations usually scan or rewrite a table, and get slower as it grows
+        log = logger.warning if elapsed >= self.slow_threshold else logger.info
+        log("Migration applied", migration=name, downgrade=downgrade, duration=round(elapsed, 3))
+        return name
+
+    def _record(self, name: str, downgrade: bool) -> None:
+        if downgrade:
+            self.model.delete().where(self.model.name == name).execute()
+        else:
+            self.model.create(name=name)
+
+    def lint(self, min_rows: Optional[int] = None) -> List[LockWarning]:
+        """
+        Find operations in pending migrations that lock a table of at least `min_rows` rows (`MIGRATE_LINT_ROWS`)
+        against reads or writes until they commit. Nothing is applied.
+        """
+        if min_rows is None:
+            min_rows = int(os.getenv("MIGRATE_LINT_ROWS", "100000"))
+
+        pending = self.diff
+        if not pending:
+            return []
+
+        # A separate migrator, so `self.migrator` is left as it is
+        migrator = self.snapshot()
+
+        found: List[Tuple[str, str, str, str]] = []
+        for name in pending:
+            migrate, _ = self.read(name)
+            # Only queues the operations; queries are mocked, as in peewee_migrate's fake runs
+            with mock.patch("peewee.Model.select"), mock.patch("peewee.Database.execute_sql"):
+                migrate(migrator, self.database, fake=True)
+            for operation in migrator.__ops__:
+                locked = _locked_table(operation)
+                if locked is not None:
+                    found.append((name, operation.method, *locked))
+            migrator.__ops__ = []
+
+        if not found:
+            return []
+
+        tables = sorted({table for _, _, table, _ in found})
+        rows = dict(
+            self.database.execute_sql(
+                "SELECT relname, GREATEST(reltuples, 0)::bigint FROM pg_class"
+                " WHERE relkind IN ('r', 'p') AND relname = ANY(%s) AND pg_table_is_visible(oid)",
+                (tables,),
+            ).fetchall()
+        )
+
+        warnings = [
+            LockWarning(name, method, table, lock, rows[table], ONLINE_ALTERNATIVES.get(method))
+            for name, method, table, lock in found
+            # Tables created by pending migrations don't exist yet
+            if table in rows and rows[table] >= min_rows
+        ]
+        for warning in warnings:
+            logger.warning("Migration locks a large table against queries", **asdict(warning))
+        return warnings
+
+
+@contextmanager
+def advisory_lock(db: "Database", key: int, timeout: float, poll_interval: float = 0.5) -> Iterator[None]:
+    """
+    Hold a session-level Postgres advisory lock on the current connection, waiting up to `timeout` seconds for it.
+
+    The lock is released on exit, or by Postgres if the connection is lost, so a crashed holder never blocks others.
+    """
+    deadline = time.monotonic() + timeout
+    waiting = False
+    while not db.execute_sql("SELECT pg_try_advisory_lock(%s)", (key,)).fetchone()[0]:
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"Timed out after {timeout}s waiting for advisory lock {key}")
+        if not waiting:
+            logger.info("Waiting for advisory lock, held by another process", key=key)
+            waiting = True
+        time.sleep(poll_interval)
+
+    try:
+        yield
+    finally:
+        try:
+            db.execute_sql("SELECT pg_advisory_unlock(%s)", (key,))
+        except (DatabaseError, InterfaceError):
+            # The connection is gone, and the lock with it
+            logger.warning("Failed to release advisory lock", key=key, exc_info=True)
+
+
+def apply_all(timeout: Optional[float] = None) -> Dict[str, float]:
+    """
+    Apply every pending migration, non-interactively.
+
+    Concurrent callers (replicas starting together) are serialized by an advisory lock: one migrates, the others wait
+    for it, then find nothing left to apply. A failed migration is rolled back and raised.
+
+    :param timeout: Seconds to wait for the lock, defaulting to `MIGRATE_LOCK_TIMEOUT`.
+    :return: Each applied migration's duration in seconds.
+    """
+    from linkpulse.utilities import get_db
+
+    from linkpulse import models
+
+    if timeout is None:
+        timeout = float(os.getenv("MIGRATE_LOCK_TIMEOUT", "300"))
+
+    db = get_db()
+    start = time.perf_counter()
+    with db.connection_context(), advisory_lock(db, MIGRATION_LOCK_KEY, timeout):
+        # Created under the lock, as the router creates its history table if missing
+        router = ExtendedRouter(
+            database=db, migrate_dir=MIGRATIONS_DIR, ignore=[models.BaseModel._meta.table_name]
+        )
+        if not router.diff:
+            logger.info("No pending migrations to apply.")
+            return {}
+        # Only warns: whether the lock is acceptable depends on the deploy
+        router.lint()
+        router.run()
+
+    logger.info(
+        "Applied migrations",
+        count=len(router.durations),
+        duration=round(sum(router.durations.values()), 3),
+        # Including the wait for the lock
+        elapsed=round(time.perf_counter() - start, 3),
+    )
+    return router.durations
+
 
 def main(*args: str) -> None:
     """
     Main function for running migrations.
     Args are fed directly from sys.argv.
+
+    With `--apply-all`, every pending migration is applied without prompting (e.g. in a deploy step), see `apply_all`.
+    With `--lint`, pending migrations are only checked for locks on large tables, exiting with 1 if any are found.
     """
+    if "--apply-all" in args:
+        apply_all()
+        return
+
+    # Interactive only, so it isn't imported by the startup hook
+    import questionary
     from linkpulse.utilities import get_db
 
     from linkpulse import models
@@ -77,11 +589,14 @@ def main(*args: str) -> None:
     db = get_db()
     router = ExtendedRouter(
         database=db,
-        migrate_dir="linkpulse/migrations",
+        migrate_dir=MIGRATIONS_DIR,
         ignore=[models.BaseModel._meta.table_name],
     )
     target_models = "linkpulse.models"  # The module to scan for models & changes
 
+    if "--lint" in args:
+        sys.exit(1 if router.lint() else 0)
+
     current = router.all_migrations()
     if len(current) == 0:
         diff = router.diff
@@ -102,6 +617,7 @@ def main(*args: str) -> None:
             "Note: Selecting a migration will apply all migrations up to and including the selected migration."
         )
         logger.info("e.g. Applying 004 while only 001 is applied would apply 002, 003, and 004.")
+        router.lint()
 
         choice = questionary.select("Select highest migration to apply:", choices=diff).ask()
         if choice is None:
@@ -4,14 +4,19 @@ It also provides a base model with database connection details.
 """
 
 import datetime
+import hashlib
 import secrets
-from os import getenv
-from typing import Optional
+from os import getenv, register_at_fork
+from typing import List, Optional, Tuple
 
 import structlog
+from linkpulse.buffer import last_used_buffer
+from linkpulse.cache import CachedSession, session_cache
+from linkpulse.database import create_database
+from linkpulse.prepared import prepared_statements
 from linkpulse.utilities import utc_now
-from peewee import AutoField, BitField, CharField, Check, DateTimeField, ForeignKeyField, Model
-from playhouse.db_url import connect
+from peewee import AutoField, BitField, CharField, Check, DateTimeField, ForeignKeyField, Model, fn
+from peewee import Tuple as PeeweeTuple
 
 logger = structlog.get_logger()
 
@@ -24,10 +29,18 @@ def _get_database_url():
     return url
 
 
+# Hex characters of a token's SHA-256 shown in place of the token, see `Session.public_id`
+PUBLIC_ID_LENGTH = 16
+
+
 class BaseModel(Model):
     class Meta:
         # accessed via `BaseModel._meta.database`
-        database = connect(url=_get_database_url())
+        database = create_database(_get_database_url())
+
+
+# Workers forked from a process with open connections must not reuse them
+register_at_fork(after_in_child=BaseModel._meta.database.after_fork)  # type: ignore
 
 
 class User(BaseModel):
@@ -46,6 +59,14 @@ class User(BaseModel):
     # TODO: delete method, ensure sessions are deleted as well
     # TODO: undelete method
 
+    @classmethod
+    def by_email(cls, email: str) -> Optional["User"]:
+        """
+        Fetch a user by email, including soft-deleted users, like `User.get_or_none(User.email == email)`.
+        """
+        users = prepared_statements.fetch("user_by_email", email)
+        return users[0] if users else None
+
 
 class Session(BaseModel):
     """
@@ -59,12 +80,15 @@ class Session(BaseModel):
     token = CharField(unique=True, primary_key=True, max_length=32)
     user = ForeignKeyField(User, backref="sessions", on_delete="CASCADE")
 
-    expiry = DateTimeField()
+    # indexed for the expired session reaper
+    expiry = DateTimeField(index=True)
 
     created_at = DateTimeField(default=utc_now)
     last_used = DateTimeField(default=None, null=True)
 
     class Meta:
+        # for keyset pagination of a user's sessions, see `page_for_user`
+        indexes = ((("user", "created_at", "token"), False),)
         constraints = [
             Check("LENGTH(token) = 32", name="session_token_length"),
             Check("expiry > created_at", name="session_expiry_created_at"),
@@ -79,6 +103,91 @@ class Session(BaseModel):
         alphabet = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
         return "".join(secrets.choice(alphabet) for _ in range(32))
 
+    @classmethod
+    def resolve(cls, token: str) -> Optional["Session"]:
+        """
+        Fetch a session and the user columns needed to serve a request in a single query.
+        The returned session's `user` only has `id` and `email` populated; don't `save()` it.
+        """
+        sessions = prepared_statements.fetch("session_by_token", token)
+        return sessions[0] if sessions else None
+
+    @classmethod
+    def delete_by_token(cls, token: str) -> int:
+        """
+        :return: The number of sessions deleted, 0 or 1.
+        """
+        return prepared_statements.execute("session_delete", token).rowcount
+
+    @staticmethod
+    def public_id(token: str) -> str:
+        """
+        A non-secret identifier for a session, safe to show to the user: the token itself is a bearer credential.
+        """
+        return hashlib.sha256(token.encode()).hexdigest()[:PUBLIC_ID_LENGTH]
+
+    @classmethod
+    def page_for_user(
+        cls,
+        user_id: int,
+        limit: int,
+        after: Optional[Tuple[datetime.datetime, str]] = None,
+        now: Optional[datetime.datetime] = None,
+    ) -> List["Session"]:
+        """
+        Fetch a page of a user's unexpired sessions, ordered by `(created_at, token)`.
+        Only the columns needed to display them are selected.
+
+        :param limit: The maximum number of sessions to return.
+        :param after: The `(created_at, public_id)` of the last session on the previous page.
+        """
+        if now is None:
+            now = utc_now()
+
+        query = (
+            cls.select(cls.token, cls.created_at, cls.last_used, cls.expiry)
+            .where((cls.user == user_id) & (cls.expiry > now))
+            .order_by(cls.created_at, cls.token)
+            .limit(limit)
+        )
+        if after is not None:
+            created_at, public_id = after
+            # The previous session's token, found by its public id within the same query; if it was deleted since,
+            # the page restarts at its creation time
+            previous = cls.alias()
+            # Same as `public_id`
+            digest = fn.ENCODE(fn.SHA256(fn.CONVERT_TO(previous.token, "UTF8")), "hex")
+            token = (
+                previous.select(previous.token)
+                .where(
+                    (previous.user == user_id)
+                    & (previous.created_at == created_at)
+                    & (fn.LEFT(digest, PUBLIC_ID_LENGTH) == public_id)
+                )
+                .limit(1)
+            )
+            # A row comparison, so Postgres seeks in the (user_id, created_at, token) index instead of skipping rows
+            query = query.where(
+                PeeweeTuple(cls.created_at, cls.token) > PeeweeTuple(created_at, fn.COALESCE(token, ""))
+            )
+        return list(query)
+
+    @classmethod
+    def from_cache(cls, cached: CachedSession) -> "Session":
+        """
+        Rebuild a session from the session cache without touching the database.
+        Only the token, expiry and user (id & email) are populated.
+        """
+        return cls(token=cached.token, expiry=cached.expiry, user=User(id=cached.user_id, email=cached.email))
+
+    def to_cache(self) -> CachedSession:
+        return CachedSession(
+            token=self.token,  # type: ignore
+            user_id=self.user_id,  # type: ignore
+            email=self.user.email,
+            expiry=self.expiry,  # type: ignore
+        )
+
     @property
     def expiry_utc(self) -> datetime.datetime:
         return self.expiry.replace(tzinfo=datetime.timezone.utc)  # type: ignore
@@ -93,17 +202,27 @@ class Session(BaseModel):
         if self.expiry_utc < now:
             logger.debug("Session expired", token=self.token, user=self.user.email, revoke=revoke)
             if revoke:
-                self.delete_instance()
+                Session.delete_by_token(self.token)  # type: ignore
+                last_used_buffer.discard(self.token)
+                session_cache.invalidate(self.token)
             return True
         return False
 
     def use(self, now: Optional[datetime.datetime] = None):
         """
         Update the last_used field of the session.
+
+        The database write is deferred to the write-behind buffer, which is flushed periodically by the scheduler.
         """
         if now is None:
             now = utc_now()
         self.last_used = now  # type: ignore
-        # TODO: This should be buffered, as it'll be called *constantly*, perhaps every single request.
-        # The ideal solution would be emitting updates to a Redis-based cache, and then flushing to the database every few seconds/minute.
-        self.save()
+        last_used_buffer.record(self.token, now)  # type: ignore
+
+
+# The queries behind nearly every request, see `prepared.py`; the values are placeholders for their parameters
+prepared_statements.register("user_by_email", User.select().where(User.email == ""))
+prepared_statements.register(
+    "session_by_token", Session.select(Session, User.id, User.email).join(User).where(Session.token == "")
+)
+prepared_statements.register("session_delete", Session.delete().where(Session.token == ""))
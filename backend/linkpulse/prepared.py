@@ -0,0 +1,181 @@
+"""prepared.py
+This module provides a registry of server-side prepared statements for the queries run on nearly every request.
+
+peewee renders a query's SQL on every call, and Postgres parses & plans it on every call. Registered statements are
+rendered once, then `PREPARE`d on each connection the first time it runs one of them, and run with `EXECUTE`.
+Prepared statements belong to the connection, so a new connection (e.g. after a reconnect, or one recycled by the
+pool) is prepared again; statements the server dropped (e.g. `DISCARD ALL` by a connection pooler) are re-prepared.
+
+Poolers in transaction mode (pgbouncer < 1.21) can hand each statement a different server connection, which breaks
+prepared statements; set `DB_PREPARED_STATEMENTS=false` to run the same SQL unprepared.
+"""
+
+import os
+import re
+import threading
+import weakref
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Set, Union
+
+import structlog
+from peewee import DatabaseError, Model, Query
+from peewee import __exception_wrapper__ as exception_wrapper
+
+logger = structlog.get_logger()
+
+# psycopg2's SQLSTATEs for a missing & an already prepared statement
+INVALID_STATEMENT_NAME = "26000"
+DUPLICATE_STATEMENT = "42P05"
+
+
+@dataclass(frozen=True)
+class Statement:
+    name: str
+    # With `$n` placeholders, for PREPARE
+    sql: str
+    # With `%s` placeholders, for running unprepared
+    unprepared: str
+    execute: str
+    # The query it was rendered from, which turns rows into model instances
+    query: Optional[Query] = None
+
+
+def _pgcode(exc: Exception) -> Optional[str]:
+    # peewee wraps psycopg2's exception, keeping it as `orig`
+    return getattr(getattr(exc, "orig", None), "pgcode", None)
+
+
+class PreparedStatements:
+    """
+    Registered statements, prepared on each connection the first time it runs one of them.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.statements: Dict[str, Statement] = {}
+
+        # connection -> names of the statements prepared on it; entries go away with their connections
+        self._prepared: "weakref.WeakKeyDictionary[Any, Set[str]]" = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+        self.prepares = 0
+        self.reprepares = 0
+        self.executions = 0
+
+    def register(self, name: str, query: Union[Query, str]) -> Statement:
+        """
+        Register a statement, from a peewee query or SQL with `$n` placeholders.
+
+        A query's parameters become the statement's, in the order they appear in its SQL; the values it was built with
+        are placeholders, e.g. `User.select().where(User.email == "")` takes the email.
+        """
+        if re.match(r"^[a-z_][a-z0-9_]*$", name) is None:
+            raise ValueError(f"Invalid statement name: {name!r}")
+
+        if isinstance(query, str):
+            numbers = [int(number) for number in re.findall(r"\$(\d+)", query)]
+            if numbers != list(range(1, len(numbers) + 1)):
+                raise ValueError("Placeholders must be used once each, in order")
+            sql, unprepared, count, model_query = query, re.sub(r"\$\d+", "%s", query), len(numbers), None
+        else:
+            unprepared, params = query.sql()
+            if "%%" in unprepared:
+                raise ValueError("Queries with literal % can't be prepared")
+            placeholders = iter(range(1, len(params) + 1))
+            sql = re.sub("%s", lambda _: f"${next(placeholders)}", unprepared)
+            count, model_query = len(params), query
+
+        arguments = f"({', '.join(['%s'] * count)})" if count else ""
+        statement = Statement(name, sql, unprepared, f"EXECUTE lp_{name}{arguments}", model_query)
+        self.statements[name] = statement
+        return statement
+
+    def _prepare(self, db: Any, connection: Any, names: List[str]) -> None:
+        sql = "; ".join(f"PREPARE lp_{name} AS {self.statements[name].sql}" for name in names)
+        try:
+            # A raw cursor: this is per-connection setup, so it isn't counted as a query (see `QueryCounter`)
+            with exception_wrapper:
+                connection.cursor().execute(sql)
+        except DatabaseError as exc:
+            if _pgcode(exc) != DUPLICATE_STATEMENT or db.in_transaction():
+                raise
+            # Prepared by a previous owner of this connection we lost track of; prepare the rest one by one
+            with exception_wrapper:
+                cursor = connection.cursor()
+                cursor.execute("SELECT name FROM pg_prepared_statements")
+                existing = {name for (name,) in cursor.fetchall()}
+                for name in names:
+                    if f"lp_{name}" not in existing:
+                        cursor.execute(f"PREPARE lp_{name} AS {self.statements[name].sql}")
+
+        with self._lock:
+            self.prepares += 1
+            self._prepared.setdefault(connection, set()).update(names)
+
+    def execute(self, name: str, *params: Any) -> Any:
+        """
+        Run a registered statement on the current thread's connection.
+
+        :return: The cursor.
+        """
+        from linkpulse.utilities import get_db
+
+        statement = self.statements[name]
+        db = get_db()
+        if not self.enabled:
+            return db.execute_sql(statement.unprepared, params)
+
+        connection = db.connection()
+        with self._lock:
+            prepared = self._prepared.get(connection, set())
+            missing = [other for other in self.statements if other not in prepared]
+        if missing:
+            # Prepare everything at once, so a connection takes a single extra round trip
+            self._prepare(db, connection, missing)
+
+        try:
+            cursor = db.execute_sql(statement.execute, params)
+        except DatabaseError as exc:
+            # Retrying inside a transaction would fail too, as the error aborted it
+            if _pgcode(exc) != INVALID_STATEMENT_NAME or db.in_transaction():
+                raise
+            logger.debug("Prepared statement missing, preparing again", statement=name)
+            with self._lock:
+                self.reprepares += 1
+                self._prepared.pop(connection, None)
+            self._prepare(db, connection, list(self.statements))
+            cursor = db.execute_sql(statement.execute, params)
+
+        self.executions += 1
+        return cursor
+
+    def fetch(self, name: str, *params: Any) -> List[Model]:
+        """
+        Run a statement registered from a model query, returning model instances like the query would.
+        """
+        statement = self.statements[name]
+        if statement.query is None:
+            raise ValueError(f"Statement {name!r} wasn't registered from a query")
+        return list(statement.query._get_cursor_wrapper(self.execute(name, *params)))
+
+    def after_fork(self) -> None:
+        # The child gets fresh connections from the pool
+        with self._lock:
+            self._prepared = weakref.WeakKeyDictionary()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            connections = len(self._prepared)
+        return {
+            "statements": len(self.statements),
+            "connections": connections,
+            "prepares": self.prepares,
+            "reprepares": self.reprepares,
+            "executions": self.executions,
+        }
+
+
+prepared_statements = PreparedStatements(
+    enabled=os.getenv("DB_PREPARED_STATEMENTS", "true").lower() == "true",
+)
+os.register_at_fork(after_in_child=prepared_statements.after_fork)
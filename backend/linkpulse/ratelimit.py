@@ -0,0 +1,187 @@
+"""ratelimit.py
+This module provides the storage behind `RateLimiter`, implementing GCRA (the generic cell rate algorithm).
+
+GCRA keeps a single timestamp per key, the "theoretical arrival time" (TAT), so memory & CPU per key are constant no
+matter how many hits it receives. A limit of N per period allows a burst of N hits, then one hit every period/N; a
+rejected hit is told exactly how long until the next one would be allowed.
+
+Two storages are available, selected with `RATE_LIMIT_STORAGE`:
+    - `memory` (default): a dictionary in this process. With several workers, each enforces the limit separately.
+    - `shared`: a SQLite database on a tmpfs (`RATE_LIMIT_PATH`), shared by every worker process on the host.
+
+Keys whose TAT has passed are indistinguishable from unseen keys, so they're evicted periodically by the scheduler.
+"""
+
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Dict, Optional, Protocol, Tuple
+
+
+def gcra(tat: Optional[float], interval: float, period: float, now: float) -> Tuple[Optional[float], float]:
+    """
+    Apply a hit to a key's theoretical arrival time.
+
+    :param tat: The key's stored TAT, or None if it has none.
+    :param interval: Seconds between hits at the sustained rate, i.e. period / amount.
+    :param period: The limit's period in seconds; up to `period / interval` hits may arrive at once.
+    :return: The TAT to store and 0 if the hit is allowed, otherwise None and the seconds until a hit would be allowed.
+    """
+    new_tat = max(tat if tat is not None else now, now) + interval
+    allow_at = new_tat - period
+    if allow_at > now:
+        return None, allow_at - now
+    return new_tat, 0.0
+
+
+class RateLimitStorage(Protocol):
+    # Whether `hit` may wait on I/O or other processes, so it must be kept off the event loop
+    blocking: bool
+
+    def hit(self, key: str, interval: float, period: float, now: float) -> float:
+        """
+        Atomically apply a hit to `key`.
+
+        :return: 0 if the hit is allowed, otherwise the seconds until one would be.
+        """
+        ...
+
+    def evict(self, now: Optional[float] = None) -> int:
+        """
+        Remove keys that are idle as of `now` (default: the current time), returning how many were removed.
+        """
+        ...
+
+    def after_fork(self) -> None:
+        """
+        Reset process-local state in a forked child.
+        """
+        ...
+
+
+class MemoryStorage:
+    """
+    Per-process storage. Thread-safe, as eviction runs on a scheduler thread.
+    """
+
+    blocking = False
+
+    def __init__(self):
+        self._tats: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def hit(self, key: str, interval: float, period: float, now: float) -> float:
+        with self._lock:
+            tat, retry_after = gcra(self._tats.get(key), interval, period, now)
+            if tat is not None:
+                self._tats[key] = tat
+            return retry_after
+
+    def evict(self, now: Optional[float] = None) -> int:
+        now = time.time() if now is None else now
+        with self._lock:
+            idle = [key for key, tat in self._tats.items() if tat <= now]
+            for key in idle:
+                del self._tats[key]
+            return len(idle)
+
+    def after_fork(self) -> None:
+        # Each worker enforces limits separately with this storage; start from a clean slate
+        self._lock = threading.Lock()
+        self._tats = {}
+
+    def __len__(self) -> int:
+        return len(self._tats)
+
+
+class SharedStorage:
+    """
+    Storage shared between processes through a SQLite database, which should live on a tmpfs such as `/dev/shm`.
+
+    Each hit is a single short write transaction. Durability is disabled, as rate limit state is disposable. A
+    connection is opened per process (lazily, so forked workers never share one).
+
+    A hit waits up to `timeout` seconds for another worker's write lock, so it runs on a thread (see `RateLimiter`).
+    """
+
+    blocking = True
+
+    def __init__(self, path: str, timeout: float = 1.0):
+        self.path = path
+        self.timeout = timeout
+        self._connection: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None or self._pid != os.getpid():
+            connection = sqlite3.connect(
+                self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=OFF")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limit (key TEXT PRIMARY KEY, tat REAL) WITHOUT ROWID"
+            )
+            self._connection, self._pid = connection, os.getpid()
+        return self._connection
+
+    def hit(self, key: str, interval: float, period: float, now: float) -> float:
+        with self._lock:
+            connection = self._connect()
+            # IMMEDIATE takes the write lock up front, so concurrent workers can't both read the same TAT
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = connection.execute("SELECT tat FROM rate_limit WHERE key = ?", (key,)).fetchone()
+                tat, retry_after = gcra(row[0] if row else None, interval, period, now)
+                if tat is not None:
+                    connection.execute(
+                        "INSERT INTO rate_limit (key, tat) VALUES (?, ?)"
+                        " ON CONFLICT (key) DO UPDATE SET tat = excluded.tat",
+                        (key, tat),
+                    )
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            return retry_after
+
+    def evict(self, now: Optional[float] = None) -> int:
+        now = time.time() if now is None else now
+        with self._lock:
+            return self._connect().execute("DELETE FROM rate_limit WHERE tat <= ?", (now,)).rowcount
+
+    def after_fork(self) -> None:
+        # The state lives in the database; only the connection (reopened by `_connect`) and lock are per process
+        self._lock = threading.Lock()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+def _default_path() -> str:
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(directory, "linkpulse-ratelimit.sqlite3")
+
+
+def create_storage(kind: Optional[str] = None) -> RateLimitStorage:
+    """
+    Create the storage selected by `kind`, defaulting to `RATE_LIMIT_STORAGE` or `memory`.
+    """
+    if kind is None:
+        kind = os.getenv("RATE_LIMIT_STORAGE", "memory")
+
+    if kind == "memory":
+        return MemoryStorage()
+    if kind == "shared":
+        return SharedStorage(os.getenv("RATE_LIMIT_PATH") or _default_path())
+    raise ValueError(f"Unknown rate limit storage: {kind}")
+
+
+rate_limit_storage = create_storage()
+os.register_at_fork(after_in_child=rate_limit_storage.after_fork)
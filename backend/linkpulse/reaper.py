@@ -0,0 +1,89 @@
+"""reaper.py
+This module provides the scheduled job that deletes expired sessions.
+
+Sessions are otherwise only removed when presented after expiry (see `Session.is_expired`), so abandoned sessions would
+accumulate forever. Deletion happens in small, separately committed batches, so row locks are only held briefly and
+concurrent session lookups are never stalled behind one large DELETE.
+"""
+
+import os
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+import structlog
+
+logger = structlog.get_logger()
+
+
+class SessionReaper:
+    def __init__(self, batch_size: Optional[int] = None, sleep: Optional[float] = None):
+        """
+        :param batch_size: Maximum sessions deleted per statement. Defaults to `SESSION_REAP_BATCH_SIZE` or 1000.
+        :param sleep: Seconds to wait between batches. Defaults to `SESSION_REAP_SLEEP` or 0.1.
+        """
+        if batch_size is None:
+            batch_size = int(os.getenv("SESSION_REAP_BATCH_SIZE", "1000"))
+        if sleep is None:
+            sleep = float(os.getenv("SESSION_REAP_SLEEP", "0.1"))
+
+        if batch_size <= 0:
+            raise ValueError("batch_size must be positive")
+
+        self.batch_size = batch_size
+        self.sleep = sleep
+        self.interval = float(os.getenv("SESSION_REAP_INTERVAL", "3600"))
+
+    def reap_batch(self, now: Optional[datetime] = None) -> int:
+        """
+        Delete up to `batch_size` sessions that expired before `now` in a single statement.
+        Rows locked by other transactions are skipped rather than waited on; they'll be picked up next run.
+        """
+        from linkpulse.models import Session
+        from linkpulse.utilities import get_db, utc_now
+
+        if now is None:
+            now = utc_now()
+        # expiry is stored as a naive UTC timestamp; compare like for like so the expiry index is used
+        now = now.astimezone(timezone.utc).replace(tzinfo=None)
+
+        expired = (
+            Session.select(Session.token)
+            .where(Session.expiry < now)
+            .order_by(Session.expiry)
+            .limit(self.batch_size)
+            .for_update("FOR UPDATE SKIP LOCKED")
+        )
+
+        with get_db().connection_context():
+            return Session.delete().where(Session.token.in_(expired)).execute()
+
+    def run(self, now: Optional[datetime] = None) -> int:
+        """
+        Delete all sessions that expired before `now` (default: the current time), batch by batch.
+
+        :return: The number of sessions deleted.
+        :rtype: int
+        """
+        start = time.perf_counter()
+        total = batches = 0
+
+        while True:
+            count = self.reap_batch(now)
+            total += count
+            batches += 1
+
+            if count < self.batch_size:
+                break
+            time.sleep(self.sleep)
+
+        logger.info(
+            "Reaped expired sessions",
+            count=total,
+            batches=batches,
+            duration_ms="{:.2f}".format((time.perf_counter() - start) * 1000),
+        )
+        return total
+
+
+session_reaper = SessionReaper()
@@ -0,0 +1,414 @@
+"""response_cache.py
+This module caches whole API responses, as the backend & decorator used with `fastapi_cache`.
+
+`ResponseCache` is a bounded LRU backend: the least recently used entries are evicted once either the entry count
+(`API_CACHE_SIZE`) or the total size of the cached bodies (`API_CACHE_MAX_BYTES`) is exceeded.
+
+It also coalesces recomputation. When a key is missing or expired, the first request runs the handler and every
+concurrent request for the same key awaits that result, rather than all of them running the handler (and its queries)
+at once. With `API_CACHE_STALE` set, an expired entry is served for up to that many more seconds while a single
+background task refreshes it.
+
+Coalescing needs the handler to be called through the backend, which `fastapi_cache.decorator.cache` doesn't do, so
+endpoints are decorated with `cached` from this module instead.
+
+Responses carry a strong ETag (a hash of the body, computed once when an entry is stored, so it's the same in every
+worker) and a `Cache-Control` derived from the entry's remaining lifetime. A matching `If-None-Match` is answered with
+a `304` from the cache entry, without running the handler or serializing anything. Endpoints that can't be cached
+server-side, such as per-user ones, can still answer conditional requests with `conditional`.
+"""
+
+import asyncio
+import hashlib
+import math
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import wraps
+from inspect import Parameter, Signature, isawaitable
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+import orjson
+import structlog
+from fastapi import status
+from fastapi.dependencies.utils import get_typed_signature
+from fastapi.encoders import jsonable_encoder
+from fastapi_cache import FastAPICache
+from fastapi_cache.types import Backend
+from starlette.requests import Request
+from starlette.responses import Response
+
+logger = structlog.get_logger()
+
+
+def etag(body: bytes) -> str:
+    """
+    A strong ETag for a response body.
+    """
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+def etag_matches(if_none_match: Optional[str], tag: str) -> bool:
+    """
+    Whether an `If-None-Match` header matches `tag`, using the weak comparison required for it (RFC 9110 13.1.2).
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(candidate.strip().removeprefix("W/") == tag for candidate in if_none_match.split(","))
+
+
+@dataclass(slots=True)
+class CacheEntry:
+    data: bytes
+    etag: str
+    # Monotonic time the entry expires at; infinite if it never does
+    expires_at: float
+
+
+class ResponseCache(Backend):
+    """
+    A bounded LRU `fastapi_cache` backend with request coalescing & optional stale-while-revalidate.
+
+    All methods run on the event loop, so no locking is needed.
+    """
+
+    def __init__(self, maxsize: int, max_bytes: int, stale: float = 0):
+        """
+        :param maxsize: The maximum number of entries held at once. 0 disables storage, but requests still coalesce.
+        :param max_bytes: The maximum total size of the cached values.
+        :param stale: Seconds an expired entry may still be served while it's refreshed in the background.
+        """
+        if maxsize < 0:
+            raise ValueError("maxsize must not be negative")
+        if max_bytes < 0:
+            raise ValueError("max_bytes must not be negative")
+        if stale < 0:
+            raise ValueError("stale must not be negative")
+
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.stale = stale
+
+        self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        self._inflight: Dict[str, asyncio.Task[CacheEntry]] = {}
+        self.bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _get(self, key: str, now: float) -> Optional[CacheEntry]:
+        """
+        Return the entry if it's fresh or within the stale window, refreshing its LRU position.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at + self.stale <= now:
+            self._remove(key)
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self.bytes -= len(entry.data)
+
+    def _store(self, key: str, data: bytes, expire: Optional[int]) -> CacheEntry:
+        entry = CacheEntry(data, etag(data), time.monotonic() + expire if expire else math.inf)
+        if key in self._entries:
+            self._remove(key)
+        if self.maxsize == 0 or len(data) > self.max_bytes:
+            return entry
+
+        self._entries[key] = entry
+        self.bytes += len(data)
+
+        while len(self._entries) > self.maxsize or self.bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.bytes -= len(evicted.data)
+            self.evictions += 1
+        return entry
+
+    @staticmethod
+    def _ttl(entry: CacheEntry, now: float) -> int:
+        # -1 for entries that never expire, as Redis reports them
+        if entry.expires_at == math.inf:
+            return -1
+        return max(0, math.ceil(entry.expires_at - now))
+
+    async def get_with_ttl(self, key: str) -> Tuple[int, Optional[bytes]]:
+        now = time.monotonic()
+        entry = self._get(key, now)
+        if entry is None or entry.expires_at <= now:
+            self.misses += 1
+            return 0, None
+        self.hits += 1
+        return self._ttl(entry, now), entry.data
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return (await self.get_with_ttl(key))[1]
+
+    async def set(self, key: str, value: bytes, expire: Optional[int] = None) -> None:
+        self._store(key, value, expire)
+
+    async def clear(self, namespace: Optional[str] = None, key: Optional[str] = None) -> int:
+        """
+        Remove the entries under `namespace`, or the single `key`, or everything if neither is given.
+        """
+        if namespace:
+            keys = [existing for existing in self._entries if existing.startswith(namespace)]
+        elif key:
+            keys = [key] if key in self._entries else []
+        else:
+            keys = list(self._entries)
+
+        for existing in keys:
+            self._remove(existing)
+        return len(keys)
+
+    async def get_or_set(
+        self, key: str, compute: Callable[[], Awaitable[bytes]], expire: Optional[int] = None
+    ) -> Tuple[str, int, CacheEntry]:
+        """
+        Return the cached value for `key`, computing & storing it if missing or expired.
+        Only one computation per key runs at a time; concurrent callers share its result (or exception).
+
+        :param compute: Produces the value to cache.
+        :param expire: Seconds the computed value is fresh for; None or 0 to never expire.
+        :return: The cache status (`HIT`, `STALE`, `COALESCED` or `MISS`), the remaining TTL (-1 if the value never
+                 expires) & the entry.
+        """
+        now = time.monotonic()
+        entry = self._get(key, now)
+        if entry is not None and entry.expires_at > now:
+            self.hits += 1
+            return "HIT", self._ttl(entry, now), entry
+
+        refresh = self._inflight.get(key)
+        if entry is not None:
+            # Within the stale window: serve the expired value, while a single task refreshes it
+            self.stale_hits += 1
+            if refresh is None:
+                self._refresh(key, compute, expire).add_done_callback(_log_refresh_failure)
+            return "STALE", 0, entry
+
+        ttl = expire or -1
+        if refresh is not None:
+            self.coalesced += 1
+            # Shielded, so a caller disconnecting doesn't cancel the computation the others are waiting on
+            return "COALESCED", ttl, await asyncio.shield(refresh)
+
+        self.misses += 1
+        return "MISS", ttl, await asyncio.shield(self._refresh(key, compute, expire))
+
+    def _refresh(
+        self, key: str, compute: Callable[[], Awaitable[bytes]], expire: Optional[int]
+    ) -> asyncio.Task[CacheEntry]:
+        async def refresh() -> CacheEntry:
+            try:
+                return self._store(key, await compute(), expire)
+            finally:
+                self._inflight.pop(key, None)
+
+        task = asyncio.create_task(refresh(), name=f"cache-refresh:{key}")
+        self._inflight[key] = task
+        return task
+
+    def close(self) -> None:
+        """
+        Cancel in-progress computations, which belong to the event loop that is shutting down.
+        """
+        for task in self._inflight.values():
+            task.cancel()
+        self._inflight.clear()
+
+    def after_fork(self) -> None:
+        """
+        Empty the cache in a forked child; computations in progress belong to the parent's event loop.
+        """
+        self._entries.clear()
+        self._inflight = {}
+        self.bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Counters for sizing the cache. These are cumulative for the lifetime of the process.
+        """
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale_hits": self.stale_hits,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+def _log_refresh_failure(task: "asyncio.Task[CacheEntry]") -> None:
+    # Nobody awaits a background refresh, so its failure would otherwise go unreported
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning("Background cache refresh failed", task=task.get_name(), exc_info=task.exception())
+
+
+def _uncacheable(request: Request) -> bool:
+    if not FastAPICache.get_enable():
+        return True
+    if request.method != "GET":
+        return True
+    return request.headers.get("Cache-Control") == "no-store"
+
+
+def _encode(result: Any) -> bytes:
+    return orjson.dumps(jsonable_encoder(result))
+
+
+def _with_request(func: Callable[..., Awaitable[Any]]) -> Tuple[Signature, str, bool]:
+    """
+    The endpoint's signature, with a `Request` parameter added if it has none.
+
+    :return: The signature, the request parameter's name & whether it was added (so must not be passed on).
+    """
+    signature = get_typed_signature(func)
+    parameters = list(signature.parameters.values())
+    existing = next((param for param in parameters if param.annotation is Request), None)
+    if existing is not None:
+        return signature, existing.name, False
+
+    param = Parameter("_cache_request", Parameter.KEYWORD_ONLY, annotation=Request)
+    # Keyword-only parameters must precede **kwargs
+    position = len(parameters) - (parameters[-1].kind is Parameter.VAR_KEYWORD if parameters else 0)
+    parameters.insert(position, param)
+    return signature.replace(parameters=parameters), param.name, True
+
+
+def cache_control(ttl: int, private: bool = False) -> str:
+    """
+    The `Cache-Control` for a response with `ttl` seconds left to live, or -1 if it never expires. Such responses
+    may change on the next deployment, so clients revalidate them on every use, which is cheap with an ETag.
+    """
+    directive = f"max-age={ttl}" if ttl >= 0 else "no-cache"
+    return f"private, {directive}" if private else directive
+
+
+def conditional_response(request: Request, body: bytes, tag: str, headers: Dict[str, str]) -> Response:
+    """
+    Answer with `304 Not Modified` if the request's `If-None-Match` matches `tag`, otherwise with the JSON `body`.
+    """
+    headers = {**headers, "ETag": tag}
+    if etag_matches(request.headers.get("If-None-Match"), tag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+def cached(
+    expire: Optional[int] = None, namespace: str = ""
+) -> Callable[[Callable[..., Awaitable[Any]]], Callable[..., Awaitable[Any]]]:
+    """
+    Cache an async endpoint's JSON response in the `FastAPICache` backend, keyed by its arguments.
+
+    Unlike `fastapi_cache.decorator.cache`, concurrent requests for a missing key are coalesced (with `ResponseCache`),
+    and hits are answered with the cached bytes rather than decoded & serialized again. `Cache-Control: no-store`
+    bypasses the cache; `no-cache` doesn't force a recomputation, as that would defeat coalescing.
+
+    :param expire: Seconds a response is fresh for; None to never expire.
+    :param namespace: Added to the key prefix, so the namespace can be cleared on its own.
+    """
+
+    def decorator(func: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+        signature, request_name, injected = _with_request(func)
+
+        @wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            request: Request = kwargs.pop(request_name) if injected else kwargs[request_name]
+            if _uncacheable(request):
+                return await func(*args, **kwargs)
+
+            key_kwargs = {name: value for name, value in kwargs.items() if name != request_name}
+            key = FastAPICache.get_key_builder()(
+                func,
+                f"{FastAPICache.get_prefix()}:{namespace}",
+                request=request,
+                response=None,
+                args=args,
+                kwargs=key_kwargs,
+            )
+            if isawaitable(key):
+                key = await key
+
+            async def compute() -> bytes:
+                return _encode(await func(*args, **kwargs))
+
+            backend = FastAPICache.get_backend()
+            if isinstance(backend, ResponseCache):
+                cache_status, ttl, entry = await backend.get_or_set(key, compute, expire)
+                body, tag = entry.data, entry.etag
+            else:
+                ttl, data = await backend.get_with_ttl(key)
+                cache_status = "HIT"
+                if data is None:
+                    data = await compute()
+                    await backend.set(key, data, expire)
+                    ttl, cache_status = expire or -1, "MISS"
+                body, tag = data, etag(data)
+
+            headers = {
+                FastAPICache.get_cache_status_header(): cache_status,
+                "Cache-Control": cache_control(ttl),
+            }
+            return conditional_response(request, body, tag, headers)
+
+        wrapper.__signature__ = signature  # type: ignore[attr-defined]
+        return wrapper
+
+    return decorator
+
+
+def conditional(
+    private: bool = True,
+) -> Callable[[Callable[..., Awaitable[Any]]], Callable[..., Awaitable[Any]]]:
+    """
+    Answer conditional requests to an async endpoint whose JSON response isn't cached server-side, such as a
+    per-user one. The endpoint still runs, but clients don't download a body they already have. Responses that the
+    endpoint builds itself (e.g. errors) are returned as they are.
+
+    :param private: Whether the response is specific to the user, so shared caches must not store it.
+    """
+
+    def decorator(func: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+        signature, request_name, injected = _with_request(func)
+
+        @wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            request: Request = kwargs.pop(request_name) if injected else kwargs[request_name]
+            result = await func(*args, **kwargs)
+            if isinstance(result, Response):
+                return result
+
+            body = _encode(result)
+            headers = {"Cache-Control": cache_control(-1, private)}
+            return conditional_response(request, body, etag(body), headers)
+
+        wrapper.__signature__ = signature  # type: ignore[attr-defined]
+        return wrapper
+
+    return decorator
+
+
+response_cache = ResponseCache(
+    maxsize=int(os.getenv("API_CACHE_SIZE", "1000")),
+    max_bytes=int(os.getenv("API_CACHE_MAX_BYTES", str(16 * 1024 * 1024))),
+    stale=float(os.getenv("API_CACHE_STALE", "0")),
+)
+os.register_at_fork(after_in_child=response_cache.after_fork)
@@ -1,25 +1,23 @@
+import base64
 from datetime import datetime, timedelta
-from typing import Annotated, Optional, Tuple
+from typing import Annotated, List, Optional, Tuple
 
 import structlog
-from fastapi import APIRouter, Depends, Response, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from linkpulse.cache import session_cache
+from linkpulse.database import run_db
 from linkpulse.dependencies import RateLimiter, SessionDependency
+from linkpulse.hashing import hashing_pool
 from linkpulse.models import Session, User
+from linkpulse.response_cache import conditional
+from linkpulse.tokens import session_signer
 from linkpulse.utilities import utc_now, is_development
-from pwdlib import PasswordHash
-from pwdlib.hashers.argon2 import Argon2Hasher
 from pydantic import BaseModel, EmailStr, Field
 
 logger = structlog.get_logger()
 
 router = APIRouter()
 
-hasher = PasswordHash([Argon2Hasher()])
-# cspell: disable
-dummy_hash = (
-    "$argon2id$v=19$m=65536,t=3,p=4$Ii3hm5/NqcJddQDFK24Wtw$I99xV/qkaLROo0VZcvaZrYMAD9RTcWzxY5/RbMoRLQ4"
-)
-
 # Session expiry times
 default_session_expiry = timedelta(hours=12)
 remember_me_session_expiry = timedelta(days=14)
@@ -43,7 +41,7 @@ def validate_session(token: str, user: bool = True) -> Tuple[bool, bool, Optiona
     :rtype: Tuple[bool, bool, Optional[User]]
     """
     # Check if session exists
-    session = Session.get_or_none(Session.token == token)
+    session = Session.resolve(token)
     if session is None:
         return False, False, None
 
@@ -73,21 +71,24 @@ class LoginSuccess(BaseModel):
 
 @router.post(
     "/api/login",
-    responses={200: {"model": LoginSuccess}, 401: {"model": LoginError}},
+    responses={
+        200: {"model": LoginSuccess},
+        401: {"model": LoginError},
+        503: {"description": "Too many concurrent logins, see Retry-After"},
+    },
     dependencies=[Depends(RateLimiter("6/minute"))],
 )
 async def login(body: LoginBody, response: Response):
     # Acquire user by email
-    user = User.get_or_none(User.email == body.email)
+    user = await run_db(User.by_email, body.email)
 
     if user is None:
         # Hash regardless of user existence to prevent timing attacks
-        hasher.verify(body.password, dummy_hash)
+        await hashing_pool.verify_dummy(body.password)
         response.status_code = status.HTTP_401_UNAUTHORIZED
         return LoginError(error="Invalid email or password")
 
-    logger.warning("Hash", hash=user.password_hash)
-    valid, updated_hash = hasher.verify_and_update(body.password, user.password_hash)
+    valid, updated_hash = await hashing_pool.verify_and_update(body.password, user.password_hash)
 
     # Check if password matches, return 401 if not
     if not valid:
@@ -97,20 +98,22 @@ async def login(body: LoginBody, response: Response):
     # Update password hash if necessary
     if updated_hash:
         user.password_hash = updated_hash
-        user.save()
+        await run_db(user.save)
 
     # Create session
     token = Session.generate_token()
     session_duration = remember_me_session_expiry if body.remember_me else default_session_expiry
-    session = Session.create(
+    session = await run_db(
+        Session.create,
         token=token,
         user=user,
         expiry=utc_now() + session_duration,
     )
 
-    # Set Cookie of session token
+    # Set Cookie of session token, signed if signing keys are configured
+    cookie = token if session_signer is None else session_signer.sign(token, user.id, session.expiry)
     max_age = int(session_duration.total_seconds())
-    response.set_cookie("session", token, max_age=max_age, secure=not is_development, httponly=True)
+    response.set_cookie("session", cookie, max_age=max_age, secure=not is_development, httponly=True)
     return {"email": user.email, "expiry": session.expiry}
 
 
@@ -122,10 +125,12 @@ async def logout(
 ):
     # We can assume the session is valid via the dependency
     if not all:
-        session.delete_instance()
+        await run_db(Session.delete_by_token, session.token)
+        session_cache.invalidate(session.token)
         logger.debug("Session deleted", user=session.user.email, token=session.token)
     else:
-        count = Session.delete().where(Session.user == session.user).execute()
+        count = await run_db(Session.delete().where(Session.user == session.user).execute)
+        session_cache.invalidate_where(lambda cached: cached.user_id == session.user_id)
         logger.debug("All sessions deleted", user=session.user.email, count=count, source_token=session.token)
 
     response.delete_cookie("session")
@@ -143,6 +148,7 @@ async def register():
 
 
 @router.get("/api/session")
+@conditional()
 async def session(session: Annotated[Session, Depends(SessionDependency(required=True))]):
     # Returns the session information for the current session
     return {
@@ -152,13 +158,81 @@ async def session(session: Annotated[Session, Depends(SessionDependency(required
     }
 
 
+class SessionInfo(BaseModel):
+    # Not the token, which is a bearer credential; see `Session.public_id`
+    id: str
+    created_at: datetime
+    last_used: Optional[datetime]
+    expiry: datetime
+    current: bool
+
+
+class SessionPage(BaseModel):
+    sessions: List[SessionInfo]
+    # Pass as `cursor` to fetch the next page; null on the last page
+    next_cursor: Optional[str]
+
+
+def encode_cursor(created_at: datetime, public_id: str) -> str:
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{public_id}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        created_at, public_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), public_id
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor") from None
+
+
+async def list_sessions(current: Session, user_id: int, limit: int, cursor: Optional[str]) -> SessionPage:
+    after = decode_cursor(cursor) if cursor is not None else None
+    # One extra row tells whether there's another page
+    page = await run_db(Session.page_for_user, user_id, limit + 1, after)
+
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        next_cursor = encode_cursor(page[-1].created_at, Session.public_id(page[-1].token))
+
+    return SessionPage(
+        sessions=[
+            SessionInfo(
+                id=Session.public_id(row.token),
+                created_at=row.created_at,
+                last_used=row.last_used,
+                expiry=row.expiry,
+                current=row.token == current.token,
+            )
+            for row in page
+        ],
+        next_cursor=next_cursor,
+    )
+
+
 @router.get("/api/sessions")
-async def sessions(session: Annotated[Session, Depends(SessionDependency(required=True))]):
-    # Returns a list of all active sessions for this user
-    return {}
+async def sessions(
+    session: Annotated[Session, Depends(SessionDependency(required=True))],
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+) -> SessionPage:
+    # Returns a page of the active sessions for this user, oldest first
+    return await list_sessions(session, session.user_id, limit, cursor)  # type: ignore
+
+
+@router.get("/api/user/{id}/sessions")
+async def user_sessions(
+    id: int,
+    session: Annotated[Session, Depends(SessionDependency(required=True))],
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+) -> SessionPage:
+    # Users may only list their own sessions, for now
+    if id != session.user_id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Forbidden")
+    return await list_sessions(session, id, limit, cursor)
 
 
-# GET /api/user/{id}/sessions
 # GET /api/user/{id}/sessions/{token}
 # DELETE /api/user/{id}/sessions
 # POST /api/user/{id}/logout (delete all sessions)
@@ -4,9 +4,12 @@ from pathlib import Path
 from typing import Any
 
 import structlog
-import toml
-from fastapi import APIRouter
-from fastapi_cache.decorator import cache
+from fastapi import APIRouter, status
+from fastapi.responses import ORJSONResponse, PlainTextResponse
+from linkpulse.database import run_db
+from linkpulse.health import readiness
+from linkpulse.metrics import registry
+from linkpulse.response_cache import cached
 from linkpulse.utilities import get_db
 
 logger = structlog.get_logger(__name__)
@@ -16,44 +19,83 @@ router = APIRouter()
 db = get_db()
 
 
+def read_version() -> str:
+    """Read the version from pyproject.toml in a source checkout, otherwise from the installed package's metadata.
+    :return: The version, or "error" if it can't be found.
+    :rtype: str
+    """
+    pyproject_path = Path(__file__).parent.parent.parent / "pyproject.toml"
+    if pyproject_path.is_file():
+        import tomllib
+
+        with pyproject_path.open("rb") as file:
+            return tomllib.load(file)["tool"]["poetry"]["version"]
+
+    from importlib.metadata import PackageNotFoundError, version
+
+    try:
+        return version("linkpulse")
+    except PackageNotFoundError:
+        return "error"
+
+
+# Read once at import, rather than on every request
+VERSION = read_version()
+
+
 @router.get("/api/version")
-@cache(expire=None)
+@cached(expire=None)
 async def version() -> dict[str, str]:
     """Get the version of the API.
     :return: The version of the API.
     :rtype: dict[str, str]
     """
-
-    pyproject_path = Path(__file__).parent.parent.parent / "pyproject.toml"
-
-    version = "unknown"
-    if pyproject_path.exists() and pyproject_path.is_file():
-        data = toml.load(pyproject_path)
-        version = data["tool"]["poetry"]["version"]
-        logger.debug("Version loaded from pyproject.toml", version=version)
-    else:
-        version = "error"
-
-    return {"version": version}
+    return {"version": VERSION}
 
 
 @router.get("/health")
+@router.get("/health/live")
 async def health():
-    """An endpoint to check if the service is running.
+    """Liveness: the process is up & serving requests. Dependencies aren't checked, see `/health/ready`.
     :return: OK
     :rtype: Literal['OK']"""
-    # TODO: Check database connection
     return "OK"
 
 
+@router.get("/health/ready")
+async def ready() -> ORJSONResponse:
+    """Readiness: the database is reachable, all migrations are applied & the scheduler is running.
+    Results are cached briefly & shared by concurrent probes, see `linkpulse.health`.
+    :return: Each check's result, with 503 if any failed.
+    :rtype: ORJSONResponse"""
+    is_ready, checks = await readiness.check()
+    return ORJSONResponse(
+        {"status": "ready" if is_ready else "unavailable", "checks": checks},
+        status_code=status.HTTP_200_OK if is_ready else status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={"Cache-Control": "no-store"},
+    )
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics() -> PlainTextResponse:
+    """Request & runtime metrics, in the Prometheus text format.
+    With `METRICS_DIR` set, this includes every worker process on the host.
+    :return: The metrics.
+    :rtype: PlainTextResponse"""
+    # Rendered on the event loop, as that's where metrics are updated; snapshots are never taken mid-update
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
 @router.get("/api/migration")
-@cache(expire=60)
+@cached(expire=60)
 async def get_migration() -> dict[str, Any]:
     """Get the last migration name and timestamp from the migratehistory table.
     :return: The last migration name and timestamp.
     :rtype: dict[str, Any]
     """
     # Kind of insecure, but this is just a demo thing to show that migratehistory is available.
-    cursor = db.execute_sql("SELECT name, migrated_at FROM migratehistory ORDER BY migrated_at DESC LIMIT 1")
+    cursor = await run_db(
+        db.execute_sql, "SELECT name, migrated_at FROM migratehistory ORDER BY migrated_at DESC LIMIT 1"
+    )
     name, migrated_at = cursor.fetchone()
     return {"name": name, "migrated_at": migrated_at}
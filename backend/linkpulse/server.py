@@ -0,0 +1,143 @@
+"""server.py
+This module starts the application server, for both development and production (`python -m linkpulse serve`).
+
+Options come from the command line, falling back to environment variables, then defaults:
+    --server      SERVER             hypercorn or uvicorn (default: hypercorn)
+    --host        HOST               (default: 0.0.0.0 in development, :: otherwise)
+    --port        PORT               (default: 8000)
+    --workers     WEB_CONCURRENCY    worker processes (default: 1)
+    --backlog     SERVER_BACKLOG     pending connection queue size (default: 2048)
+    --keep-alive  SERVER_KEEP_ALIVE  seconds idle connections are kept open (default: 5)
+    --http2       SERVER_HTTP2       offer HTTP/2, hypercorn only (default: false)
+    --reload      SERVER_RELOAD      restart on code changes (default: true in development)
+
+Both servers start workers as fresh (spawned) processes, each importing the app & opening its own database pool,
+scheduler and caches. Anything that does fork a process with live state instead is covered by the `after_fork` hooks
+registered next to each of those objects.
+"""
+
+import argparse
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Optional, Sequence
+
+import structlog
+from linkpulse.utilities import is_development
+
+logger = structlog.get_logger()
+
+APP = "linkpulse.app:app"
+SERVERS = ("hypercorn", "uvicorn")
+
+# Server loggers propagate to the root logger, which is configured by `setup_logging`
+LOG_CONFIG: Dict[str, Any] = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "loggers": {
+        name: {"propagate": True} for name in ("uvicorn", "uvicorn.access", "hypercorn", "hypercorn.access")
+    },
+}
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+@dataclass(frozen=True)
+class ServeOptions:
+    server: str = "hypercorn"
+    host: str = "::"
+    port: int = 8000
+    workers: int = 1
+    backlog: int = 2048
+    keep_alive: float = 5.0
+    http2: bool = False
+    reload: bool = False
+
+    @classmethod
+    def parse(cls, args: Sequence[str] = ()) -> "ServeOptions":
+        parser = argparse.ArgumentParser(prog="linkpulse serve", description="Start the application server.")
+        parser.add_argument("--server", choices=SERVERS, default=os.getenv("SERVER", "hypercorn"))
+        parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0" if is_development else "::"))
+        parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+        parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "1")))
+        parser.add_argument("--backlog", type=int, default=int(os.getenv("SERVER_BACKLOG", "2048")))
+        parser.add_argument("--keep-alive", type=float, default=float(os.getenv("SERVER_KEEP_ALIVE", "5")))
+        parser.add_argument(
+            "--http2", action=argparse.BooleanOptionalAction, default=_env_bool("SERVER_HTTP2", False)
+        )
+        parser.add_argument(
+            "--reload",
+            action=argparse.BooleanOptionalAction,
+            default=_env_bool("SERVER_RELOAD", is_development),
+        )
+        options = parser.parse_args(list(args))
+
+        if options.workers < 1:
+            parser.error("--workers must be at least 1")
+        if options.http2 and options.server == "uvicorn":
+            parser.error("uvicorn does not support HTTP/2, use --server hypercorn")
+
+        return cls(
+            server=options.server,
+            host=options.host,
+            port=options.port,
+            workers=options.workers,
+            backlog=options.backlog,
+            keep_alive=options.keep_alive,
+            http2=options.http2,
+            reload=options.reload,
+        )
+
+
+def _clear_metrics(directory: Optional[str]) -> None:
+    # Snapshots left by a previous run's workers would otherwise be counted again
+    if directory:
+        for path in Path(directory).glob("*.json"):
+            path.unlink(missing_ok=True)
+
+
+def serve(options: ServeOptions) -> None:
+    workers = options.workers
+    if options.reload and workers > 1:
+        logger.warning("Reloading is not supported with multiple workers, using one", workers=workers)
+        workers = 1
+
+    _clear_metrics(os.getenv("METRICS_DIR"))
+    logger.debug("Starting server", **{**options.__dict__, "workers": workers})
+
+    if options.server == "uvicorn":
+        import uvicorn
+
+        uvicorn.run(
+            APP,
+            host=options.host,
+            port=options.port,
+            workers=workers,
+            reload=options.reload,
+            backlog=options.backlog,
+            timeout_keep_alive=int(options.keep_alive),
+            log_config=LOG_CONFIG,
+        )
+        return
+
+    from hypercorn.config import Config
+    from hypercorn.run import run
+
+    config = Config()
+    config.application_path = APP
+    # IPv6 addresses must be bracketed
+    config.bind = [
+        f"[{options.host}]:{options.port}" if ":" in options.host else f"{options.host}:{options.port}"
+    ]
+    config.workers = workers
+    config.backlog = options.backlog
+    config.keep_alive_timeout = options.keep_alive
+    config.alpn_protocols = ["h2", "http/1.1"] if options.http2 else ["http/1.1"]
+    config.use_reloader = options.reload
+    config.logconfig_dict = LOG_CONFIG
+    run(config)
@@ -1,6 +1,11 @@
+import subprocess
+import sys
+
 from fastapi.testclient import TestClient
 
+from linkpulse import app as app_module
 from linkpulse.app import app
+from linkpulse.health import readiness
 
 
 def test_health():
@@ -8,9 +13,72 @@ def test_health():
         response = client.get("/health")
         assert response.status_code == 200
         assert response.json() == "OK"
+        assert client.get("/health/live").status_code == 200
+
+
+def test_ready():
+    with TestClient(app) as client:
+        response = client.get("/health/ready")
+        assert response.status_code == 200
+        assert response.json() == {
+            "status": "ready",
+            "checks": {"database": "ok", "migrations": "ok", "scheduler": "ok"},
+        }
+
+
+def test_ready_scheduler_stopped():
+    with TestClient(app) as client:
+        scheduler, app_module.scheduler = app_module.scheduler, None
+        readiness.invalidate()
+        try:
+            response = client.get("/health/ready")
+        finally:
+            app_module.scheduler = scheduler
+        assert response.status_code == 503
+        assert response.json()["checks"]["scheduler"] == "not running"
 
 
 def test_migration():
     with TestClient(app) as client:
         response = client.get("/api/migration")
         assert response.status_code == 200
+
+
+def test_lazy_imports():
+    # Heavy dependencies are imported on first use, not when the app is imported
+    code = "import sys, linkpulse.app; print(','.join(m for m in {} if m in sys.modules))".format(
+        ("apscheduler", "limits", "pwdlib", "argon2", "toml")
+    )
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == ""
+
+
+def test_database_unavailable(monkeypatch):
+    from linkpulse.routers import misc
+    from peewee import OperationalError
+
+    async def unavailable(*_):
+        raise OperationalError("connection refused")
+
+    monkeypatch.setattr(misc, "run_db", unavailable)
+    with TestClient(app) as client:
+        response = client.get("/api/migration", headers={"Cache-Control": "no-store"})
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "1"
+
+
+def test_migrate_on_startup(monkeypatch):
+    from linkpulse import migrate
+
+    calls = 0
+
+    def apply_all() -> dict:
+        nonlocal calls
+        calls += 1
+        return {}
+
+    monkeypatch.setenv("MIGRATE_ON_STARTUP", "true")
+    monkeypatch.setattr(migrate, "apply_all", apply_all)
+    with TestClient(app) as client:
+        assert client.get("/health").status_code == 200
+    assert calls == 1
@@ -0,0 +1,43 @@
+import asyncio
+
+from linkpulse.benchmarks.api import compare, run
+from linkpulse.benchmarks.startup import parse_importtime
+from linkpulse.models import User
+
+
+def test_benchmark_run():
+    results = asyncio.run(run(["session", "health"], concurrency=2, requests=10, warmup=2))
+
+    assert set(results["results"]) == {"session", "health"}
+    for result in results["results"].values():
+        assert result["errors"] == 0
+        assert result["rps"] > 0
+        assert result["p50_ms"] <= result["p95_ms"] <= result["p99_ms"]
+    assert results["results"]["health"]["queries_per_request"] == 0
+
+    # Benchmark users are removed afterwards
+    assert User.select().where(User.email.startswith("bench-")).count() == 0
+
+
+def test_benchmark_compare():
+    baseline = {"results": {"health": {"rps": 1000, "p95_ms": 1.0, "p99_ms": 2.0, "queries_per_request": 0}}}
+    within = {"results": {"health": {"rps": 950, "p95_ms": 1.05, "p99_ms": 2.1, "queries_per_request": 0}}}
+    worse = {"results": {"health": {"rps": 800, "p95_ms": 1.0, "p99_ms": 2.0, "queries_per_request": 1}}}
+
+    assert compare(within, baseline, threshold=0.1) == []
+    assert {regression["metric"] for regression in compare(worse, baseline, threshold=0.1)} == {
+        "rps",
+        "queries_per_request",
+    }
+
+
+def test_parse_importtime():
+    output = "\n".join(
+        [
+            "import time: self [us] | cumulative | imported package",
+            "import time:       120 |        120 |     linkpulse.cache",
+            "import time:      3000 |       3120 |   linkpulse.models",
+            "some unrelated log line",
+        ]
+    )
+    assert parse_importtime(output) == [("linkpulse.cache", 120, 120, 2), ("linkpulse.models", 3000, 3120, 1)]
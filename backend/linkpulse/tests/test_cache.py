@@ -0,0 +1,95 @@
+import time
+
+from fastapi import status
+from fastapi.testclient import TestClient
+from linkpulse.app import app
+from linkpulse.cache import TTLCache, session_cache
+from linkpulse.tests.test_session import expired_session, session
+from linkpulse.tests.test_user import user
+
+
+def test_ttl_cache_lru_eviction():
+    cache: TTLCache[str, int] = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # 'b' is now least recently used
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_ttl_cache_expiry():
+    cache: TTLCache[str, int] = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1, ttl=0.01)
+    time.sleep(0.02)
+    assert cache.get("a") is None
+
+    stats = cache.stats()
+    assert stats["expirations"] == 1
+    assert stats["misses"] == 1
+    assert stats["size"] == 0
+
+
+def test_ttl_cache_disabled():
+    cache: TTLCache[str, int] = TTLCache(maxsize=0, ttl=60)
+    cache.set("a", 1)
+    assert cache.get("a") is None
+
+
+def test_session_cache_hit(session):
+    with TestClient(app) as client:
+        client.cookies.set("session", session.token)
+
+        response = client.get("/api/session")
+        assert response.status_code == status.HTTP_200_OK
+        hits = session_cache.hits
+
+        response = client.get("/api/session")
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()["user"]["email"] == session.user.email
+        assert session_cache.hits == hits + 1
+
+
+def test_session_cache_logout(session):
+    with TestClient(app) as client:
+        client.cookies.set("session", session.token)
+        assert client.get("/api/session").status_code == status.HTTP_200_OK
+        assert session_cache.get(session.token) is not None
+
+        assert client.post("/api/logout").status_code == status.HTTP_200_OK
+        assert session_cache.get(session.token) is None
+
+        client.cookies.set("session", session.token)
+        assert client.get("/api/session").status_code == status.HTTP_401_UNAUTHORIZED
+
+
+def test_session_cache_expired(expired_session):
+    session_cache.set(expired_session.token, expired_session.to_cache())
+
+    with TestClient(app) as client:
+        client.cookies.set("session", expired_session.token)
+        assert client.get("/api/session").status_code == status.HTTP_401_UNAUTHORIZED
+
+    assert session_cache.get(expired_session.token) is None
+
+
+def test_session_cache_logout_all(user):
+    args = {"email": user.email, "password": "password"}
+
+    with TestClient(app) as client:
+        assert client.post("/api/login", json=args).status_code == status.HTTP_200_OK
+        first = client.cookies.get("session")
+        assert client.post("/api/login", json=args).status_code == status.HTTP_200_OK
+        second = client.cookies.get("session")
+        assert client.get("/api/session").status_code == status.HTTP_200_OK
+        assert session_cache.get(second) is not None
+
+        client.cookies.set("session", first)
+        assert client.post("/api/logout", params={"all": True}).status_code == status.HTTP_200_OK
+        assert session_cache.get(second) is None
+
+        client.cookies.set("session", second)
+        assert client.get("/api/session").status_code == status.HTTP_401_UNAUTHORIZED
@@ -0,0 +1,140 @@
+import asyncio
+import os
+import threading
+import time
+
+import pytest
+from linkpulse.database import PostgresPool, QueryExecutor, create_database, run_db
+from linkpulse.utilities import get_db
+from playhouse.pool import MaxConnectionsExceeded
+
+
+@pytest.fixture
+def pool():
+    pool = create_database(os.environ["DATABASE_URL"])
+    yield pool
+    pool.close_all()
+
+
+def test_run_db_off_loop():
+    async def main():
+        return await run_db(threading.get_ident)
+
+    assert asyncio.run(main()) != threading.get_ident()
+
+
+def test_run_db_concurrent():
+    db = get_db()
+    executor = QueryExecutor("test", max_workers=2)
+
+    async def main():
+        start = time.perf_counter()
+        await asyncio.gather(*(executor.run(db.execute_sql, "SELECT pg_sleep(0.2)") for _ in range(2)))
+        return time.perf_counter() - start
+
+    try:
+        # Both queries sleep in parallel, rather than one after the other
+        assert asyncio.run(main()) < 0.4
+    finally:
+        executor.shutdown()
+
+
+def test_create_database_options(monkeypatch):
+    monkeypatch.setenv("DB_POOL_MAX_SIZE", "7")
+    monkeypatch.setenv("DB_POOL_MAX_IDLE", "12.5")
+
+    pool = create_database("postgres://user@localhost:5432/db?max_idle=3&sslmode=disable")
+    assert isinstance(pool, PostgresPool)
+    assert pool._max_connections == 7  # environment variable
+    assert pool._max_idle == 3  # query parameter takes precedence
+    assert pool.connect_params["sslmode"] == "disable"  # unrelated parameters pass through to psycopg2
+
+    with pytest.raises(ValueError):
+        create_database("mysql://user@localhost/db")
+
+
+def test_pool_min_connections(pool):
+    pool._min_connections = 2
+    pool.maintain()
+    assert pool.stats()["idle"] == 2
+
+    # Reused, not created
+    with pool.connection_context():
+        pool.execute_sql("SELECT 1")
+    assert pool.stats()["created"] == 2
+
+
+def test_pool_ping_discards_dead_connection(pool):
+    pool._ping_interval = 0
+
+    with pool.connection_context():
+        pid = pool.execute_sql("SELECT pg_backend_pid()").fetchone()[0]
+
+    # Simulate a failover by killing the idle connection's backend
+    with get_db().connection_context():
+        get_db().execute_sql("SELECT pg_terminate_backend(%s)", (pid,))
+
+    with pool.connection_context():
+        assert pool.execute_sql("SELECT pg_backend_pid()").fetchone()[0] != pid
+    assert pool.stats()["failed_pings"] == 1
+
+
+def test_pool_max_idle(pool):
+    pool._max_idle = 0
+
+    with pool.connection_context():
+        pool.execute_sql("SELECT 1")
+    time.sleep(0.01)
+    pool.maintain()
+
+    assert pool.stats()["recycled"] >= 1
+
+
+def test_pool_checkout_timeout(pool):
+    pool._max_connections = 1
+    pool._wait_timeout = 0.2
+    held, release = threading.Event(), threading.Event()
+
+    def hold():
+        with pool.connection_context():
+            held.set()
+            release.wait()
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    held.wait()
+    try:
+        with pytest.raises(MaxConnectionsExceeded):
+            pool.connect()
+        assert pool.stats()["timeouts"] == 1
+    finally:
+        release.set()
+        thread.join()
+
+
+def test_pool_after_fork():
+    # The application's pool, which has its fork hook registered
+    db = get_db()
+    with db.connection_context():
+        parent = db.connection()
+    assert db.stats()["idle"] >= 1
+
+    pid = os.fork()
+    if pid == 0:
+        # Child: inherited connections are forgotten, and a new one opened
+        code = 1
+        try:
+            assert db.stats()["idle"] == 0
+            with db.connection_context():
+                assert db.connection() is not parent
+                db.execute_sql("SELECT 1")
+            code = 0
+        finally:
+            os._exit(code)
+
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+
+    # The child left the parent's connection open
+    with parent.cursor() as cursor:
+        cursor.execute("SELECT 1")
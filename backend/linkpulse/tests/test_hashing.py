@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+from fastapi import status
+from fastapi.testclient import TestClient
+from linkpulse.app import app
+from linkpulse.hashing import HashingPool, HashingPoolSaturated, hasher, hashing_pool
+from linkpulse.tests.test_user import user
+
+
+def test_hashing_pool_verify():
+    pool = HashingPool(max_workers=1, max_queue=0)
+    password_hash = hasher.hash("password")
+
+    async def main():
+        return await pool.verify("password", password_hash), await pool.verify("wrong", password_hash)
+
+    try:
+        assert asyncio.run(main()) == (True, False)
+    finally:
+        pool.shutdown()
+
+
+def test_hashing_pool_saturated():
+    pool = HashingPool(max_workers=1, max_queue=1, retry_after=3)
+
+    async def main():
+        return await asyncio.gather(
+            *(pool.verify_dummy("password") for _ in range(3)), return_exceptions=True
+        )
+
+    try:
+        results = asyncio.run(main())
+    finally:
+        pool.shutdown()
+
+    # One running, one queued, one rejected
+    rejected = [result for result in results if isinstance(result, HashingPoolSaturated)]
+    assert len(rejected) == 1
+    assert rejected[0].retry_after == 3
+    assert pool.rejected == 1
+    assert pool.in_flight == 0
+
+
+@pytest.mark.parametrize("exists", [True, False])
+def test_login_saturated(user, monkeypatch, exists):
+    monkeypatch.setattr(hashing_pool, "in_flight", hashing_pool.max_workers + hashing_pool.max_queue)
+    email = user.email if exists else "missing@example.com"
+
+    with TestClient(app) as client:
+        response = client.post("/api/login", json={"email": email, "password": "password"})
+        # The response must not depend on whether the account exists
+        assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+        assert response.headers["Retry-After"] == str(hashing_pool.retry_after)
@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+from linkpulse.health import MIGRATIONS, ReadinessProbe
+
+
+def test_readiness_coalesces_and_caches():
+    calls = 0
+
+    async def slow() -> None:
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+
+    async def scenario():
+        probe = ReadinessProbe(ttl=60, timeout=1)
+        probe.register("slow", slow)
+        results = await asyncio.gather(*(probe.check() for _ in range(5)))
+        # Cached until invalidated
+        await probe.check()
+        probe.invalidate()
+        await probe.check()
+        return probe, results
+
+    probe, results = asyncio.run(scenario())
+    assert calls == 2
+    assert probe.runs == 2
+    assert all(result == (True, {"slow": "ok"}) for result in results)
+
+
+def test_readiness_failures():
+    async def failing() -> None:
+        raise ConnectionError("refused")
+
+    async def unhealthy() -> str:
+        return "not running"
+
+    async def hanging() -> None:
+        await asyncio.sleep(10)
+
+    async def healthy() -> None:
+        return None
+
+    async def scenario():
+        probe = ReadinessProbe(ttl=0, timeout=0.05)
+        for check in (failing, unhealthy, hanging, healthy):
+            probe.register(check.__name__, check)
+        return probe, await probe.check()
+
+    probe, (ready, checks) = asyncio.run(scenario())
+    assert not ready
+    assert checks == {
+        "failing": "ConnectionError: refused",
+        "unhealthy": "not running",
+        "hanging": "timed out after 0.05s",
+        "healthy": "ok",
+    }
+    assert probe.failures == 1
+
+
+@pytest.mark.parametrize("invalid", [{"ttl": -1}, {"timeout": 0}])
+def test_readiness_invalid(invalid):
+    with pytest.raises(ValueError):
+        ReadinessProbe(**{"ttl": 1, "timeout": 1, **invalid})
+
+
+def test_migration_names():
+    assert MIGRATIONS[0] == "001_initial"
+    assert MIGRATIONS == sorted(MIGRATIONS)
@@ -0,0 +1,105 @@
+import io
+import logging
+import threading
+
+import pytest
+from linkpulse.logging import QueueLogHandler
+
+
+class BlockingStream(io.StringIO):
+    """A stream whose writes block until released, simulating back-pressure on stdout."""
+
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+        self.writing = threading.Event()
+
+    def write(self, s: str) -> int:
+        self.writing.set()
+        self.release.wait()
+        return super().write(s)
+
+
+def record(message: str, level: int = logging.INFO) -> logging.LogRecord:
+    return logging.LogRecord("test", level, __file__, 0, message, None, None)
+
+
+@pytest.fixture
+def stream():
+    stream = BlockingStream()
+    yield stream
+    stream.release.set()
+
+
+def test_queue_handler_writes_in_order():
+    stream = io.StringIO()
+    handler = QueueLogHandler(stream=stream, batch_size=3)
+
+    for i in range(10):
+        handler.handle(record(f"message {i}"))
+    handler.flush()
+
+    assert stream.getvalue().splitlines() == [f"message {i}" for i in range(10)]
+    handler.close()
+
+
+def test_queue_handler_close_drains():
+    stream = io.StringIO()
+    handler = QueueLogHandler(stream=stream)
+
+    for i in range(100):
+        handler.handle(record(f"message {i}"))
+    handler.close()
+
+    assert len(stream.getvalue().splitlines()) == 100
+
+
+def test_queue_handler_drop_oldest(stream):
+    handler = QueueLogHandler(stream=stream, max_size=2, policy="drop-oldest", batch_size=1)
+
+    # The writer takes the first record and blocks writing it; the rest queue up
+    handler.handle(record("first"))
+    stream.writing.wait()
+    for i in range(4):
+        handler.handle(record(f"queued {i}"))
+
+    assert handler.dropped == 2
+    stream.release.set()
+    handler.close()
+    assert stream.getvalue().splitlines() == ["first", "queued 2", "queued 3"]
+
+
+def test_queue_handler_drop_debug(stream):
+    handler = QueueLogHandler(stream=stream, max_size=1, policy="drop-debug", batch_size=1)
+
+    handler.handle(record("first"))
+    stream.writing.wait()
+    handler.handle(record("queued"))
+    handler.handle(record("debug", level=logging.DEBUG))
+
+    assert handler.dropped == 1
+    assert handler.stats()["queued"] == 1
+    stream.release.set()
+    handler.close()
+    assert stream.getvalue().splitlines() == ["first", "queued"]
+
+
+def test_queue_handler_block(stream):
+    handler = QueueLogHandler(stream=stream, max_size=1, policy="block", batch_size=1)
+
+    handler.handle(record("first"))
+    stream.writing.wait()
+    handler.handle(record("queued"))
+
+    # The queue is full, so this blocks until the writer catches up
+    blocked = threading.Thread(target=handler.handle, args=(record("blocked"),))
+    blocked.start()
+    blocked.join(timeout=0.1)
+    assert blocked.is_alive()
+
+    stream.release.set()
+    blocked.join(timeout=5)
+    assert not blocked.is_alive()
+    handler.close()
+    assert handler.dropped == 0
+    assert stream.getvalue().splitlines() == ["first", "queued", "blocked"]
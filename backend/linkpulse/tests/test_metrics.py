@@ -0,0 +1,117 @@
+import json
+import os
+import subprocess
+import sys
+
+from fastapi import FastAPI, status
+from fastapi.testclient import TestClient
+from linkpulse.app import app
+from linkpulse.metrics import Registry, gauges, http_requests, merge, render
+from linkpulse.middleware import MetricsMiddleware
+
+
+def test_histogram_render():
+    registry = Registry()
+    histogram = registry.histogram("latency_seconds", "Latency", ("route",), buckets=(0.1, 1.0))
+    histogram.observe(0.05, ("/a",))
+    histogram.observe(0.5, ("/a",))
+    histogram.observe(5, ("/a",))
+
+    lines = registry.render().splitlines()
+    assert "# TYPE latency_seconds histogram" in lines
+    assert 'latency_seconds_bucket{route="/a",le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{route="/a",le="1"} 2' in lines
+    assert 'latency_seconds_bucket{route="/a",le="+Inf"} 3' in lines
+    assert 'latency_seconds_sum{route="/a"} 5.55' in lines
+    assert 'latency_seconds_count{route="/a"} 3' in lines
+
+
+def test_label_escaping():
+    registry = Registry()
+    registry.counter("requests_total", "Requests", ("path",)).inc(('a"b\\c\n',))
+    assert 'requests_total{path="a\\"b\\\\c\\n"} 1' in registry.render()
+
+
+def test_merge_snapshots():
+    first, second = Registry(), Registry()
+    for registry, count in ((first, 2), (second, 3)):
+        registry.counter("requests_total", "Requests", ("route",)).inc(("/a",), count)
+        registry.histogram("latency_seconds", "Latency", buckets=(1.0,)).observe(0.5)
+
+    merged = render(merge([first.snapshot(), json.loads(json.dumps(second.snapshot()))]))
+    assert 'requests_total{route="/a"} 5' in merged
+    assert "latency_seconds_count 2" in merged
+
+
+def test_shared_directory(tmp_path):
+    # Another worker's snapshot, as written by `write_snapshot`
+    other = Registry(str(tmp_path))
+    other.counter("requests_total", "Requests").inc(amount=4)
+    (tmp_path / "1.json").write_text(json.dumps(other.snapshot()))
+
+    registry = Registry(str(tmp_path))
+    registry.counter("requests_total", "Requests").inc()
+
+    assert "requests_total 5" in registry.render().splitlines()
+    assert len(list(tmp_path.glob("*.json"))) == 2
+
+
+def test_shared_directory_exited_gauges(tmp_path):
+    def snapshot(requests: int, pool_size: int) -> str:
+        other = Registry(str(tmp_path))
+        other.counter("requests_total", "Requests").inc(amount=requests)
+        other.register_collector(lambda: gauges("pool", "Pool", {"size": pool_size}))
+        return json.dumps(other.snapshot())
+
+    # A running worker, and one that exited without a final snapshot
+    sleeper = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+    exited = subprocess.Popen([sys.executable, "-c", "pass"])
+    exited.wait()
+    try:
+        (tmp_path / f"{sleeper.pid}.json").write_text(snapshot(2, 3))
+        (tmp_path / f"{exited.pid}.json").write_text(snapshot(4, 5))
+
+        registry = Registry(str(tmp_path))
+        registry.counter("requests_total", "Requests").inc()
+        registry.register_collector(lambda: gauges("pool", "Pool", {"size": 1}))
+        lines = registry.render().splitlines()
+        # Counters are kept, gauges only from the processes still running
+        assert "requests_total 7" in lines
+        assert 'pool{stat="size"} 4' in lines
+
+        # This process's final snapshot leaves its gauges out too
+        registry.write_snapshot(final=True)
+        final = json.loads((tmp_path / f"{os.getpid()}.json").read_text())
+        assert "pool" not in final and "requests_total" in final
+    finally:
+        sleeper.kill()
+        sleeper.wait()
+
+
+def test_middleware_labels_route_template():
+    item_app = FastAPI()
+
+    @item_app.get("/item/{id}")
+    async def item(id: int):
+        return id
+
+    item_app.add_middleware(MetricsMiddleware)
+
+    with TestClient(item_app) as client:
+        client.get("/item/1")
+        client.get("/item/2")
+        client.get("/nowhere")
+
+    assert http_requests.values[("/item/{id}", "GET", "200")] >= 2
+    assert http_requests.values[("<unmatched>", "GET", "404")] >= 1
+
+
+def test_metrics_endpoint():
+    with TestClient(app) as client:
+        client.get("/health")
+        response = client.get("/metrics")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'http_requests_total{route="/health",method="GET",status="200"}' in response.text
+    assert 'linkpulse_db_pool{stat="checkouts"}' in response.text
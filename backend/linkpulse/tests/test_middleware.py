@@ -0,0 +1,114 @@
+import logging
+
+import pytest
+from fastapi import FastAPI, status
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+from linkpulse.middleware import AccessLogSampler, LoggingMiddleware
+from linkpulse.utilities import is_development
+from structlog.testing import capture_logs
+
+
+@pytest.fixture
+def app(monkeypatch):
+    # Log access at a level enabled regardless of LOG_LEVEL
+    monkeypatch.setenv("ACCESS_LOG_LEVEL", "WARNING")
+    app = FastAPI()
+
+    @app.get("/ok")
+    async def ok():
+        return "OK"
+
+    @app.get("/missing")
+    async def missing():
+        from fastapi import HTTPException
+
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+    @app.get("/error")
+    async def error():
+        raise RuntimeError("boom")
+
+    @app.get("/stream")
+    async def stream():
+        async def chunks():
+            for i in range(3):
+                yield f"chunk{i};".encode()
+
+        return StreamingResponse(chunks())
+
+    app.add_middleware(LoggingMiddleware)
+    return app
+
+
+def test_access_log(app):
+    with capture_logs() as logs, TestClient(app) as client:
+        response = client.get("/missing", params={"a": "1"})
+
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    (entry,) = [log for log in logs if log["event"] == "Request"]
+    assert entry["http"]["status_code"] == status.HTTP_404_NOT_FOUND
+    assert entry["http"]["method"] == "GET"
+    assert entry["http"]["query"] == {"a": "1"}
+    assert entry["http"]["url"].endswith("/missing?a=1")
+    assert entry["client"] is not None
+    assert float(entry["duration_ms"]) >= 0
+
+
+def test_process_time_header(app):
+    with TestClient(app) as client:
+        response = client.get("/ok")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert ("X-Process-Time" in response.headers) == is_development
+
+
+def test_streaming_passthrough(app):
+    with TestClient(app) as client:
+        response = client.get("/stream")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.text == "chunk0;chunk1;chunk2;"
+
+
+def test_exception_not_swallowed(app):
+    with capture_logs() as logs, TestClient(app) as client:
+        with pytest.raises(RuntimeError):
+            client.get("/error")
+
+    assert any(log["event"] == "Uncaught exception" for log in logs)
+    (entry,) = [log for log in logs if log["event"] == "Request"]
+    assert entry["http"]["status_code"] == status.HTTP_500_INTERNAL_SERVER_ERROR
+
+
+def test_access_log_disabled(app, monkeypatch):
+    monkeypatch.setenv("ACCESS_LOG_LEVEL", "DEBUG")
+    access_logger = logging.getLogger("api.access")
+    previous = access_logger.level
+    access_logger.setLevel(logging.INFO)
+
+    try:
+        with capture_logs() as logs, TestClient(app) as client:
+            assert client.get("/ok").status_code == status.HTTP_200_OK
+    finally:
+        access_logger.setLevel(previous)
+
+    assert not any(log["event"] == "Request" for log in logs)
+
+
+def test_access_log_sampler():
+    sampler = AccessLogSampler(rate=0, client_error_rate=0, slow_ms=500)
+
+    assert sampler.should_log(200, 10) is False
+    assert sampler.should_log(404, 10) is False
+    assert sampler.should_log(200, 500) is True  # slow
+    assert sampler.should_log(500, 10) is True  # server error
+    assert sampler.should_log(503, 10) is True
+
+    assert AccessLogSampler().should_log(200, 10) is True
+
+
+def test_access_log_sampler_rate():
+    sampler = AccessLogSampler(rate=0.5)
+    sampled = sum(sampler.should_log(200, 1) for _ in range(10000))
+    assert 4000 < sampled < 6000
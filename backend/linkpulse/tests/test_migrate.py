@@ -0,0 +1,192 @@
+import shutil
+import threading
+import uuid
+
+import pytest
+from linkpulse.migrate import (
+    ACCESS_EXCLUSIVE,
+    MIGRATIONS_DIR,
+    SNAPSHOT_NAME,
+    ExtendedRouter,
+    advisory_lock,
+    apply_all,
+)
+from linkpulse.utilities import get_db
+from peewee_migrate.router import compile_migrations
+
+MIGRATION = """
+def migrate(migrator, database, fake=False, **kwargs):
+    migrator.sql("SELECT pg_sleep(0.05)")
+
+
+def rollback(migrator, database, fake=False, **kwargs):
+    pass
+"""
+
+ONLINE_MIGRATION = """
+import peewee as pw
+
+
+def migrate(migrator, database, fake=False, **kwargs):
+    @migrator.create_model
+    class Item(pw.Model):
+        code = pw.CharField()
+        quantity = pw.IntegerField()
+
+        class Meta:
+            table_name = "{table}"
+
+    migrator.add_index_concurrently("{table}", "code", unique=True)
+    migrator.add_constraint_not_valid("{table}", "{table}_quantity", pw.Check("quantity >= 0"))
+
+
+def rollback(migrator, database, fake=False, **kwargs):
+    migrator.drop_index_concurrently("{table}", "code")
+"""
+
+LOCKING_MIGRATION = """
+def migrate(migrator, database, fake=False, **kwargs):
+    migrator.add_index("session", "last_used")
+    migrator.add_index_concurrently("session", "user", "last_used")
+    migrator.sql('ALTER TABLE "session" ADD COLUMN note TEXT')
+    migrator.sql('ALTER TABLE "session" VALIDATE CONSTRAINT session_token_length')
+
+
+def rollback(migrator, database, fake=False, **kwargs):
+    pass
+"""
+
+
+@pytest.fixture
+def history():
+    """
+    A separate migration history table, so migrations applied by a test aren't replayed by others running concurrently.
+    """
+    table = f"migratehistory_{uuid.uuid4().hex[:8]}"
+    yield table
+
+    db = get_db()
+    with db.connection_context():
+        db.execute_sql(f'DROP TABLE IF EXISTS "{table}"')
+
+
+def test_apply_all_nothing_pending():
+    # The test database is fully migrated
+    assert apply_all(timeout=5) == {}
+
+
+def test_run_times_migrations(tmp_path, history):
+    (tmp_path / "001_sleep.py").write_text(MIGRATION)
+
+    db = get_db()
+    with db.connection_context():
+        router = ExtendedRouter(database=db, migrate_dir=tmp_path, migrate_table=history)
+        assert router.run() == ["001_sleep"]
+        assert router.durations["001_sleep"] >= 0.05
+        assert router.diff == []
+
+
+def test_advisory_lock_excludes():
+    db = get_db()
+    key = uuid.uuid4().int >> 65
+    locked, release = threading.Event(), threading.Event()
+
+    def hold() -> None:
+        with db.connection_context(), advisory_lock(db, key, timeout=1):
+            locked.set()
+            release.wait(5)
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    try:
+        assert locked.wait(5)
+        with db.connection_context():
+            with pytest.raises(TimeoutError):
+                with advisory_lock(db, key, timeout=0.2, poll_interval=0.05):
+                    pass
+    finally:
+        release.set()
+        holder.join()
+
+    # Released by the holder
+    with db.connection_context(), advisory_lock(db, key, timeout=1):
+        pass
+
+
+def test_online_operations(tmp_path, history):
+    table = f"online_{uuid.uuid4().hex[:8]}"
+    (tmp_path / "001_online.py").write_text(ONLINE_MIGRATION.format(table=table))
+
+    db = get_db()
+    with db.connection_context():
+        try:
+            router = ExtendedRouter(database=db, migrate_dir=tmp_path, migrate_table=history)
+            # Fails if run in a transaction: CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+            assert router.run() == ["001_online"]
+
+            index = db.execute_sql(
+                "SELECT indisvalid, indisunique FROM pg_index WHERE indexrelid = to_regclass(%s)",
+                (f"{table}_code",),
+            ).fetchone()
+            assert index == (True, True)
+            validated = db.execute_sql(
+                "SELECT convalidated FROM pg_constraint WHERE conname = %s", (f"{table}_quantity",)
+            ).fetchone()
+            assert validated == (True,)
+
+            router.rollback()
+            assert router.done == []
+            assert db.execute_sql("SELECT to_regclass(%s)", (f"{table}_code",)).fetchone() == (None,)
+        finally:
+            db.execute_sql(f'DROP TABLE IF EXISTS "{table}"')
+
+
+def test_lint(tmp_path, history):
+    for path in MIGRATIONS_DIR.glob("*.py"):
+        shutil.copy(path, tmp_path)
+    (tmp_path / "999_locking.py").write_text(LOCKING_MIGRATION)
+
+    db = get_db()
+    with db.connection_context():
+        # Every migration is pending against the empty history, and nothing is applied
+        router = ExtendedRouter(database=db, migrate_dir=tmp_path, migrate_table=history)
+        warnings = [warning for warning in router.lint(min_rows=0) if warning.migration == "999_locking"]
+        found = [
+            (warning.operation, warning.table, warning.lock, warning.alternative) for warning in warnings
+        ]
+        assert found == [
+            ("add_index", "session", "SHARE", "add_index_concurrently"),
+            ("sql", "session", ACCESS_EXCLUSIVE, None),
+        ]
+        assert router.diff[-1] == "999_locking"
+
+        assert router.lint(min_rows=10**12) == []
+
+
+def test_snapshot(tmp_path, monkeypatch):
+    for path in MIGRATIONS_DIR.glob("*.py"):
+        shutil.copy(path, tmp_path)
+
+    db = get_db()
+    with db.connection_context():
+        # Replays the test database's applied migrations, and saves their state
+        replayed = ExtendedRouter(database=db, migrate_dir=tmp_path).migrator
+        assert (tmp_path / SNAPSHOT_NAME).exists()
+
+        def replay(*_, **__):
+            raise AssertionError("replayed despite a matching snapshot")
+
+        router = ExtendedRouter(database=db, migrate_dir=tmp_path)
+        monkeypatch.setattr(router, "run_one", replay)
+        loaded = router.migrator
+        assert [model._meta.table_name for model in loaded.orm] == ["user", "session"]
+        # No differences either way
+        assert compile_migrations(loaded, list(replayed.orm)) == ""
+        assert compile_migrations(replayed, list(loaded.orm)) == ""
+
+        # Changing an applied migration invalidates the snapshot
+        applied = router.done[-1]
+        with (tmp_path / f"{applied}.py").open("a") as file:
+            file.write("\n# Changed\n")
+        with pytest.raises(AssertionError, match="replayed"):
+            router.snapshot()
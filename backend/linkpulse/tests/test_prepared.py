@@ -0,0 +1,141 @@
+from datetime import timedelta
+
+import pytest
+from linkpulse.benchmarks.prepared import main as benchmark
+from linkpulse.database import QueryCounter
+from linkpulse.models import Session, User
+from linkpulse.prepared import PreparedStatements, prepared_statements
+from linkpulse.tests.random import random_email, random_string
+from linkpulse.utilities import get_db, utc_now
+
+
+@pytest.fixture
+def user():
+    user = User.create(email=random_email(), password_hash=random_string(64))
+    yield user
+    user.delete_instance()
+
+
+@pytest.fixture
+def session(user):
+    return Session.create(token=Session.generate_token(), user=user, expiry=utc_now() + timedelta(hours=1))
+
+
+def _registry() -> PreparedStatements:
+    # Named apart from the application's statements, which are prepared on the same connections
+    statements = PreparedStatements()
+    statements.register("test_user_by_email", User.select().where(User.email == ""))
+    statements.register("test_user_email", 'SELECT email FROM "user" WHERE id = $1')
+    return statements
+
+
+@pytest.fixture
+def statements():
+    return _registry()
+
+
+def _prepared_names():
+    return {name for (name,) in get_db().execute_sql("SELECT name FROM pg_prepared_statements").fetchall()}
+
+
+def test_register():
+    statements = PreparedStatements()
+    statement = statements.register(
+        "session_by_token", Session.select().where((Session.token == "") & (Session.expiry > utc_now()))
+    )
+    assert "$1" in statement.sql and "$2" in statement.sql and "%s" not in statement.sql
+    assert statement.execute == "EXECUTE lp_session_by_token(%s, %s)"
+
+    with pytest.raises(ValueError):
+        statements.register("Invalid-Name", "SELECT 1")
+    with pytest.raises(ValueError):
+        statements.register("out_of_order", "SELECT $2, $1, $1")
+
+
+def test_matches_query(session, user):
+    db = get_db()
+    with db.connection_context():
+        resolved = Session.resolve(session.token)
+        query = Session.select(Session, User.id, User.email).join(User)
+        expected = query.where(Session.token == session.token).get()
+        assert (resolved.token, resolved.expiry, resolved.user.id, resolved.user.email) == (
+            expected.token,
+            expected.expiry,
+            expected.user.id,
+            expected.user.email,
+        )
+        assert Session.resolve(random_string(32)) is None
+
+        assert User.by_email(user.email).password_hash == user.password_hash
+        assert User.by_email(random_email()) is None
+
+        assert Session.delete_by_token(session.token) == 1
+        assert Session.resolve(session.token) is None
+
+
+def test_prepared_once_per_connection(statements, user):
+    db = get_db()
+    with db.connection_context():
+        with QueryCounter(db) as counter:
+            for _ in range(3):
+                assert statements.fetch("test_user_by_email", user.email)[0].id == user.id
+                assert statements.execute("test_user_email", user.id).fetchone() == (user.email,)
+        # Preparing doesn't take a query of its own
+        assert counter.count == 6
+        assert {"lp_test_user_by_email", "lp_test_user_email"} <= _prepared_names()
+        assert statements.stats()["prepares"] == 1
+
+    # The pool hands the same connection back, already prepared
+    with db.connection_context():
+        statements.execute("test_user_email", user.id)
+    assert statements.stats()["prepares"] == 1
+
+
+def test_reprepared(statements, user):
+    db = get_db()
+    with db.connection_context():
+        statements.execute("test_user_email", user.id)
+
+        # e.g. a connection pooler resetting the server connection
+        db.execute_sql("DEALLOCATE ALL")
+        assert statements.execute("test_user_email", user.id).fetchone() == (user.email,)
+        assert statements.stats()["reprepares"] == 1
+
+    # A new connection, e.g. after a reconnect
+    db.connect(reuse_if_open=True)
+    db.manual_close()
+    with db.connection_context():
+        assert "lp_test_user_email" not in _prepared_names()
+        assert statements.execute("test_user_email", user.id).fetchone() == (user.email,)
+    assert statements.stats()["prepares"] == 3
+
+
+def test_already_prepared(statements, user):
+    db = get_db()
+    with db.connection_context():
+        statements.execute("test_user_email", user.id)
+
+        # Another registry (e.g. one that lost track of the connection) finds the statements already there
+        other = _registry()
+        assert other.execute("test_user_email", user.id).fetchone() == (user.email,)
+        assert other.stats()["prepares"] == 1
+
+
+def test_disabled(statements, user):
+    statements.enabled = False
+    db = get_db()
+    with db.connection_context(), QueryCounter(db) as counter:
+        assert statements.fetch("test_user_by_email", user.email)[0].id == user.id
+    assert not counter.queries[0].startswith("EXECUTE")
+    assert statements.stats()["prepares"] == 0
+
+
+def test_benchmark():
+    enabled = prepared_statements.enabled
+    medians = benchmark(iterations=10)
+
+    assert set(medians) == {"session_by_token", "user_by_email"}
+    for result in medians.values():
+        assert set(result) == {"peewee", "unprepared", "prepared"}
+    assert prepared_statements.enabled == enabled
+    assert User.select().where(User.email.startswith("bench-")).count() == 0
@@ -0,0 +1,120 @@
+import asyncio
+import multiprocessing
+import sqlite3
+import threading
+
+import pytest
+from linkpulse.dependencies import RateLimiter
+from linkpulse.ratelimit import MemoryStorage, SharedStorage, create_storage, gcra
+from starlette.requests import Request
+from starlette.responses import Response
+
+# 6/minute: a burst of 6, then one every 10 seconds
+INTERVAL, PERIOD = 10.0, 60.0
+
+
+def test_gcra_burst_and_retry_after():
+    tat = None
+    for _ in range(6):
+        tat, retry_after = gcra(tat, INTERVAL, PERIOD, now=0)
+        assert retry_after == 0
+
+    rejected, retry_after = gcra(tat, INTERVAL, PERIOD, now=0)
+    assert rejected is None
+    assert retry_after == INTERVAL
+
+    # Partway through the interval, only the remainder is reported
+    assert gcra(tat, INTERVAL, PERIOD, now=4)[1] == pytest.approx(6)
+    assert gcra(tat, INTERVAL, PERIOD, now=10)[1] == 0
+
+
+@pytest.fixture(params=["memory", "shared"])
+def storage(request, tmp_path):
+    if request.param == "memory":
+        yield MemoryStorage()
+    else:
+        storage = SharedStorage(str(tmp_path / "ratelimit.sqlite3"))
+        yield storage
+        storage.close()
+
+
+def test_storage_limits_per_key(storage):
+    for _ in range(6):
+        assert storage.hit("a", INTERVAL, PERIOD, now=100) == 0
+    assert storage.hit("a", INTERVAL, PERIOD, now=100) == INTERVAL
+    # Rejected hits don't push the reset further out
+    assert storage.hit("a", INTERVAL, PERIOD, now=100) == INTERVAL
+    assert storage.hit("b", INTERVAL, PERIOD, now=100) == 0
+
+
+def test_storage_evicts_idle_keys(storage):
+    storage.hit("a", INTERVAL, PERIOD, now=100)  # TAT 110
+    storage.hit("b", INTERVAL, PERIOD, now=150)  # TAT 160
+
+    assert storage.evict(now=120) == 1
+    assert storage.evict(now=120) == 0
+    # The remaining key still holds its state
+    for _ in range(5):
+        assert storage.hit("b", INTERVAL, PERIOD, now=150) == 0
+    assert storage.hit("b", INTERVAL, PERIOD, now=150) > 0
+
+
+def _hit_many(path: str, count: int, results) -> None:
+    storage = SharedStorage(path)
+    results.put(sum(storage.hit("shared", INTERVAL, PERIOD, now=100) == 0 for _ in range(count)))
+
+
+def test_shared_storage_across_processes(tmp_path):
+    path = str(tmp_path / "ratelimit.sqlite3")
+    results = multiprocessing.get_context("fork").Queue()
+    processes = [
+        multiprocessing.get_context("fork").Process(target=_hit_many, args=(path, 5, results))
+        for _ in range(4)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    # The limit holds across all processes combined, not per process
+    assert sum(results.get() for _ in processes) == 6
+
+
+def test_shared_storage_off_event_loop(tmp_path):
+    path = str(tmp_path / "ratelimit.sqlite3")
+    storage = SharedStorage(path, timeout=5)
+    limiter = RateLimiter("6/minute", storage=storage)
+    request = Request({"type": "http", "headers": [], "client": ("127.0.0.1", 50000)})
+
+    # Another worker holds the write lock for a while
+    storage.evict()
+    holder = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    holder.execute("BEGIN IMMEDIATE")
+    threading.Timer(0.3, holder.execute, ("COMMIT",)).start()
+
+    async def run() -> int:
+        ticks = 0
+
+        async def tick() -> None:
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker = asyncio.create_task(tick())
+        assert await limiter(request, Response()) is True
+        ticker.cancel()
+        return ticks
+
+    try:
+        # The event loop kept running while the hit waited for the lock
+        assert asyncio.run(run()) >= 10
+    finally:
+        holder.close()
+        storage.close()
+
+
+def test_create_storage():
+    assert isinstance(create_storage("memory"), MemoryStorage)
+    with pytest.raises(ValueError):
+        create_storage("redis")
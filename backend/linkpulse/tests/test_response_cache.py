@@ -0,0 +1,187 @@
+import asyncio
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from linkpulse.app import app
+from linkpulse.response_cache import ResponseCache, etag, etag_matches
+from linkpulse.tests.test_session import session
+from linkpulse.tests.test_user import user
+
+
+def _expire(cache: ResponseCache, key: str, seconds_ago: float = 1) -> None:
+    cache._entries[key].expires_at = time.monotonic() - seconds_ago
+
+
+def test_response_cache_lru_eviction():
+    async def scenario():
+        cache = ResponseCache(maxsize=2, max_bytes=1024)
+        await cache.set("a", b"1", 60)
+        await cache.set("b", b"2", 60)
+        assert await cache.get("a") == b"1"  # 'b' is now least recently used
+        await cache.set("c", b"3", 60)
+        return cache
+
+    cache = asyncio.run(scenario())
+    assert list(cache._entries) == ["a", "c"]
+    assert cache.stats()["evictions"] == 1
+
+
+def test_response_cache_max_bytes():
+    async def scenario():
+        cache = ResponseCache(maxsize=10, max_bytes=10)
+        await cache.set("a", b"x" * 4)
+        await cache.set("b", b"x" * 4)
+        await cache.set("c", b"x" * 4)
+        # Larger than the whole cache: not stored, and the previous value for the key is dropped
+        await cache.set("c", b"x" * 11)
+        return cache
+
+    cache = asyncio.run(scenario())
+    assert list(cache._entries) == ["b"]
+    assert cache.bytes == 4
+
+
+def test_response_cache_coalesces():
+    calls = 0
+
+    async def compute() -> bytes:
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return b"value"
+
+    async def scenario():
+        cache = ResponseCache(maxsize=10, max_bytes=1024)
+        results = await asyncio.gather(*(cache.get_or_set("key", compute, 60) for _ in range(10)))
+        return cache, results
+
+    cache, results = asyncio.run(scenario())
+    assert calls == 1
+    assert sorted(status for status, _, _ in results) == ["COALESCED"] * 9 + ["MISS"]
+    assert {entry.data for _, _, entry in results} == {b"value"}
+    assert cache.stats()["coalesced"] == 9
+
+
+def test_response_cache_failure_not_cached():
+    calls = 0
+
+    async def compute() -> bytes:
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        raise RuntimeError("query failed")
+
+    async def scenario():
+        cache = ResponseCache(maxsize=10, max_bytes=1024)
+        results = await asyncio.gather(
+            *(cache.get_or_set("key", compute, 60) for _ in range(3)), return_exceptions=True
+        )
+        return cache, results
+
+    cache, results = asyncio.run(scenario())
+    # Every waiter sees the failure, and the next request tries again
+    assert calls == 1
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert not cache._entries and not cache._inflight
+
+
+def test_response_cache_stale_while_revalidate():
+    async def scenario():
+        cache = ResponseCache(maxsize=10, max_bytes=1024, stale=30)
+        await cache.set("key", b"old", 60)
+        _expire(cache, "key")
+
+        done = asyncio.Event()
+
+        async def compute() -> bytes:
+            done.set()
+            return b"new"
+
+        first = await cache.get_or_set("key", compute, 60)
+        second = await cache.get_or_set("key", compute, 60)
+        await done.wait()
+        await asyncio.sleep(0)
+        third = await cache.get_or_set("key", compute, 60)
+        return cache, first, second, third
+
+    cache, first, second, third = asyncio.run(scenario())
+    assert first[0] == second[0] == "STALE"
+    assert first[2].data == second[2].data == b"old"
+    assert third[0] == "HIT" and third[2].data == b"new"
+    assert cache.stats()["stale_hits"] == 2
+
+
+def test_response_cache_expired_beyond_stale():
+    async def scenario():
+        cache = ResponseCache(maxsize=10, max_bytes=1024, stale=5)
+        await cache.set("key", b"old", 60)
+        _expire(cache, "key", seconds_ago=10)
+
+        async def compute() -> bytes:
+            return b"new"
+
+        return cache, await cache.get_or_set("key", compute, 60)
+
+    cache, (status, ttl, entry) = asyncio.run(scenario())
+    assert (status, ttl, entry.data, entry.etag) == ("MISS", 60, b"new", etag(b"new"))
+    assert cache.stats()["expirations"] == 1
+
+
+@pytest.mark.parametrize("invalid", [{"maxsize": -1}, {"max_bytes": -1}, {"stale": -1}])
+def test_response_cache_invalid(invalid):
+    with pytest.raises(ValueError):
+        ResponseCache(**{"maxsize": 1, "max_bytes": 1, **invalid})
+
+
+def test_cached_endpoint():
+    with TestClient(app) as client:
+        first = client.get("/api/version")
+        second = client.get("/api/version")
+
+    assert first.status_code == second.status_code == 200
+    assert first.json() == second.json()
+    assert second.headers["X-Cache"] == "HIT"
+    assert first.headers["ETag"] == second.headers["ETag"] == etag(first.content)
+    # Never expires, so clients revalidate
+    assert second.headers["Cache-Control"] == "no-cache"
+
+
+def test_etag_matches():
+    tag = etag(b"{}")
+    assert etag_matches(tag, tag)
+    assert etag_matches(f'"other", W/{tag}', tag)
+    assert etag_matches("*", tag)
+    assert not etag_matches('"other"', tag)
+    assert not etag_matches(None, tag)
+
+
+def test_cached_endpoint_not_modified():
+    with TestClient(app) as client:
+        first = client.get("/api/migration")
+        assert first.headers["Cache-Control"].startswith("max-age=")
+
+        response = client.get("/api/migration", headers={"If-None-Match": first.headers["ETag"]})
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["ETag"] == first.headers["ETag"]
+        assert response.headers["X-Cache"] == "HIT"
+
+        assert client.get("/api/migration", headers={"If-None-Match": '"stale"'}).status_code == 200
+
+
+def test_session_not_modified(session):
+    with TestClient(app) as client:
+        client.cookies.set("session", session.token)
+        first = client.get("/api/session")
+        assert first.status_code == 200
+        assert first.headers["Cache-Control"] == "private, no-cache"
+
+        response = client.get("/api/session", headers={"If-None-Match": first.headers["ETag"]})
+        assert response.status_code == 304
+        assert response.content == b""
+
+        # Authentication still applies
+        client.cookies.clear()
+        response = client.get("/api/session", headers={"If-None-Match": first.headers["ETag"]})
+        assert response.status_code == 401
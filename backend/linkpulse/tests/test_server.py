@@ -0,0 +1,27 @@
+import pytest
+from linkpulse.server import ServeOptions
+
+
+def test_serve_options_env(monkeypatch):
+    monkeypatch.setenv("SERVER", "uvicorn")
+    monkeypatch.setenv("WEB_CONCURRENCY", "4")
+    monkeypatch.setenv("SERVER_KEEP_ALIVE", "30")
+    monkeypatch.setenv("SERVER_RELOAD", "false")
+
+    options = ServeOptions.parse()
+    assert options.server == "uvicorn"
+    assert options.workers == 4
+    assert options.keep_alive == 30
+    assert options.reload is False
+
+    # The command line takes precedence
+    options = ServeOptions.parse(["--server", "hypercorn", "--workers", "2", "--http2", "--backlog", "512"])
+    assert (options.server, options.workers, options.http2, options.backlog) == ("hypercorn", 2, True, 512)
+
+
+@pytest.mark.parametrize(
+    "args", [["--workers", "0"], ["--server", "uvicorn", "--http2"], ["--server", "daphne"]]
+)
+def test_serve_options_invalid(args):
+    with pytest.raises(SystemExit):
+        ServeOptions.parse(args)
@@ -1,12 +1,20 @@
-from datetime import timedelta
+from base64 import urlsafe_b64decode
+from datetime import datetime, timedelta, timezone
 
 import pytest
 import structlog
+from fastapi import status
+from fastapi.testclient import TestClient
+from linkpulse.app import app
+from linkpulse.buffer import last_used_buffer
+from linkpulse.cache import session_cache
+from linkpulse.database import QueryCounter
 from linkpulse.models import Session
+from linkpulse.reaper import SessionReaper
 from linkpulse.routers.auth import validate_session
 from linkpulse.tests.random import random_string
 from linkpulse.tests.test_user import user
-from linkpulse.utilities import utc_now
+from linkpulse.utilities import get_db, utc_now
 from peewee import IntegrityError
 
 logger = structlog.get_logger()
@@ -74,5 +82,134 @@ def test_session_constraint_expiry(user):
 def test_validate_session(db, session):
     assert session.last_used is None
     assert validate_session(session.token, user=True) == (True, True, session.user)
+    # last_used is buffered, so it won't be visible until flushed
+    last_used_buffer.flush()
     session = Session.get(Session.token == session.token)
     assert session.last_used is not None
+
+
+def test_last_used_buffer_newest(session):
+    newest = utc_now() + timedelta(minutes=5)
+    session.use(now=newest)
+    session.use(now=newest - timedelta(minutes=1))  # older values must not overwrite newer ones
+
+    assert last_used_buffer.flush() >= 1
+    assert Session.get(Session.token == session.token).last_used == newest.replace(tzinfo=None)
+
+
+def test_last_used_buffer_deleted(expired_session):
+    expired_session.use(now=utc_now())
+    assert expired_session.is_expired(revoke=True) is True
+    # Revocation drops the pending update instead of updating a missing row
+    last_used_buffer.flush()
+    assert Session.get_or_none(Session.token == expired_session.token) is None
+
+
+def test_validate_session_queries(session):
+    with QueryCounter(get_db()) as counter:
+        exists, valid, user = validate_session(session.token, user=False)
+
+    assert (exists, valid) == (True, True)
+    assert user.email == session.user.email
+    # Session & user are fetched together
+    assert counter.count == 1
+
+
+def test_session_request_queries(session):
+    session_cache.invalidate(session.token)
+
+    with TestClient(app) as client:
+        client.cookies.set("session", session.token)
+
+        with QueryCounter(get_db()) as counter:
+            response = client.get("/api/session")
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()["user"]["email"] == session.user.email
+        assert counter.count == 1, counter.queries
+
+        # Subsequent requests are served from the session cache
+        with QueryCounter(get_db()) as counter:
+            assert client.get("/api/session").status_code == status.HTTP_200_OK
+        assert counter.count == 0, counter.queries
+
+
+def test_reaper(user):
+    # Far enough in the past that other tests' sessions are never reaped here
+    cutoff = datetime(2000, 1, 1, tzinfo=timezone.utc)
+    tokens = [Session.generate_token() for _ in range(5)]
+    for i, token in enumerate(tokens):
+        created_at = cutoff - timedelta(days=2, minutes=i)
+        Session.create(user=user, token=token, created_at=created_at, expiry=created_at + timedelta(days=1))
+
+    reaper = SessionReaper(batch_size=2, sleep=0)
+    assert reaper.run(now=cutoff) == 5
+    assert Session.select().where(Session.token.in_(tokens)).count() == 0
+    assert reaper.run(now=cutoff) == 0
+
+
+def test_list_sessions(session):
+    user = session.user
+    base = utc_now() - timedelta(minutes=30)
+    # Equal creation times are ordered by token; the second & third straddle the first page's end
+    tokens = sorted(Session.generate_token() for _ in range(4))
+    for i, token in enumerate(tokens):
+        Session.create(
+            user=user,
+            token=token,
+            created_at=base + timedelta(minutes=(i + 1) // 2),
+            expiry=utc_now() + timedelta(hours=1),
+        )
+    Session.create(
+        user=user,
+        token=Session.generate_token(),
+        created_at=base - timedelta(hours=2),
+        expiry=base - timedelta(hours=1),
+    )
+
+    with TestClient(app) as client:
+        client.cookies.set("session", session.token)
+        assert client.get("/api/session").status_code == status.HTTP_200_OK
+
+        listed, cursor, pages = [], None, 0
+        while True:
+            params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+            with QueryCounter(get_db()) as counter:
+                response = client.get("/api/sessions", params=params)
+            assert response.status_code == status.HTTP_200_OK
+            assert counter.count == 1, counter.queries
+
+            page = response.json()
+            listed += page["sessions"]
+            pages += 1
+            cursor = page["next_cursor"]
+            # Neither the sessions nor the cursor expose a token
+            exposed = response.text + (urlsafe_b64decode(cursor).decode() if cursor else "")
+            assert not any(token in exposed for token in [*tokens, session.token])
+            if cursor is None:
+                break
+
+    # The expired session is excluded; the current one was created last
+    assert [item["id"] for item in listed] == [Session.public_id(token) for token in [*tokens, session.token]]
+    assert [item["current"] for item in listed] == [False] * 4 + [True]
+    assert pages == 3
+    assert set(listed[0]) == {"id", "created_at", "last_used", "expiry", "current"}
+
+
+def test_list_user_sessions(session):
+    with TestClient(app) as client:
+        client.cookies.set("session", session.token)
+
+        response = client.get(f"/api/user/{session.user_id}/sessions")
+        assert response.status_code == status.HTTP_200_OK
+        assert [item["id"] for item in response.json()["sessions"]] == [Session.public_id(session.token)]
+        assert session.token not in response.text
+
+        assert (
+            client.get(f"/api/user/{session.user_id + 1}/sessions").status_code == status.HTTP_403_FORBIDDEN
+        )
+        response = client.get("/api/sessions", params={"cursor": "not a cursor"})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert (
+            client.get("/api/sessions", params={"limit": 0}).status_code
+            == status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
@@ -0,0 +1,121 @@
+from datetime import timedelta
+
+import pytest
+from fastapi import status
+from fastapi.testclient import TestClient
+from linkpulse import dependencies
+from linkpulse.app import app
+from linkpulse.cache import session_cache
+from linkpulse.database import QueryCounter
+from linkpulse.models import Session
+from linkpulse.routers import auth
+from linkpulse.tests.test_session import session
+from linkpulse.tests.test_user import user
+from linkpulse.tokens import SessionSigner, create_signer, is_signed, parse_keys
+from linkpulse.utilities import get_db, utc_now
+
+OLD_KEY = b"o" * 32
+NEW_KEY = b"n" * 32
+
+
+@pytest.fixture
+def signer(monkeypatch):
+    signer = SessionSigner({"new": NEW_KEY, "old": OLD_KEY})
+    monkeypatch.setattr(dependencies, "session_signer", signer)
+    monkeypatch.setattr(auth, "session_signer", signer)
+    return signer
+
+
+def test_sign_and_verify():
+    signer = SessionSigner({"new": NEW_KEY})
+    token, expiry = Session.generate_token(), utc_now() + timedelta(hours=1)
+    value = signer.sign(token, 42, expiry)
+
+    assert is_signed(value)
+    claims = signer.verify(value)
+    assert claims is not None
+    assert (claims.token, claims.user_id) == (token, 42)
+    assert claims.expiry == expiry.replace(microsecond=0)
+
+    # Expired
+    assert signer.verify(value, now=expiry + timedelta(seconds=1)) is None
+
+
+def test_verify_rejects_tampering():
+    signer = SessionSigner({"new": NEW_KEY})
+    value = signer.sign(Session.generate_token(), 42, utc_now() + timedelta(hours=1))
+    prefix, key_id, token, user_id, expiry, signature = value.split(".")
+
+    assert signer.verify(".".join([prefix, key_id, token, "43", expiry, signature])) is None
+    assert signer.verify(".".join([prefix, key_id, token, user_id, str(int(expiry) + 60), signature])) is None
+    assert signer.verify(".".join([prefix, "other", token, user_id, expiry, signature])) is None
+    assert signer.verify(value[:-1]) is None
+    assert signer.verify("s1.garbage") is None
+    # Signed with a key that isn't configured
+    assert SessionSigner({"new": OLD_KEY}).verify(value) is None
+
+
+def test_key_rotation():
+    token, expiry = Session.generate_token(), utc_now() + timedelta(hours=1)
+    before = SessionSigner({"old": OLD_KEY}).sign(token, 1, expiry)
+    rotated = SessionSigner({"new": NEW_KEY, "old": OLD_KEY})
+
+    # Cookies signed with the previous key still verify, new ones use the new key
+    assert rotated.verify(before) is not None
+    assert rotated.sign(token, 1, expiry).startswith("s1.new.")
+
+
+def test_parse_keys():
+    assert parse_keys("") == {}
+    assert parse_keys(f"b:{'x' * 32}, a:{'y' * 32}") == {"b": b"x" * 32, "a": b"y" * 32}
+    assert create_signer("") is None
+    with pytest.raises(ValueError):
+        parse_keys("missing-separator")
+    with pytest.raises(ValueError):
+        create_signer("short:secret")
+    with pytest.raises(ValueError):
+        create_signer(f"bad.id:{'x' * 32}")
+
+
+def test_signed_login(signer, user):
+    with TestClient(app) as client:
+        response = client.post("/api/login", json={"email": user.email, "password": "password"})
+        assert response.status_code == status.HTTP_200_OK
+        cookie = client.cookies.get("session")
+        assert cookie.startswith("s1.new.")
+
+        claims = signer.verify(cookie)
+        assert claims is not None and claims.user_id == user.id
+        assert client.get("/api/session").json()["user"]["email"] == user.email
+
+        # Revocation still applies to validly signed cookies
+        assert client.post("/api/logout").status_code == status.HTTP_200_OK
+        client.cookies.set("session", cookie)
+        assert client.get("/api/session").status_code == status.HTTP_401_UNAUTHORIZED
+
+
+def test_signed_rejected_without_queries(signer, session):
+    forged = SessionSigner({"new": b"f" * 32}).sign(session.token, session.user_id, session.expiry)
+    expired = signer.sign(session.token, session.user_id, utc_now() - timedelta(minutes=1))
+    session_cache.invalidate(session.token)
+
+    with TestClient(app) as client:
+        for cookie in (forged, expired):
+            client.cookies.set("session", cookie)
+            with QueryCounter(get_db()) as counter:
+                response = client.get("/api/session")
+            assert response.status_code == status.HTTP_401_UNAUTHORIZED
+            assert counter.count == 0, counter.queries
+
+
+def test_both_formats_accepted(signer, session):
+    with TestClient(app) as client:
+        client.cookies.set("session", session.token)
+        assert client.get("/api/session").status_code == status.HTTP_200_OK
+
+        client.cookies.set("session", signer.sign(session.token, session.user_id, session.expiry))
+        assert client.get("/api/session").status_code == status.HTTP_200_OK
+
+        # Claims must match the session they name
+        client.cookies.set("session", signer.sign(session.token, session.user_id + 1, session.expiry))
+        assert client.get("/api/session").status_code == status.HTTP_401_UNAUTHORIZED
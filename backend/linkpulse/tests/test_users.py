@@ -0,0 +1,120 @@
+import csv
+import io
+import json
+from datetime import datetime
+
+import pytest
+from linkpulse.hashing import dummy_hash, hasher
+from linkpulse.models import User
+from linkpulse.tests.random import random_email
+from linkpulse.users import detect_format, export_users, import_users
+
+
+@pytest.fixture
+def emails():
+    emails = [random_email() for _ in range(3)]
+    yield emails
+    User.delete().where(User.email.in_(emails)).execute()
+
+
+def test_import_ndjson(emails):
+    existing = User.create(email=emails[2], password_hash=dummy_hash)
+    records = [
+        {"email": emails[0], "password": "password"},
+        {"email": emails[1], "password_hash": dummy_hash},
+        {"email": emails[0], "password": "repeated"},  # Repeated within the input
+        {"email": emails[2], "password": "password"},  # Already exists
+        {"email": "not-an-email", "password": "password"},
+        {"email": random_email(), "password_hash": "plaintext"},
+        {"email": random_email()},
+    ]
+    stream = io.StringIO("\n".join(json.dumps(record) for record in records) + "\n")
+
+    stats = import_users(stream, "ndjson", batch_size=2, workers=2)
+
+    # Existing users (including the one imported by the first batch) aren't hashed
+    assert (stats.read, stats.rejected, stats.hashed) == (7, 3, 1)
+    assert (stats.written, stats.duplicates) == (2, 2)
+    assert stats.rows_per_second > 0
+
+    imported = {user.email: user for user in User.select().where(User.email.in_(emails))}
+    assert hasher.verify("password", imported[emails[0]].password_hash)
+    assert imported[emails[1]].password_hash == dummy_hash
+    assert imported[emails[2]].password_hash == existing.password_hash
+
+
+def test_import_malformed(emails):
+    lines = [
+        json.dumps(
+            {"email": emails[0], "password_hash": dummy_hash, "created_at": "2024-01-02T03:04:05+01:00"}
+        ),
+        '{"email": "truncated@example.com", "pass',
+        json.dumps(["not", "an", "object"]),
+        json.dumps({"email": random_email(), "password_hash": dummy_hash, "created_at": "yesterday"}),
+        json.dumps({"email": random_email(), "password_hash": dummy_hash, "created_at": 1704164645}),
+        json.dumps({"email": emails[1], "password_hash": dummy_hash}),
+    ]
+
+    # Bad lines are rejected & counted, without ending the import
+    stats = import_users(io.StringIO("\n".join(lines)), "ndjson", batch_size=2)
+
+    assert (stats.read, stats.rejected, stats.written) == (6, 4, 2)
+    assert User.get(User.email == emails[0]).created_at == datetime(2024, 1, 2, 2, 4, 5)
+
+
+def test_import_rerun(emails):
+    lines = "\n".join(json.dumps({"email": email, "password": "password"}) for email in emails)
+    assert import_users(io.StringIO(lines), "ndjson").hashed == 3
+
+    # Re-running an interrupted import doesn't hash the users it already imported
+    stats = import_users(io.StringIO(lines), "ndjson")
+    assert (stats.written, stats.duplicates, stats.hashed) == (0, 3, 0)
+
+
+def test_import_csv_update(emails):
+    User.create(email=emails[0], password_hash=dummy_hash)
+    stream = io.StringIO(
+        f"email,password\n{emails[0]},changed\n{emails[1]},first\n{emails[1]},last\n{emails[2]},password\n"
+    )
+
+    stats = import_users(stream, "csv", on_duplicate="update")
+
+    assert (stats.written, stats.duplicates) == (3, 1)
+    assert hasher.verify("changed", User.get(User.email == emails[0]).password_hash)
+    # Within a batch, an email's last record wins, as it would across batches
+    assert hasher.verify("last", User.get(User.email == emails[1]).password_hash)
+
+
+def test_export_round_trip(emails):
+    for email in emails:
+        User.create(email=email, password_hash=dummy_hash)
+
+    ndjson = io.StringIO()
+    count = export_users(ndjson, "ndjson")
+    rows = [json.loads(line) for line in ndjson.getvalue().splitlines()]
+    assert count == len(rows)
+    exported = {row["email"]: row for row in rows if row["email"] in emails}
+    assert set(exported) == set(emails)
+    assert set(exported[emails[0]]) == {"email", "password_hash", "created_at"}
+    # JSON escapes survive the export untouched
+    assert exported[emails[0]]["password_hash"] == dummy_hash
+
+    exported_csv = io.StringIO()
+    export_users(exported_csv, "csv")
+    exported_csv.seek(0)
+    assert {row["email"] for row in csv.DictReader(exported_csv)} >= set(emails)
+
+    # An export imports as it is, without hashing; only the missing user is written
+    User.delete().where(User.email == emails[0]).execute()
+    lines = [line for line in ndjson.getvalue().splitlines() if json.loads(line)["email"] in emails]
+    stats = import_users(io.StringIO("\n".join(lines)), "ndjson")
+    assert (stats.written, stats.duplicates, stats.hashed) == (1, 2, 0)
+    assert User.get(User.email == emails[0]).password_hash == dummy_hash
+
+
+def test_detect_format():
+    assert detect_format("users.csv", None) == "csv"
+    assert detect_format("users.jsonl", None) == "ndjson"
+    assert detect_format("users.txt", "csv") == "csv"
+    with pytest.raises(ValueError):
+        detect_format("users.txt", None)
@@ -0,0 +1,125 @@
+"""tokens.py
+This module signs & verifies session cookies, so forged or expired ones are rejected without any I/O.
+
+A signed cookie embeds the session's token (its primary key in the `session` table), user id and expiry, followed by
+an HMAC-SHA256 signature:
+
+    s1.<key id>.<token>.<user id>.<expiry, unix seconds>.<signature, base64url>
+
+The `session` table remains the source of truth: a cookie that passes the signature & expiry checks is still looked up
+(in the session cache, or the database) to catch revoked sessions. Only the lookups for invalid cookies are skipped.
+
+Signing keys come from `SESSION_SIGNING_KEYS`, a comma-separated list of `<key id>:<secret>` pairs. The first key signs
+new cookies; the rest only verify, so a key can be rotated by prepending a new one & removing the old one once the
+cookies it signed have expired. Without any keys, cookies are the plain 32-character token, as before. Both formats
+are always accepted, so sessions survive enabling (or rotating) signing.
+"""
+
+import base64
+import hashlib
+import hmac
+import os
+import re
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+PREFIX = "s1"
+KEY_ID = re.compile(r"^[A-Za-z0-9_-]{1,16}$")
+
+
+@dataclass(frozen=True, slots=True)
+class SignedSession:
+    """
+    The claims of a verified session cookie.
+    """
+
+    token: str
+    user_id: int
+    expiry: datetime
+
+
+class SessionSigner:
+    """
+    Signs & verifies session cookies with a set of HMAC keys, the first of which signs.
+    """
+
+    def __init__(self, keys: Dict[str, bytes]):
+        """
+        :param keys: Secrets by key id, in order of preference; the first signs new cookies.
+        """
+        if not keys:
+            raise ValueError("At least one signing key is required")
+        for key_id, secret in keys.items():
+            if KEY_ID.match(key_id) is None:
+                raise ValueError(f"Invalid signing key id: {key_id!r}")
+            if len(secret) < 32:
+                raise ValueError(f"Signing key {key_id!r} must be at least 32 bytes")
+
+        self.keys = keys
+        self.active = next(iter(keys))
+
+    @staticmethod
+    def _signature(secret: bytes, payload: str) -> str:
+        digest = hmac.new(secret, payload.encode(), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+    def sign(self, token: str, user_id: int, expiry: datetime) -> str:
+        """
+        Produce the cookie value for a session.
+        """
+        timestamp = int(expiry.replace(tzinfo=expiry.tzinfo or timezone.utc).timestamp())
+        payload = f"{PREFIX}.{self.active}.{token}.{user_id}.{timestamp}"
+        return f"{payload}.{self._signature(self.keys[self.active], payload)}"
+
+    def verify(self, value: str, now: Optional[datetime] = None) -> Optional[SignedSession]:
+        """
+        Verify a signed cookie's signature & expiry.
+
+        :return: The session's claims, or None if the cookie is malformed, signed by an unknown key, forged or expired.
+        """
+        parts = value.split(".")
+        if len(parts) != 6 or parts[0] != PREFIX:
+            return None
+
+        _, key_id, token, user_id, timestamp, signature = parts
+        secret = self.keys.get(key_id)
+        if secret is None or not user_id.isdigit() or not timestamp.isdigit():
+            return None
+
+        expected = self._signature(secret, value.rpartition(".")[0])
+        if not hmac.compare_digest(expected, signature):
+            return None
+
+        expiry = datetime.fromtimestamp(int(timestamp), tz=timezone.utc)
+        if expiry <= (now or datetime.now(timezone.utc)):
+            return None
+        return SignedSession(token=token, user_id=int(user_id), expiry=expiry)
+
+
+def is_signed(value: str) -> bool:
+    return value.startswith(PREFIX + ".")
+
+
+def parse_keys(value: str) -> Dict[str, bytes]:
+    """
+    Parse `SESSION_SIGNING_KEYS`, e.g. `2024b:<secret>,2024a:<secret>`.
+    """
+    keys: Dict[str, bytes] = {}
+    for entry in filter(None, (entry.strip() for entry in value.split(","))):
+        key_id, separator, secret = entry.partition(":")
+        if not separator:
+            raise ValueError("Signing keys must be formatted as <key id>:<secret>")
+        keys[key_id] = secret.encode()
+    return keys
+
+
+def create_signer(value: Optional[str] = None) -> Optional[SessionSigner]:
+    """
+    Create the signer configured by `value`, defaulting to `SESSION_SIGNING_KEYS`; None if no keys are configured.
+    """
+    keys = parse_keys(os.getenv("SESSION_SIGNING_KEYS", "") if value is None else value)
+    return SessionSigner(keys) if keys else None
+
+
+session_signer = create_signer()
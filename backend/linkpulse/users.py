@@ -0,0 +1,335 @@
+"""users.py
+This module imports & exports users in bulk, streaming through Postgres `COPY` in constant memory.
+
+Usage:
+    python -m linkpulse users export [--format ndjson|csv] [--output PATH]
+    python -m linkpulse users import PATH [--format ndjson|csv] [--batch-size N] [--workers N] [--on-duplicate skip|update]
+
+Records have an `email` and either a plaintext `password` or a pre-computed Argon2 `password_hash`, plus an optional
+ISO 8601 `created_at`; exports have the same shape (with hashes), so they can be imported elsewhere. `-` reads from
+stdin or writes to stdout, and the format is taken from the file extension unless given.
+
+Imports run in batches. Plaintext passwords are hashed in parallel on a thread pool (argon2-cffi releases the GIL), then
+each batch is copied into a temporary staging table and merged into `user` with a single `INSERT ... ON CONFLICT`, so
+duplicate emails (already present, or repeated in the input) never raise per-row errors. Each batch commits on its
+own, so an interrupted import can be re-run: users already imported count as duplicates, and with `--on-duplicate
+skip` their passwords aren't hashed again. An email repeated within the input keeps its first record with `skip`, and
+its last with `update`, as if each record were imported in turn.
+"""
+
+import argparse
+import csv
+import io
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from dataclasses import asdict, dataclass
+from functools import partial
+from datetime import datetime, timezone
+from typing import IO, Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+import structlog
+from linkpulse.hashing import get_hasher
+from linkpulse.utilities import get_db
+
+logger = structlog.get_logger()
+
+FORMATS = ("ndjson", "csv")
+# Matches the `user` table's column sizes
+MAX_EMAIL_LENGTH = 45
+MAX_HASH_LENGTH = 97
+# Rejected records are counted; only the first few are logged individually
+LOGGED_REJECTIONS = 10
+
+EXPORT_QUERY = 'SELECT email, password_hash, created_at FROM "user" WHERE deleted_at IS NULL ORDER BY id'
+
+STAGING_TABLE = """
+CREATE TEMPORARY TABLE IF NOT EXISTS user_import (
+    ordinal INTEGER NOT NULL,
+    email TEXT NOT NULL,
+    password_hash TEXT NOT NULL,
+    created_at TIMESTAMP
+) ON COMMIT DELETE ROWS
+"""
+
+MERGE = """
+INSERT INTO "user" (email, password_hash, flags, created_at, updated_at)
+SELECT DISTINCT ON (email) email, password_hash, 0, COALESCE(created_at, %(now)s), %(now)s
+FROM user_import
+ORDER BY email, ordinal {order}
+ON CONFLICT (email) DO {action}
+"""
+
+# The action taken on existing users, and which of an email's records in a batch is kept: the first, or the last
+ON_DUPLICATE = {
+    "skip": ("NOTHING", "ASC"),
+    "update": ("UPDATE SET password_hash = EXCLUDED.password_hash, updated_at = EXCLUDED.updated_at", "DESC"),
+}
+
+
+@dataclass
+class ImportStats:
+    read: int = 0
+    rejected: int = 0
+    hashed: int = 0
+    # Inserted, or updated with `--on-duplicate update`
+    written: int = 0
+    duplicates: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        return round(self.read / self.elapsed, 1) if self.elapsed > 0 else 0.0
+
+
+def detect_format(path: str, format: Optional[str]) -> str:
+    if format is not None:
+        return format
+    if path.endswith(".csv"):
+        return "csv"
+    if path.endswith((".ndjson", ".jsonl")):
+        return "ndjson"
+    raise ValueError(f"Can't tell the format of {path!r}, use --format")
+
+
+@dataclass(frozen=True)
+class Unreadable:
+    """
+    A line that couldn't be parsed, rejected like an invalid record.
+    """
+
+    reason: str
+
+
+def read_records(file: IO[str], format: str) -> Iterator[Union[Dict[str, Any], Unreadable]]:
+    if format == "csv":
+        yield from csv.DictReader(file)
+        return
+    for line in file:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError as exc:
+                yield Unreadable(f"invalid JSON: {exc}")
+
+
+def _parse_created_at(value: str) -> str:
+    """
+    Parse an ISO 8601 `created_at`, normalized to naive UTC like `utc_now` values.
+    """
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed.isoformat(sep=" ")
+
+
+def _validate(record: Any) -> Optional[str]:
+    """
+    :return: Why the record can't be imported, or None if it can.
+    """
+    if isinstance(record, Unreadable):
+        return record.reason
+    if not isinstance(record, dict):
+        return "not an object"
+
+    email = record.get("email")
+    if not isinstance(email, str) or "@" not in email or len(email) > MAX_EMAIL_LENGTH:
+        return "invalid email"
+
+    password_hash = record.get("password_hash")
+    if password_hash:
+        if not isinstance(password_hash, str) or len(password_hash) > MAX_HASH_LENGTH:
+            return "invalid password_hash, expected an Argon2 hash"
+        if not password_hash.startswith("$argon2"):
+            return "invalid password_hash, expected an Argon2 hash"
+    elif not record.get("password") or not isinstance(record["password"], str):
+        return "missing password or password_hash"
+
+    created_at = record.get("created_at")
+    if created_at:
+        if not isinstance(created_at, str):
+            return "invalid created_at, expected an ISO 8601 timestamp"
+        try:
+            _parse_created_at(created_at)
+        except ValueError:
+            return "invalid created_at, expected an ISO 8601 timestamp"
+    return None
+
+
+def existing_emails(cursor: Any, emails: List[str]) -> Set[str]:
+    cursor.execute('SELECT email FROM "user" WHERE email = ANY(%s)', (emails,))
+    return {email for (email,) in cursor.fetchall()}
+
+
+def prepare_batch(
+    records: Iterable[Any],
+    executor: ThreadPoolExecutor,
+    stats: ImportStats,
+    existing: Optional[Callable[[List[str]], Set[str]]] = None,
+) -> List[Tuple[int, str, str, Optional[str]]]:
+    """
+    Validate a batch of records & hash their plaintext passwords in parallel.
+
+    :param existing: Looks up which of the batch's emails already exist; their records are skipped as duplicates,
+        without hashing. Only for imports that keep existing users.
+    :return: (ordinal, email, password hash, created_at) rows, ready to copy into the staging table.
+    """
+    valid: List[Dict[str, Any]] = []
+    for record in records:
+        stats.read += 1
+        reason = _validate(record)
+        if reason is not None:
+            stats.rejected += 1
+            if stats.rejected <= LOGGED_REJECTIONS:
+                email = record.get("email") if isinstance(record, dict) else None
+                logger.warning("Rejected record", record=stats.read, email=email, reason=reason)
+            continue
+        valid.append(record)
+
+    if existing is not None and valid:
+        found = existing([record["email"] for record in valid])
+        stats.duplicates += sum(record["email"] in found for record in valid)
+        valid = [record for record in valid if record["email"] not in found]
+
+    plaintext = [record["password"] for record in valid if not record.get("password_hash")]
+    hashes = iter(executor.map(get_hasher().hash, plaintext))
+    stats.hashed += len(plaintext)
+
+    return [
+        (
+            ordinal,
+            record["email"],
+            record.get("password_hash") or next(hashes),
+            _parse_created_at(record["created_at"]) if record.get("created_at") else None,
+        )
+        for ordinal, record in enumerate(valid)
+    ]
+
+
+def _copy_rows(cursor: Any, rows: List[Tuple[int, str, str, Optional[str]]]) -> None:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    cursor.copy_expert(
+        "COPY user_import (ordinal, email, password_hash, created_at) FROM STDIN WITH (FORMAT csv)", buffer
+    )
+
+
+def import_users(
+    file: IO[str],
+    format: str,
+    batch_size: int = 5000,
+    workers: Optional[int] = None,
+    on_duplicate: str = "skip",
+) -> ImportStats:
+    """
+    Import users from an NDJSON or CSV stream, committing each batch.
+    """
+    if batch_size < 1:
+        raise ValueError("batch_size must be positive")
+    action, order = ON_DUPLICATE[on_duplicate]
+    merge = MERGE.format(action=action, order=order)
+
+    db = get_db()
+    stats = ImportStats()
+    start = time.perf_counter()
+
+    with db.connection_context(), ThreadPoolExecutor(
+        max_workers=workers or os.cpu_count() or 1, thread_name_prefix="import-hash"
+    ) as executor:
+        cursor = db.connection().cursor()
+        cursor.execute(STAGING_TABLE)
+        existing = partial(existing_emails, cursor) if on_duplicate == "skip" else None
+        try:
+            for records in itertools.batched(read_records(file, format), batch_size):
+                rows = prepare_batch(records, executor, stats, existing)
+                if not rows:
+                    continue
+
+                with db.atomic():
+                    _copy_rows(cursor, rows)
+                    # Timestamps are stored as naive UTC, like `utc_now` values
+                    cursor.execute(merge, {"now": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())})
+                    written = cursor.rowcount
+
+                stats.written += written
+                stats.duplicates += len(rows) - written
+                stats.elapsed = time.perf_counter() - start
+                logger.info("Imported batch", **asdict(stats), rows_per_second=stats.rows_per_second)
+        finally:
+            # The connection goes back to the pool
+            cursor.execute("DROP TABLE IF EXISTS user_import")
+
+    stats.elapsed = time.perf_counter() - start
+    return stats
+
+
+def export_users(file: IO[str], format: str) -> int:
+    """
+    Export every user that isn't deleted, in `id` order.
+
+    :return: The number of users exported.
+    """
+    if format == "csv":
+        sql = f"COPY ({EXPORT_QUERY}) TO STDOUT WITH (FORMAT csv, HEADER)"
+    else:
+        # Text format would escape the JSON's backslashes; CSV with quote & delimiter characters that can't
+        # appear in JSON output passes each row through untouched
+        sql = (
+            f"COPY (SELECT row_to_json(u) FROM ({EXPORT_QUERY}) u) TO STDOUT"
+            " WITH (FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02')"
+        )
+
+    db = get_db()
+    with db.connection_context():
+        cursor = db.connection().cursor()
+        cursor.copy_expert(sql, file)
+        return cursor.rowcount
+
+
+def main(*args: str) -> Dict[str, Any]:
+    parser = argparse.ArgumentParser(prog="linkpulse users", description="Import or export users in bulk.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="Export users")
+    export.add_argument(
+        "--format", choices=FORMATS, default=None, help="Output format (default: from the path)"
+    )
+    export.add_argument("--output", default="-", help="Output path, or - for stdout (default)")
+
+    load = commands.add_parser("import", help="Import users")
+    load.add_argument("path", help="Input path, or - for stdin")
+    load.add_argument("--format", choices=FORMATS, default=None, help="Input format (default: from the path)")
+    load.add_argument("--batch-size", type=int, default=5000, help="Records per batch (default: 5000)")
+    load.add_argument("--workers", type=int, default=None, help="Hashing threads (default: CPU count)")
+    load.add_argument(
+        "--on-duplicate",
+        choices=tuple(ON_DUPLICATE),
+        default="skip",
+        help="Keep existing users (skip, default) or replace their password hash (update)",
+    )
+    options = parser.parse_args(args)
+
+    if options.command == "export":
+        path = options.output
+        format = options.format or ("ndjson" if path == "-" else detect_format(path, None))
+        start = time.perf_counter()
+        with nullcontext(sys.stdout) if path == "-" else open(path, "w", newline="") as file:
+            count = export_users(file, format)
+        elapsed = time.perf_counter() - start
+        summary = {"exported": count, "elapsed": round(elapsed, 3)}
+        summary["rows_per_second"] = round(count / elapsed, 1) if elapsed > 0 else 0.0
+        logger.info("Export complete", **summary)
+        return summary
+
+    path = options.path
+    format = options.format or ("ndjson" if path == "-" else detect_format(path, None))
+    with nullcontext(sys.stdin) if path == "-" else open(path, newline="") as file:
+        stats = import_users(file, format, options.batch_size, options.workers, options.on_duplicate)
+    summary = {**asdict(stats), "elapsed": round(stats.elapsed, 3), "rows_per_second": stats.rows_per_second}
+    logger.info("Import complete", **summary)
+    return summary